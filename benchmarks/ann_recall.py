@@ -0,0 +1,94 @@
+"""IVF recall-vs-exact report on synthetic embeddings (no API key needed).
+
+    python benchmarks/ann_recall.py --rows 200000 --dim 256 --nprobe 4 8 16 32 64
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from memolla.models import ChunkRecord
+from memolla.vectors import IVFVectorIndex, NumpyVectorIndex
+
+
+def synthetic(rng: np.random.Generator, rows: int, dim: int, clusters: int, spread: float) -> np.ndarray:
+    # 混合ガウス (埋め込みのトピック構造の近似) / Gaussian mixture as a stand-in for topical embeddings
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    return (centers[labels] + spread * rng.normal(size=(rows, dim))).astype(np.float32)
+
+
+def fill(index: NumpyVectorIndex, data: np.ndarray, batch: int = 20000) -> float:
+    started = time.perf_counter()
+    for start in range(0, len(data), batch):
+        part = data[start : start + batch]
+        chunks = [ChunkRecord(f"c{start + i}", "bench", start + i, "") for i in range(len(part))]
+        index.add_embeddings(chunks, part)
+    return time.perf_counter() - started
+
+
+def timed_search(index: NumpyVectorIndex, queries: np.ndarray, top_k: int, **kwargs) -> tuple[List[set], float]:
+    # 1 クエリずつ実行して平均レイテンシを測る / Per-query latency, as Memory.search issues them
+    hits: List[set] = []
+    started = time.perf_counter()
+    for q in queries:
+        hits.append({cid for cid, _ in index.search_by_vectors([q], top_k, **kwargs)[0]})
+    return hits, (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--dtype", default="float32", choices=("float32", "float16", "int8"))
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = synthetic(rng, args.rows + args.queries, args.dim, args.clusters, args.spread)
+    data, queries = data[: args.rows], data[args.rows :]
+    workdir = Path(tempfile.mkdtemp(prefix="memolla-ann-"))
+    try:
+        flat = NumpyVectorIndex(base_dir=workdir / "flat", embedding=None, dtype=args.dtype)  # type: ignore[arg-type]
+        ivf = IVFVectorIndex(base_dir=workdir / "ivf", embedding=None, dtype=args.dtype, nlist=args.nlist)  # type: ignore[arg-type]
+        fill(flat, data)
+        build_s = fill(ivf, data)
+        exact, exact_ms = timed_search(flat, queries, args.top_k)
+        state = ivf._ivf
+        report = {
+            "rows": args.rows,
+            "dim": args.dim,
+            "dtype": args.dtype,
+            "nlist": len(state.centroids) if state is not None else 0,
+            "ivf_build_s": round(build_s, 2),
+            "exact_ms": round(exact_ms, 3),
+            "runs": [],
+        }
+        print(f"rows={args.rows} dim={args.dim} dtype={args.dtype} nlist={report['nlist']} build={build_s:.1f}s")
+        print(f"exact       : recall@{args.top_k}=1.000  {exact_ms:7.3f} ms/query")
+        for nprobe in args.nprobe:
+            hits, ms = timed_search(ivf, queries, args.top_k, nprobe=nprobe)
+            recall = float(np.mean([len(h & e) / max(1, len(e)) for h, e in zip(hits, exact)]))
+            report["runs"].append({"nprobe": nprobe, "recall": round(recall, 4), "ms": round(ms, 3)})
+            print(f"nprobe={nprobe:<5}: recall@{args.top_k}={recall:.3f}  {ms:7.3f} ms/query  ({exact_ms / ms:.1f}x)")
+        if args.output:
+            Path(args.output).write_text(json.dumps(report, indent=2))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Cold-start benchmark: import time, Memory() construction and time-to-first-search.
+
+Each measurement runs in a fresh interpreter so module caches do not carry over.
+
+    python benchmarks/cold_start.py --modes bm25 bm25,chroma bm25,numpy --runs 5
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# 子プロセスで実行する計測コード / Measurement code run in a child interpreter
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import memolla
+imported = time.perf_counter()
+mem = memolla.Memory(db_path=sys.argv[1], search_modes=sys.argv[2].split(","))
+constructed = time.perf_counter()
+mem.search("alpha topic7", 5)
+searched = time.perf_counter()
+heavy = [m for m in ("chromadb", "openai", "bm25s") if m in sys.modules]
+mem.close()
+print(json.dumps({
+    "import_s": imported - started,
+    "init_s": constructed - imported,
+    "first_search_s": searched - constructed,
+    "total_s": searched - started,
+    "modules": heavy,
+}))
+"""
+
+_SEED = """
+import sys
+import memolla
+mem = memolla.Memory(db_path=sys.argv[1], search_modes=sys.argv[2].split(","))
+for i in range(int(sys.argv[3])):
+    mem.add_knowledge(f"doc{i}", f"alpha topic{i % 50} " + " ".join(f"w{(i * 7 + j) % 997}" for j in range(80)))
+mem.close()
+"""
+
+
+def run(code: str, *args: str) -> str:
+    # 計測対象と同じ環境変数で実行 (API キーが無ければローカルのフォールバック) / Inherit the caller's environment
+    out = subprocess.run([sys.executable, "-c", code, *args], check=True, capture_output=True, text=True)
+    return out.stdout.strip().splitlines()[-1] if out.stdout.strip() else ""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["bm25", "bm25,chroma", "bm25,numpy"])
+    parser.add_argument("--docs", type=int, default=1000, help="documents stored before measuring")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="memolla-cold-"))
+    report = {"python": sys.version.split()[0], "docs": args.docs, "runs": args.runs, "modes": {}}
+    try:
+        for mode in args.modes:
+            db_path = str(workdir / mode.replace(",", "_") / "db.sqlite")
+            run(_SEED, db_path, mode, str(args.docs))
+            samples = [json.loads(run(_PROBE, db_path, mode)) for _ in range(args.runs)]
+            summary = {
+                key: round(statistics.median(s[key] for s in samples), 4)
+                for key in ("import_s", "init_s", "first_search_s", "total_s")
+            }
+            summary["modules"] = samples[-1]["modules"]
+            report["modes"][mode] = summary
+            print(
+                f"{mode:<14} import={summary['import_s']:.3f}s init={summary['init_s']:.3f}s "
+                f"first_search={summary['first_search_s']:.3f}s total={summary['total_s']:.3f}s "
+                f"loaded={','.join(summary['modules']) or '-'}"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Offline benchmark suite: ingest throughput, search latency, hydration cost, index load time and peak RSS.
+
+Runs without network access: the OpenAI key is removed from the child environment, so embeddings use the
+local hashing embedder. Each (language, size, mode) case ingests into a fresh store in one child process and measures
+search in a second one, so load time and peak RSS are per phase.
+
+    python benchmarks/suite.py --sizes 1000 10000 --langs en ja --modes bm25 chroma hybrid --output results.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+# ベンチマーク名 → Memory の search_modes / Benchmark mode name -> Memory search_modes
+MODES: Dict[str, List[str]] = {
+    "bm25": ["bm25"],
+    "chroma": ["chroma"],
+    "hybrid": ["bm25", "chroma"],
+    "numpy": ["numpy"],
+    "hybrid-numpy": ["bm25", "numpy"],
+    "ivf": ["ivf"],
+}
+
+_EN_WORDS = (
+    "memory search index vector token query result score model cache chunk document session summary agent "
+    "context retrieval ranking latency storage segment embedding corpus sentence language system update "
+    "delete stream batch cluster graph network signal window buffer thread process record table column"
+).split()
+_JA_WORDS = (
+    "記憶 検索 索引 ベクトル 単語 質問 結果 得点 模型 キャッシュ 断片 文書 会話 要約 代理 文脈 取得 順位 遅延 保存 "
+    "区間 埋め込み 資料 文章 言語 仕組み 更新 削除 流れ 一括 集団 図表 通信 信号 窓 緩衝 処理 記録 表 列"
+).split()
+
+
+def _words(lang: str, count: int, rng: random.Random) -> List[str]:
+    # 語彙を合成して語彙数を増やす (長い裾を持つ分布) / Compound words for a long-tailed vocabulary
+    base = _EN_WORDS if lang == "en" else _JA_WORDS
+    vocab = base + [a + b for a in base[:24] for b in base[:24]]
+    weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+    return rng.choices(vocab, weights=weights, k=count)
+
+
+def _phrases(lang: str, count: int, rng: random.Random) -> List[str]:
+    # 日本語は 1〜2 語の句を読点で区切る (BM25 のトークナイザは分かち書きしないため) / Japanese: short 、-separated phrases
+    words = _words(lang, count, rng)
+    if lang == "en":
+        return words
+    phrases, i = [], 0
+    while i < len(words):
+        step = rng.randint(1, 2)
+        phrases.append("".join(words[i : i + step]))
+        i += step
+    return phrases
+
+
+def make_corpus(lang: str, size: int, *, words_per_doc: int = 180, seed: int = 0) -> List[str]:
+    rng = random.Random(f"{lang}:{seed}")
+    sep, end = (" ", ". ") if lang == "en" else ("、", "。")
+    docs = []
+    for _ in range(size):
+        phrases = _phrases(lang, words_per_doc, rng)
+        sentences = [sep.join(phrases[i : i + 8]) for i in range(0, len(phrases), 8)]
+        docs.append(end.join(sentences) + end.strip())
+    return docs
+
+
+def make_queries(lang: str, count: int, *, seed: int = 1) -> List[str]:
+    rng = random.Random(f"{lang}:q:{seed}")
+    return [" ".join(_phrases(lang, rng.randint(2, 4), rng)) for _ in range(count)]
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # pragma: no cover - Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KiB、macOS はバイト / KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _percentiles(samples: Sequence[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    mean = round(statistics.fmean(ordered) * 1000, 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": mean}
+
+
+def phase_ingest(args: argparse.Namespace) -> Dict[str, Any]:
+    from memolla import Memory
+
+    docs = make_corpus(args.lang, args.size)
+    mem = Memory(db_path=args.db, search_modes=MODES[args.mode])
+    started = time.perf_counter()
+    for i, text in enumerate(docs):
+        mem.add_knowledge(f"doc{i}", text, {"lang": args.lang, "bucket": i % 10})
+    elapsed = time.perf_counter() - started
+    mem.close()
+    return {
+        "docs": len(docs),
+        "chars": sum(map(len, docs)),
+        "ingest_s": round(elapsed, 3),
+        "docs_per_s": round(len(docs) / elapsed, 1),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def phase_search(args: argparse.Namespace) -> Dict[str, Any]:
+    started = time.perf_counter()
+    from memolla import Memory
+
+    imported = time.perf_counter()
+    mem = Memory(db_path=args.db, search_modes=MODES[args.mode])
+    # 遅延生成されるインデックスをここで読み込ませる / Force the lazily built indexes to load
+    if "lexical" in mem.search_modes:
+        mem.bm25_index
+    if "vector" in mem.search_modes:
+        mem.dense_index
+    loaded = time.perf_counter()
+    queries = make_queries(args.lang, args.queries + args.warmup)
+    for query in queries[: args.warmup]:
+        mem.search(query, args.top_k)
+    latencies = []
+    for query in queries[args.warmup :]:
+        t = time.perf_counter()
+        mem.search(query, args.top_k)
+        latencies.append(time.perf_counter() - t)
+
+    # 本文の復元 (LRU を空にした状態と温まった状態) / Chunk hydration with a cold and a warm LRU
+    rng = random.Random(0)
+    batch = args.top_k * mem.fanout
+    cold, warm = [], []
+    for _ in range(args.queries):
+        ids = [f"doc{rng.randrange(args.size)}:0" for _ in range(batch)]
+        mem._chunk_cache.clear()
+        t = time.perf_counter()
+        mem._hydrate(ids)
+        cold.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        mem._hydrate(ids)
+        warm.append(time.perf_counter() - t)
+    mem.close()
+    return {
+        "import_s": round(imported - started, 3),
+        "index_load_s": round(loaded - imported, 3),
+        "search": _percentiles(latencies),
+        "hydrate_cold": _percentiles(cold),
+        "hydrate_warm": _percentiles(warm),
+        "hydrate_batch": batch,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _child(phase: str, lang: str, size: int, mode: str, db: str, args: argparse.Namespace) -> Dict[str, Any]:
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY" and not k.startswith("MEMOLLA_")}
+    cmd = [
+        sys.executable,
+        __file__,
+        "--phase", phase,
+        "--lang", lang,
+        "--size", str(size),
+        "--mode", mode,
+        "--db", db,
+        "--queries", str(args.queries),
+        "--warmup", str(args.warmup),
+        "--top-k", str(args.top_k),
+    ]  # fmt: skip
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True, env=env)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--langs", nargs="+", default=["en", "ja"], choices=("en", "ja"))
+    parser.add_argument("--modes", nargs="+", default=["bm25", "chroma", "hybrid"], choices=tuple(MODES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--output", default="benchmark-results.json")
+    # 子プロセス用 / Used by the child processes
+    parser.add_argument("--phase", choices=("ingest", "search"), help=argparse.SUPPRESS)
+    parser.add_argument("--lang", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        result = phase_ingest(args) if args.phase == "ingest" else phase_search(args)
+        print(json.dumps(result))
+        return
+
+    report: Dict[str, Any] = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"queries": args.queries, "warmup": args.warmup, "top_k": args.top_k},
+        "results": [],
+    }
+    workdir = Path(tempfile.mkdtemp(prefix="memolla-bench-"))
+    try:
+        for lang in args.langs:
+            for size in args.sizes:
+                for mode in args.modes:
+                    db = str(workdir / f"{lang}-{size}-{mode}" / "db.sqlite")
+                    ingest = _child("ingest", lang, size, mode, db, args)
+                    search = _child("search", lang, size, mode, db, args)
+                    case = {"lang": lang, "size": size, "mode": mode, "ingest": ingest, "search": search}
+                    report["results"].append(case)
+                    print(
+                        f"{lang} {size:>7} {mode:<12} ingest {ingest['docs_per_s']:>8.1f} docs/s  "
+                        f"search p50/p95/p99 {search['search']['p50_ms']:.2f}/{search['search']['p95_ms']:.2f}/"
+                        f"{search['search']['p99_ms']:.2f} ms  hydrate {search['hydrate_cold']['p50_ms']:.2f} ms  "
+                        f"load {search['index_load_s']:.3f}s  rss {ingest['peak_rss_mb']}/{search['peak_rss_mb']} MB",
+                        flush=True,
+                    )
+                    shutil.rmtree(Path(db).parent, ignore_errors=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
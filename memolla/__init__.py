@@ -1,9 +1,15 @@
+from .async_memory import AsyncMemory
 from .memory import Memory
 from .models import (
     ChunkRecord,
     DocumentRecord,
+    FusionReport,
+    IngestReport,
     MessageRecord,
+    RerankReport,
     SearchResult,
+    SessionSummary,
+    StageEvent,
     EvalMetrics,
     TrialConfig,
     TrialResult,
@@ -11,11 +17,17 @@ from .models import (
 )
 
 __all__ = [
+    "AsyncMemory",
     "Memory",
     "ChunkRecord",
     "DocumentRecord",
+    "FusionReport",
+    "IngestReport",
     "MessageRecord",
+    "RerankReport",
     "SearchResult",
+    "SessionSummary",
+    "StageEvent",
     "EvalMetrics",
     "TrialConfig",
     "TrialResult",
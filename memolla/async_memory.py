@@ -0,0 +1,409 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import logging
+import time
+from datetime import datetime
+from typing import AbstractSet, Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .filters import normalize_where
+from .fusion import ThresholdFusion
+from .indexes import BM25Index
+from .memory import Memory
+from .models import (
+    ChunkRecord,
+    DocumentRecord,
+    IngestReport,
+    MessageRecord,
+    OptimizeResult,
+    SearchResult,
+    SessionSummary,
+)
+from .providers import AsyncEmbeddingProvider, AsyncLLMProvider, build_async_client
+from .summarize import AsyncMapReduceSummarizer
+from .vectors import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMemory:
+    """
+    Memory の asyncio 版 / asyncio facade over Memory.
+    SQLite・BM25 の処理はスレッドへ逃がし、Embedding / LLM 呼び出しは AsyncOpenAI で行う。
+    引数・戻り値・エラーコードは Memory と同一。
+    """
+
+    def __init__(
+        self,
+        *,
+        db_path: str | None = None,
+        search_modes: Sequence[str] | str = ("bm25", "chroma"),
+        blend_alpha: float = 0.5,
+        fanout: int = 2,
+        rerank_mode: str = "normalized-score",
+        **backend_options: Any,
+    ) -> None:
+        self._memory = Memory(
+            db_path=db_path,
+            search_modes=search_modes,
+            blend_alpha=blend_alpha,
+            fanout=fanout,
+            rerank_mode=rerank_mode,
+            **backend_options,
+        )
+        settings = self._memory.provider_settings
+        self._client = build_async_client(settings.api_key, settings.base_url)
+        self.embedding = AsyncEmbeddingProvider(
+            client=self._client,
+            model=settings.embedding_model,
+            cache=self._memory.embedding.cache,
+            # 同期版とレート制限を共有する / Share rate limits with the sync provider
+            scheduler=self._memory.embedding.scheduler,
+            local=self._memory.embedding.local,
+        )
+        self.llm = AsyncLLMProvider(client=self._client, model=settings.model)
+        # 同期版と要約キャッシュ・設定を共有する / Share the summary cache and settings with the sync side
+        sync = self._memory.summarizer
+        self.summarizer = AsyncMapReduceSummarizer(
+            self.llm, cache=sync.cache, concurrency=sync.concurrency, fan_in=sync.fan_in, max_tokens=sync.max_tokens
+        )
+
+    @classmethod
+    async def create(cls, **kwargs: Any) -> "AsyncMemory":
+        # 初期化 (SQLite / インデックス読み込み) もイベントループ外で行う / Construct off-loop
+        return await asyncio.to_thread(lambda: cls(**kwargs))
+
+    @property
+    def memory(self) -> Memory:
+        return self._memory
+
+    async def __aenter__(self) -> "AsyncMemory":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await asyncio.to_thread(self._memory.close)
+        # 一度も使われていないクライアントは生成せずに済ませる / Never build a client just to close it
+        if self._client is not None and getattr(self._client, "built", True):
+            await self._client.close()
+
+    # 会話ログ追加 / add conversation log
+    async def add_conversation(
+        self,
+        session_id: str,
+        role: str,
+        content: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        ts: Optional[datetime] = None,
+    ) -> None:
+        await asyncio.to_thread(self._memory.add_conversation, session_id, role, content, metadata, ts)
+
+    # ナレッジ追加 / add knowledge
+    async def add_knowledge(
+        self,
+        doc_id: str,
+        text: str,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        chunks = await asyncio.to_thread(self._memory._store_document, doc_id, text, metadata)
+        await self._index_chunks(chunks)
+
+    # ナレッジ更新 / update knowledge
+    async def update_knowledge(
+        self,
+        doc_id: str,
+        text: str,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> DocumentRecord:
+        mem = self._memory
+        doc, new_chunks, kept, _ = await asyncio.to_thread(mem._store_update, doc_id, text, metadata)
+        await self._index_chunks(new_chunks)
+        (dense_index,) = await self._ensure_indexes("dense_index")
+        if kept and dense_index:
+            metadatas = await asyncio.to_thread(mem._chunk_metadatas, kept)
+            await asyncio.to_thread(dense_index.update_metadata, [c.chunk_id for c in kept], metadatas)
+        return doc
+
+    # ナレッジ削除 / delete knowledge
+    async def delete_knowledge(self, doc_id: str) -> None:
+        await asyncio.to_thread(self._memory.delete_knowledge, doc_id)
+
+    async def compact(self) -> int:
+        return await asyncio.to_thread(self._memory.compact)
+
+    # ナレッジ一括追加 / bulk add knowledge
+    async def add_knowledge_many(
+        self,
+        items: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]],
+        *,
+        batch_size: int = 256,
+        skip_existing: bool = False,
+    ) -> IngestReport:
+        if batch_size <= 0:
+            raise ValueError("[mem][E004] batch_size must be positive")
+        mem = self._memory
+        started = time.perf_counter()
+        total_docs = total_chunks = skipped = 0
+        for batch, duplicates in mem._iter_batches(items, batch_size, skip_existing):
+            records, existing = await asyncio.to_thread(mem._store_batch, batch, skip_existing)
+            skipped += duplicates + existing
+            chunks = [c for _, doc_chunks in records for c in doc_chunks]
+            await self._index_chunks(chunks)
+            total_docs += len(records)
+            total_chunks += len(chunks)
+        return mem._ingest_report(started, total_docs, total_chunks, skipped)
+
+    # ナレッジのストリーム登録 / streaming knowledge ingestion
+    async def add_knowledge_stream(
+        self,
+        doc_id: str,
+        source: Any,
+        metadata: Optional[Dict[str, Any]] = None,
+        *,
+        batch_chunks: int = 256,
+        encoding: str = "utf-8",
+    ) -> IngestReport:
+        # ファイル読み込みを含め全体をスレッドで実行 / Run the whole (blocking) stream in a worker thread
+        return await asyncio.to_thread(
+            self._memory.add_knowledge_stream,
+            doc_id,
+            source,
+            metadata,
+            batch_chunks=batch_chunks,
+            encoding=encoding,
+        )
+
+    async def _index_chunks(self, chunks: List[ChunkRecord]) -> None:
+        if not chunks:
+            return
+        mem = self._memory
+        embeddings: Optional[List[List[float]]] = None
+        (dense_index,) = await self._ensure_indexes("dense_index")
+        if dense_index:
+            with mem._stage("ingest.embed") as stage:
+                embeddings = await self.embedding.embed_texts([c.text for c in chunks])
+                stage.items = len(chunks)
+        await asyncio.to_thread(mem._index_chunks, chunks, embeddings)
+
+    async def _ensure_indexes(self, *names: str) -> Tuple[Any, ...]:
+        # 遅延生成のインデックスを取得。初回の生成 (Chroma の import・ロード) はスレッドで行う
+        # / Resolve lazy indexes; first-time construction runs off the event loop
+        mem = self._memory
+        if all(name in mem._indexes for name in names):
+            return tuple(mem._indexes[name] for name in names)
+        return await asyncio.to_thread(lambda: tuple(getattr(mem, name) for name in names))
+
+    # 会話取得 / get conversation
+    async def get_conversation(self, session_id: str) -> List[MessageRecord]:
+        return await asyncio.to_thread(self._memory.get_conversation, session_id)
+
+    # ナレッジ取得 / get knowledge
+    async def get_knowledge(self, doc_id: str) -> DocumentRecord:
+        return await asyncio.to_thread(self._memory.get_knowledge, doc_id)
+
+    # 検索 / search
+    async def search(self, query: str, top_k: int = 5, *, where: Optional[Dict[str, Any]] = None) -> List[SearchResult]:
+        if top_k <= 0:
+            raise ValueError("[mem][E004] top_k must be positive")
+        with self._memory._stage("search.total") as stage:
+            results = await self._search(query, top_k, where)
+            stage.items = len(results)
+        return results
+
+    async def _search(self, query: str, top_k: int, where: Optional[Dict[str, Any]]) -> List[SearchResult]:
+        mem = self._memory
+        use_lexical = "lexical" in mem.search_modes
+        use_vector = "vector" in mem.search_modes
+        where = normalize_where(where) if where is not None else None
+        cache_key, generation = mem._query_cache_key(query, top_k, where), 0
+        if cache_key is not None:
+            generation = mem.query_cache.generation
+            cached = mem.query_cache.get(cache_key)
+            mem._count("search.query_cache_hits" if cached is not None else "search.query_cache_misses")
+            if cached is not None:
+                return cached
+
+        allowed = await asyncio.to_thread(mem._allowed_chunks, where)
+        if allowed is not None and not allowed:
+            return []
+        fusion: Optional[ThresholdFusion] = None
+        if mem._adaptive_fusion(use_lexical, use_vector):
+            fusion, degraded = await self._retrieve_adaptive(query, top_k, allowed=allowed, where=where)
+            bm25_hits, dense_hits = fusion.lists
+        else:
+            candidate_k = max(top_k, top_k * mem.fanout)
+            bm25_hits, dense_hits, degraded = await self._retrieve(
+                query, candidate_k, use_lexical=use_lexical, use_vector=use_vector, allowed=allowed, where=where
+            )
+        results, partial = await asyncio.to_thread(
+            mem._finalize_search, query, top_k, bm25_hits, dense_hits, fusion=fusion
+        )
+        mem._store_query_cache(cache_key, results, generation, degraded or partial)
+        return results
+
+    # 会話検索 / search conversation
+    async def search_conversation(
+        self,
+        query: str,
+        top_k: int = 5,
+        *,
+        session_id: Optional[str] = None,
+        role: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[SearchResult]:
+        if top_k <= 0:
+            raise ValueError("[mem][E004] top_k must be positive")
+        mem = self._memory
+        await asyncio.to_thread(mem._prepare_message_search)
+        allowed, where = await asyncio.to_thread(mem._message_filters, session_id, role, since, until)
+        if allowed is not None and not allowed:
+            return []
+        use_lexical = "lexical" in mem.search_modes
+        use_vector = "vector" in mem.search_modes
+        lexical_index, dense_index = await self._ensure_indexes("message_bm25", "message_dense")
+        indexes = {"lexical_index": lexical_index, "dense_index": dense_index}
+        fusion: Optional[ThresholdFusion] = None
+        if mem._adaptive_fusion(use_lexical, use_vector):
+            fusion, _ = await self._retrieve_adaptive(query, top_k, allowed=allowed, where=where, **indexes)
+            bm25_hits, dense_hits = fusion.lists
+        else:
+            candidate_k = max(top_k, top_k * mem.fanout)
+            bm25_hits, dense_hits, _ = await self._retrieve(
+                query,
+                candidate_k,
+                use_lexical=use_lexical,
+                use_vector=use_vector,
+                allowed=allowed,
+                where=where,
+                **indexes,
+            )
+        results, _ = await asyncio.to_thread(
+            mem._finalize_search, query, top_k, bm25_hits, dense_hits, mem._resolve_messages, fusion=fusion
+        )
+        return results
+
+    async def _retrieve_adaptive(self, query: str, top_k: int, **options: Any) -> Tuple[ThresholdFusion, bool]:
+        # Memory._retrieve_adaptive の非同期版 / asyncio counterpart of Memory._retrieve_adaptive
+        fusion = self._memory._threshold_fusion(top_k)
+        *lists, degraded = await self._retrieve(query, fusion.depth, use_lexical=True, use_vector=True, **options)
+        while fusion.update(tuple(lists)):
+            lexical, vector = fusion.wants
+            *lists, again = await self._retrieve(
+                query, fusion.depth, use_lexical=lexical, use_vector=vector, **options
+            )
+            degraded = degraded or again
+        return fusion, degraded
+
+    async def _retrieve(
+        self,
+        query: str,
+        k: int,
+        *,
+        use_lexical: bool,
+        use_vector: bool,
+        lexical_index: Optional[BM25Index] = None,
+        dense_index: Optional[VectorIndex] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[tuple[str, float]], List[tuple[str, float]], bool]:
+        mem = self._memory
+        if lexical_index is None or dense_index is None:
+            bm25_index, knowledge_dense = await self._ensure_indexes("bm25_index", "dense_index")
+            lexical_index = lexical_index if lexical_index is not None else bm25_index
+            dense_index = dense_index if dense_index is not None else knowledge_dense
+        dense_ready = use_vector and dense_index is not None
+        if use_vector and not dense_ready:
+            logger.warning("[mem][W01] %s index unavailable, fallback to bm25", mem.vector_backend)
+        started = time.monotonic()
+        bm25_task = (
+            asyncio.create_task(asyncio.to_thread(mem._lexical_search, lexical_index, query, k, allowed))
+            if use_lexical
+            else None
+        )
+        dense_task = (
+            asyncio.create_task(self._dense_search(query, k, dense_index, where, allowed)) if dense_ready else None
+        )
+
+        bm25_hits: List[tuple[str, float]] = []
+        dense_hits: List[tuple[str, float]] = []
+        degraded = False
+        if bm25_task is not None:
+            try:
+                bm25_hits = await asyncio.wait_for(bm25_task, mem._remaining(mem.lexical_timeout, started))
+            except asyncio.TimeoutError:
+                degraded = True
+                mem._mark_degraded()
+                logger.warning("[mem][W02] %s index timed out, using %s results only", mem.lexical_backend, mem.vector_backend)
+        if dense_task is not None:
+            try:
+                dense_hits = await asyncio.wait_for(dense_task, mem._remaining(mem.dense_timeout, started))
+            except asyncio.TimeoutError:
+                degraded = True
+                mem._mark_degraded()
+                logger.warning(
+                    "[mem][W01] %s index timed out after %.2fs, fallback to bm25", mem.vector_backend, mem.dense_timeout
+                )
+            except Exception as exc:  # pragma: no cover - defensive fallback
+                degraded = True
+                mem._dense_failed(exc)
+        return bm25_hits, dense_hits, degraded
+
+    async def _dense_search(
+        self,
+        query: str,
+        k: int,
+        index: VectorIndex,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[tuple[str, float]]:
+        # 同期版と同じくクエリの埋め込みを含めて計測。失敗は _retrieve が縮退として扱う
+        # / Timed including the query embedding, as in Memory; _retrieve handles failures
+        with self._memory._stage("search.vector") as stage:
+            query_emb = await self.embedding.embed_query(query)
+            hits = await asyncio.to_thread(index.search_by_vector, query_emb, k, where=where, allowed=allowed)
+            stage.items = len(hits)
+        return hits
+
+    async def refresh_summary(self, session_id: str) -> Optional[SessionSummary]:
+        return await asyncio.to_thread(self._memory.refresh_summary, session_id)
+
+    # 要約 / create_summary
+    async def create_summary(
+        self,
+        *,
+        session_id: Optional[str] = None,
+        doc_id: Optional[str] = None,
+        **options: Any,
+    ) -> str:
+        mem = self._memory
+        summarizer = options.get("summarizer")
+        if summarizer:
+            text = await asyncio.to_thread(mem._summary_source, session_id=session_id, doc_id=doc_id)
+            result = summarizer(text)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        if session_id and not doc_id and mem._rolling_enabled():
+            record = await asyncio.to_thread(mem.refresh_summary, session_id)
+            if record is None:
+                raise ValueError("[mem][E006] target not found")
+            return record.summary
+        leaves = await asyncio.to_thread(mem._summary_leaves, session_id=session_id, doc_id=doc_id)
+        return await self.summarizer.summarize(leaves)
+
+    # 最適化 / optimize
+    async def optimize(
+        self,
+        *,
+        level: str = "eval",
+        doc_ids: Optional[List[str]] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        eval_id: Optional[str] = None,
+        llm: Any = None,
+        dry_run: bool = False,
+    ) -> OptimizeResult:
+        raise NotImplementedError("[mem][E005] optimize level not implemented")
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .models import SearchResult
+from .storage import SQLiteRepository
+from .utils import LRUCache, normalize_text
+
+
+class EmbeddingCache:
+    """
+    埋め込みのコンテンツアドレス型キャッシュ / Content-addressed embedding cache.
+    (モデル名, テキストの SHA-256) をキーに SQLite の embedding_cache テーブルへ永続化し、
+    クエリ埋め込み用にプロセス内 LRU を前段に置く。
+    """
+
+    def __init__(self, repo: SQLiteRepository, *, memory_size: int = 1024) -> None:
+        self.repo = repo
+        self._lru: LRUCache[Tuple[str, str], List[float]] = LRUCache(memory_size)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, model: str, texts: Sequence[str]) -> Tuple[List[str], Dict[str, List[float]], Dict[str, str]]:
+        # 戻り値: (各テキストのハッシュ, ヒットした埋め込み, 未取得のハッシュ→テキスト) / (hashes, hits, misses)
+        hashes = [self.key(t) for t in texts]
+        found = {h: _decode(blob) for h, blob in self.repo.get_embeddings(model, hashes).items()}
+        missing: Dict[str, str] = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in found:
+                missing.setdefault(text_hash, text)
+        # 同一バッチ内の重複テキストは 1 件だけ送るためヒット扱い / In-batch duplicates count as hits
+        self._record(disk=len(hashes) - len(missing), misses=len(missing))
+        return hashes, found, missing
+
+    def fill(
+        self,
+        model: str,
+        hashes: List[str],
+        found: Dict[str, List[float]],
+        missing: Dict[str, str],
+        vectors: List[List[float]],
+    ) -> List[List[float]]:
+        # プロバイダの結果を保存し、入力順の埋め込みを返す / Persist fresh vectors, return in input order
+        fresh = dict(zip(missing.keys(), vectors))
+        if fresh:
+            self.repo.save_embeddings(model, ((h, _encode(v)) for h, v in fresh.items()))
+            found.update(fresh)
+        return [found[h] for h in hashes]
+
+    def get_query(self, model: str, text: str) -> Optional[List[float]]:
+        vector = self._lru.get((model, self.key(text)))
+        if vector is not None:
+            self._record(memory=1)
+        return vector
+
+    def put_query(self, model: str, text: str, vector: List[float]) -> None:
+        self._lru.put((model, self.key(text)), vector)
+
+    def _record(self, *, memory: int = 0, disk: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            self.memory_hits += memory
+            self.disk_hits += disk
+            self.misses += misses
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+def _encode(vector: List[float]) -> bytes:
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def _decode(blob: bytes) -> List[float]:
+    return np.frombuffer(blob, dtype="<f4").tolist()
+
+
+class SummaryCache:
+    """
+    要約のコンテンツアドレス型キャッシュ / Content-addressed cache of map-reduce summaries.
+    (モデル名と段階, 入力テキストの SHA-256) をキーに SQLite の chunk_summaries テーブルへ永続化する。
+    変わっていないチャンク群・中間要約は再要約しない。
+    """
+
+    def __init__(self, repo: SQLiteRepository) -> None:
+        self.repo = repo
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, texts: Sequence[str]) -> Dict[str, str]:
+        # テキスト → 要約 (保存済みのもののみ) / text -> stored summary, hits only
+        hashes = {text: EmbeddingCache.key(text) for text in texts}
+        stored = self.repo.get_summaries(model, hashes.values())
+        found = {text: stored[h] for text, h in hashes.items() if h in stored}
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, summaries: Dict[str, str]) -> None:
+        if summaries:
+            self.repo.save_summaries(model, ((EmbeddingCache.key(t), s) for t, s in summaries.items()))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class QueryCache:
+    """
+    検索結果キャッシュ / Search result cache.
+    (正規化クエリ, top_k, 検索設定) をキーに件数・推定バイト数の上限付き LRU で保持する。
+    インデックス更新時に bump() で世代を進めて全破棄し、古い世代で計算された結果は保存しない。
+    """
+
+    def __init__(self, *, max_entries: int = 1024, max_bytes: int = 32 * 1024 * 1024) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self._data: "OrderedDict[Hashable, Tuple[List[SearchResult], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return normalize_text(query)
+
+    def get(self, key: Hashable) -> Optional[List[SearchResult]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        return [_copy_result(r) for r in entry[0]]
+
+    def put(self, key: Hashable, results: List[SearchResult], generation: int) -> None:
+        size = sum(_result_size(r) for r in results)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        stored = [_copy_result(r) for r in results]
+        with self._lock:
+            # 検索中にインデックスが更新された結果は保存しない / Drop results computed against an old generation
+            if generation != self.generation:
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (stored, size)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+
+    def bump(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class RerankCache:
+    """
+    LLM リランクの採点キャッシュ / Cache of LLM relevance scores.
+    (正規化クエリ, チャンク ID, モデル) をキーに、採点時の本文の SHA-256 (EmbeddingCache.key) と共に保持する。
+    同じ ID で本文が更新されたチャンクはハッシュが一致しないため採点し直す。
+    """
+
+    def __init__(self, max_entries: int = 4096) -> None:
+        self._lru: LRUCache[Tuple[str, str, str], Tuple[str, float]] = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, query: str, model: str, texts: Dict[str, str]) -> Dict[str, float]:
+        # チャンク ID → 本文 を受け取り、採点済みのものだけ返す / Scores for ids whose text is unchanged
+        norm = QueryCache.normalize(query)
+        found = self._lru.get_many((norm, cid, model) for cid in texts)
+        scores = {key[1]: score for key, (digest, score) in found.items() if digest == EmbeddingCache.key(texts[key[1]])}
+        with self._lock:
+            self.hits += len(scores)
+            self.misses += len(texts) - len(scores)
+        return scores
+
+    def put_many(self, query: str, model: str, scores: Dict[str, Tuple[str, float]]) -> None:
+        # チャンク ID → (採点した本文, 採点) / id -> (scored text, score)
+        norm = QueryCache.normalize(query)
+        for cid, (text, score) in scores.items():
+            self._lru.put((norm, cid, model), (EmbeddingCache.key(text), score))
+
+    def clear(self) -> None:
+        self._lru.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _copy_result(result: SearchResult) -> SearchResult:
+    # 呼び出し側の変更がキャッシュへ波及しないよう複製 / Copy so callers cannot mutate cached entries
+    return replace(result, metadata=dict(result.metadata))
+
+
+def _result_size(result: SearchResult) -> int:
+    # 文字列長ベースの概算 / Rough estimate from string lengths
+    return 128 + len(result.text) + len(result.chunk_id) + len(result.doc_id) + 64 * len(result.metadata)
@@ -4,8 +4,6 @@ import os
 from dataclasses import dataclass
 from typing import Optional
 
-from dotenv import load_dotenv
-
 
 def is_openai_model(model: Optional[str]) -> bool:
     if not model:
@@ -32,6 +30,8 @@ def load_provider_settings(
     OpenAI 互換 API の設定をロードする / Load OpenAI-compatible API settings.
     優先度: 明示指定 -> .env -> 環境変数。
     """
+    from dotenv import load_dotenv
+
     load_dotenv()
     resolved_api_key = api_key or os.getenv("OPENAI_API_KEY")
     resolved_model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Tuple
+
+# Chroma の where 句と同じ演算子のみ受け付ける / Same operator subset as Chroma's `where`
+_COMPARISONS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+_MEMBERSHIP = {"$in": "IN", "$nin": "NOT IN"}
+_SCALARS = (str, int, float, bool)
+
+
+def normalize_where(where: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    where 句を検証し、1 条件 1 辞書の正規形に変換する / Validate and canonicalize a `where` filter.
+    正規形はそのまま Chroma に渡せ、SQLite 側は where_to_sql で同じ条件に変換する。
+    """
+    if not isinstance(where, dict) or not where:
+        raise ValueError("[mem][E004] where must be a non-empty dict")
+    clauses: List[Dict[str, Any]] = []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(value, list) or not value:
+                raise ValueError(f"[mem][E004] {key} expects a non-empty list")
+            parts = [normalize_where(v) for v in value]
+            clauses.append(parts[0] if len(parts) == 1 else {key: parts})
+        elif key.startswith("$"):
+            raise ValueError(f"[mem][E004] unsupported where operator: {key}")
+        else:
+            clauses.append({key: _normalize_condition(value)})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _normalize_condition(value: Any) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        value = {"$eq": value}
+    if len(value) != 1:
+        raise ValueError("[mem][E004] each where condition takes exactly one operator")
+    op, operand = next(iter(value.items()))
+    if op in _COMPARISONS:
+        if not isinstance(operand, _SCALARS):
+            raise ValueError(f"[mem][E004] {op} expects a scalar value")
+    elif op in _MEMBERSHIP:
+        if not isinstance(operand, list) or not operand or not all(isinstance(v, _SCALARS) for v in operand):
+            raise ValueError(f"[mem][E004] {op} expects a non-empty list of scalars")
+    else:
+        raise ValueError(f"[mem][E004] unsupported where operator: {op}")
+    return {op: operand}
+
+
+def where_key(where: Dict[str, Any]) -> str:
+    # キャッシュ用の正準表現 / Canonical form for cache keys
+    return json.dumps(where, sort_keys=True, ensure_ascii=False)
+
+
+def where_to_sql(where: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    # 正規化済み where を documents テーブルへの SQL 条件に変換 / Compile to SQL over `documents`
+    if "$and" in where or "$or" in where:
+        op = "$and" if "$and" in where else "$or"
+        parts = [where_to_sql(w) for w in where[op]]
+        joiner = " AND " if op == "$and" else " OR "
+        return "(" + joiner.join(sql for sql, _ in parts) + ")", [p for _, params in parts for p in params]
+    key, condition = next(iter(where.items()))
+    op, operand = next(iter(condition.items()))
+    if key == "doc_id":
+        column, params = "documents.doc_id", []
+    elif json.dumps(key) == f'"{key}"':
+        column, params = "json_extract(documents.metadata, ?)", [f'$."{key}"']
+    else:
+        # JSON パスは保存時のエスケープ (\uXXXX・\" 等) と一致しないため、キーを直接照合する
+        # / JSON paths cannot match escaped keys (non-ASCII, quotes, backslashes), so compare keys via json_each
+        column, params = "(SELECT value FROM json_each(documents.metadata) WHERE key = ?)", [key]
+    if op in _MEMBERSHIP:
+        placeholders = ",".join("?" * len(operand))
+        return f"{column} {_MEMBERSHIP[op]} ({placeholders})", params + list(operand)
+    return f"{column} {_COMPARISONS[op]} ?", params + [operand]
+
+
+def chroma_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    # Chroma が保持できるスカラー値のみを残す / Chroma only stores scalar metadata values
+    return {k: v for k, v in metadata.items() if isinstance(v, _SCALARS) and k not in ("doc_id", "seq")}
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import heapq
+from operator import itemgetter
+from typing import Dict, List, Optional, Protocol, Sequence, Tuple
+
+from .models import FusionReport
+
+FUSION_MODES = ("weighted", "rrf")
+
+# 候補リストは常に (BM25, ベクトル) の順 / Hit lists are always ordered (bm25, dense)
+Hits = List[Tuple[str, float]]
+# (ID, 融合スコア, 正規化 BM25 スコア, 正規化ベクトルスコア) / (id, fused score, normalized bm25, normalized dense)
+Fused = Tuple[str, float, Optional[float], Optional[float]]
+
+
+class FusionStrategy(Protocol):
+    # 1 リトリーバの 1 候補が融合スコアへ寄与する値 (rank・スコアに対して単調減少)
+    # Contribution of one candidate from one retriever; must not increase with rank or decrease with score
+    name: str
+
+    def contribution(self, side: int, rank: int, normalized: float) -> float: ...
+
+
+class WeightedFusion:
+    """
+    最大値で正規化したスコアの加重和 / Weighted sum of max-normalized scores.
+    score = alpha * dense + (1 - alpha) * bm25 (従来の融合と同じ)。
+    """
+
+    name = "weighted"
+
+    def __init__(self, alpha: float = 0.5) -> None:
+        self.weights = (1.0 - alpha, alpha)
+
+    def contribution(self, side: int, rank: int, normalized: float) -> float:
+        return self.weights[side] * normalized
+
+
+class RRFFusion:
+    """
+    Reciprocal Rank Fusion / 順位の逆数の加重和。
+    score = Σ w / (k + rank) (rank は 1 始まり)。スコアの尺度に依らず融合できる。
+    """
+
+    name = "rrf"
+
+    def __init__(self, alpha: float = 0.5, k: int = 60) -> None:
+        if k <= 0:
+            raise ValueError("[mem][E004] rrf_k must be positive")
+        self.weights = (1.0 - alpha, alpha)
+        self.k = k
+
+    def contribution(self, side: int, rank: int, normalized: float) -> float:
+        return self.weights[side] / (self.k + rank + 1)
+
+
+def build_strategy(mode: str, *, alpha: float = 0.5, rrf_k: int = 60) -> FusionStrategy:
+    if mode == "weighted":
+        return WeightedFusion(alpha)
+    if mode == "rrf":
+        return RRFFusion(alpha, rrf_k)
+    raise ValueError(f"[mem][E004] unsupported fusion mode: {mode}")
+
+
+def fuse(strategy: FusionStrategy, lists: Sequence[Hits], limit: Optional[int] = None) -> List[Fused]:
+    """
+    候補リストを融合して降順に返す / Fuse (bm25, dense) hit lists, best first.
+    limit を指定するとヒープで上位 limit 件だけを選ぶ (全件ソートしない)。
+    """
+    return _select(_accumulate(strategy, lists), limit)
+
+
+def _accumulate(strategy: FusionStrategy, lists: Sequence[Hits]) -> Dict[str, List]:
+    # ID → [融合スコア, 正規化 BM25, 正規化ベクトル] / id -> [fused, bm25, dense]
+    table: Dict[str, List] = {}
+    for side, hits in enumerate(lists):
+        if not hits:
+            continue
+        top = max(score for _, score in hits) or 1.0
+        for rank, (hit_id, score) in enumerate(hits):
+            normalized = score / top
+            entry = table.get(hit_id)
+            if entry is None:
+                entry = table[hit_id] = [0.0, None, None]
+            entry[0] += strategy.contribution(side, rank, normalized)
+            entry[1 + side] = normalized
+    return table
+
+
+def _select(table: Dict[str, List], limit: Optional[int]) -> List[Fused]:
+    rows = ((hit_id, score, s_bm, s_de) for hit_id, (score, s_bm, s_de) in table.items())
+    if limit is None:
+        return sorted(rows, key=itemgetter(1), reverse=True)
+    # nlargest は sorted(...)[:limit] と同じ順 (同点は先勝ち) / Same order as a stable full sort
+    return heapq.nlargest(limit, rows, key=itemgetter(1))
+
+
+class ThresholdFusion:
+    """
+    必要な分だけ候補を深く取る融合 (閾値アルゴリズム / NRA) / Threshold-algorithm fusion.
+    各リトリーバから depth 件ずつ取り、未取得の候補が取りうる最大スコア (閾値) と、
+    片側しか見えていない候補の上界が、現在の top_k 件目を超えうる間だけ depth を倍にして取り直す。
+    リトリーバ側の呼び出しは利用者 (同期/非同期) が行う:
+
+        fusion = ThresholdFusion(strategy, top_k, start=top_k, max_depth=...)
+        lists = retrieve(fusion.depth, fusion.wants)
+        while fusion.update(lists):
+            lists = retrieve(fusion.depth, fusion.wants)
+        merged = fusion.result()
+    """
+
+    def __init__(self, strategy: FusionStrategy, top_k: int, *, start: int, max_depth: int) -> None:
+        self.strategy = strategy
+        self.top_k = top_k
+        self.depth = max(1, min(start, max_depth))
+        self.max_depth = max(self.depth, max_depth)
+        self.lists: List[Hits] = [[], []]
+        # 取り尽くした / 縮退したリトリーバ / Retrievers that ran out of candidates or degraded
+        self.done = [False, False]
+        self.wants: Tuple[bool, bool] = (True, True)
+        self.rounds = 0
+        self._table: Dict[str, List] = {}
+
+    def update(self, lists: Sequence[Hits]) -> bool:
+        # 取得結果を反映し、さらに深く取るべきなら True / Merge a round; True if another round is needed
+        self.rounds += 1
+        for side, hits in enumerate(lists):
+            if not self.wants[side]:
+                continue
+            if len(hits) < len(self.lists[side]):
+                # タイムアウト等で減った場合は前回の結果を使い、以降は取らない / Keep the deeper, earlier list
+                self.done[side] = True
+                continue
+            self.lists[side] = list(hits)
+            self.done[side] = self.done[side] or len(hits) < self.depth
+        self._table = _accumulate(self.strategy, self.lists)
+        if all(self.done) or self.depth >= self.max_depth or self._settled():
+            return False
+        self.depth = min(self.depth * 2, self.max_depth)
+        self.wants = (not self.done[0], not self.done[1])
+        return True
+
+    def result(self, limit: Optional[int] = None) -> List[Fused]:
+        return _select(self._table, limit)
+
+    @property
+    def report(self) -> FusionReport:
+        return FusionReport(
+            mode=f"{self.strategy.name}+threshold",
+            candidates_bm25=len(self.lists[0]),
+            candidates_dense=len(self.lists[1]),
+            rounds=self.rounds,
+        )
+
+    def _frontier(self, side: int) -> float:
+        # そのリトリーバで未取得の候補が得られる最大の寄与 / Best contribution still unseen on one side
+        hits = self.lists[side]
+        if self.done[side] or not hits:
+            return 0.0
+        top = max(score for _, score in hits) or 1.0
+        return self.strategy.contribution(side, len(hits), hits[-1][1] / top)
+
+    def _settled(self) -> bool:
+        # top_k 件の顔ぶれがもう変わりえないか / Whether the top-k set can still change
+        frontier = (self._frontier(0), self._frontier(1))
+        ranked = heapq.nlargest(self.top_k, self._table.items(), key=lambda item: item[1][0])
+        if len(ranked) < self.top_k:
+            return False
+        kth = ranked[-1][1][0]
+        # 両方で未取得の候補 / Candidates unseen by both retrievers
+        if frontier[0] + frontier[1] > kth:
+            return False
+        # 片側だけで見つかった候補の上界 / Upper bounds of candidates seen on one side only
+        chosen = {hit_id for hit_id, _ in ranked}
+        for hit_id, (score, s_bm, s_de) in self._table.items():
+            if hit_id in chosen:
+                continue
+            bound = score + (frontier[0] if s_bm is None else 0.0) + (frontier[1] if s_de is None else 0.0)
+            if bound > kth:
+                return False
+        return True
+
+
+def single_report(mode: str, lists: Sequence[Hits]) -> FusionReport:
+    # 1 回で取得した場合の報告 / Report for a single-round fusion
+    return FusionReport(mode=mode, candidates_bm25=len(lists[0]), candidates_dense=len(lists[1]), rounds=1)
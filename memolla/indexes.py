@@ -2,137 +2,847 @@ from __future__ import annotations
 
 import json
 import logging
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+from collections import Counter
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import AbstractSet, Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
 
-import chromadb
-from bm25s import BM25, Tokenizer
-from chromadb.config import Settings
+import numpy as np
 
 from .models import ChunkRecord
 from .providers import EmbeddingProvider
 
 logger = logging.getLogger(__name__)
 
+_EMPTY_INT = np.zeros(0, dtype=np.int32)
+_EMPTY_FLOAT = np.zeros(0, dtype=np.float32)
+_SEGMENT_MAGIC = b"MLBM25S1"
+
+
+class _ChunkIdTable:
+    """
+    チャンク ID 表 / Chunk-id table.
+    UTF-8 を連結したバイト列と各 ID の開始オフセットで保持し、参照時にのみデコードする。
+    """
+
+    __slots__ = ("offsets", "blob")
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    @classmethod
+    def from_list(cls, chunk_ids: Sequence[str]) -> "_ChunkIdTable":
+        encoded = [cid.encode("utf-8") for cid in chunk_ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    @classmethod
+    def concat(cls, tables: Sequence["_ChunkIdTable"]) -> "_ChunkIdTable":
+        # デコードせずにオフセットをずらして連結 / Concatenate by shifting offsets, no decoding
+        parts = [np.zeros(1, dtype=np.uint64)]
+        base = 0
+        for table in tables:
+            parts.append(table.offsets[1:] + np.uint64(base))
+            base += len(table.blob)
+        blob = np.concatenate([t.blob for t in tables]) if tables else np.zeros(0, dtype=np.uint8)
+        return cls(np.concatenate(parts), blob)
+
+
+class _Segment:
+    """
+    不変の BM25 セグメント / Immutable BM25 segment.
+    語 ID ごとの転置リスト (CSR 形式) とチャンク長を保持する。
+    ディスク上では単一ファイル (ヘッダ + 生配列) に保存し、読み込み時は mmap で遅延参照する。
+    """
+
+    __slots__ = ("name", "chunk_ids", "doc_lens", "total_len", "terms", "indptr", "postings", "tfs")
+
+    def __init__(
+        self,
+        name: str,
+        chunk_ids: _ChunkIdTable,
+        doc_lens: np.ndarray,
+        terms: np.ndarray,
+        indptr: np.ndarray,
+        postings: np.ndarray,
+        tfs: np.ndarray,
+        total_len: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.chunk_ids = chunk_ids
+        self.doc_lens = doc_lens
+        self.total_len = int(doc_lens.sum()) if total_len is None else total_len
+        self.terms = terms
+        self.indptr = indptr
+        self.postings = postings
+        self.tfs = tfs
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def lookup(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        pos = int(np.searchsorted(self.terms, term_id))
+        if pos >= len(self.terms) or self.terms[pos] != term_id:
+            return _EMPTY_INT, _EMPTY_FLOAT
+        start, end = self.indptr[pos], self.indptr[pos + 1]
+        return self.postings[start:end], self.tfs[start:end]
+
+    def df(self, term_id: int) -> int:
+        return len(self.lookup(term_id)[0])
+
+    @classmethod
+    def build(cls, name: str, chunk_ids: List[str], token_ids: List[List[int]]) -> "_Segment":
+        doc_lens = np.fromiter((len(t) for t in token_ids), dtype=np.int32, count=len(token_ids))
+        term_parts: List[np.ndarray] = []
+        doc_parts: List[np.ndarray] = []
+        tf_parts: List[np.ndarray] = []
+        for local_idx, ids in enumerate(token_ids):
+            if not ids:
+                continue
+            uniq, counts = np.unique(np.asarray(ids, dtype=np.int64), return_counts=True)
+            term_parts.append(uniq)
+            doc_parts.append(np.full(len(uniq), local_idx, dtype=np.int32))
+            tf_parts.append(counts.astype(np.float32))
+        table = _ChunkIdTable.from_list(chunk_ids)
+        return cls._from_triples(name, table, doc_lens, term_parts, doc_parts, tf_parts)
+
+    def deleted_mask(self, deleted: AbstractSet[str]) -> Optional[np.ndarray]:
+        # 削除済みチャンクの位置 (無ければ None) / Mask of tombstoned docs, None when there are none
+        if not deleted:
+            return None
+        mask = np.fromiter((self.chunk_ids[i] in deleted for i in range(len(self))), dtype=bool, count=len(self))
+        return mask if mask.any() else None
+
+    @classmethod
+    def merge(
+        cls,
+        name: str,
+        segments: Sequence["_Segment"],
+        deleted: AbstractSet[str] = frozenset(),
+    ) -> "_Segment":
+        # deleted に含まれるチャンクは物理的に取り除く / Tombstoned chunks are purged while merging
+        term_parts: List[np.ndarray] = []
+        doc_parts: List[np.ndarray] = []
+        tf_parts: List[np.ndarray] = []
+        tables: List[_ChunkIdTable] = []
+        lens: List[np.ndarray] = []
+        offset = 0
+        for seg in segments:
+            terms = np.repeat(seg.terms, np.diff(seg.indptr))
+            mask = seg.deleted_mask(deleted)
+            if mask is None:
+                term_parts.append(terms)
+                doc_parts.append(seg.postings + offset)
+                tf_parts.append(seg.tfs)
+                tables.append(seg.chunk_ids)
+                lens.append(seg.doc_lens)
+                offset += len(seg)
+                continue
+            keep = ~mask
+            remap = np.cumsum(keep, dtype=np.int64) - 1
+            live = keep[seg.postings]
+            term_parts.append(terms[live])
+            doc_parts.append(remap[seg.postings[live]] + offset)
+            tf_parts.append(seg.tfs[live])
+            tables.append(_ChunkIdTable.from_list([seg.chunk_ids[i] for i in np.flatnonzero(keep)]))
+            lens.append(seg.doc_lens[keep])
+            offset += int(keep.sum())
+        table = _ChunkIdTable.concat(tables)
+        doc_lens = np.concatenate(lens) if lens else _EMPTY_INT
+        return cls._from_triples(name, table, doc_lens, term_parts, doc_parts, tf_parts)
+
+    @classmethod
+    def _from_triples(
+        cls,
+        name: str,
+        chunk_ids: _ChunkIdTable,
+        doc_lens: np.ndarray,
+        term_parts: List[np.ndarray],
+        doc_parts: List[np.ndarray],
+        tf_parts: List[np.ndarray],
+    ) -> "_Segment":
+        if not term_parts:
+            return cls(name, chunk_ids, doc_lens, _EMPTY_INT.astype(np.int64), np.zeros(1, dtype=np.int64), _EMPTY_INT, _EMPTY_FLOAT)
+        all_terms = np.concatenate(term_parts)
+        all_docs = np.concatenate(doc_parts).astype(np.int32)
+        all_tfs = np.concatenate(tf_parts).astype(np.float32)
+        # 語 ID で安定ソートし、語ごとの文書順を保つ / Stable sort keeps doc order within each term
+        order = np.argsort(all_terms, kind="stable")
+        terms, counts = np.unique(all_terms[order], return_counts=True)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(name, chunk_ids, doc_lens, terms, indptr, all_docs[order], all_tfs[order])
+
+    def write(self, path: Path) -> None:
+        arrays = {
+            "id_offsets": self.chunk_ids.offsets,
+            "id_blob": self.chunk_ids.blob,
+            "doc_lens": self.doc_lens,
+            "terms": self.terms,
+            "indptr": self.indptr,
+            "postings": self.postings,
+            "tfs": self.tfs,
+        }
+        layout: Dict[str, Any] = {}
+        offset = 0
+        for key, arr in arrays.items():
+            layout[key] = {"offset": offset, "dtype": arr.dtype.str, "count": int(arr.size)}
+            offset += _aligned(arr.nbytes)
+        header = json.dumps({"docs": len(self), "total_len": self.total_len, "arrays": layout}).encode("utf-8")
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_SEGMENT_MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            f.write(b"\0" * (_aligned(f.tell()) - f.tell()))
+            for arr in arrays.values():
+                data = np.ascontiguousarray(arr).tobytes()
+                f.write(data)
+                f.write(b"\0" * (_aligned(len(data)) - len(data)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, name: str, path: Path) -> "_Segment":
+        # ファイル全体を mmap し、配列はページ参照時に読み込まれる / Arrays are paged in lazily via mmap
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[: len(_SEGMENT_MAGIC)] != _SEGMENT_MAGIC:
+            raise ValueError(f"invalid BM25 segment file: {path}")
+        (header_len,) = struct.unpack_from("<Q", mm, len(_SEGMENT_MAGIC))
+        header_start = len(_SEGMENT_MAGIC) + 8
+        header = json.loads(mm[header_start : header_start + header_len].decode("utf-8"))
+        data_start = _aligned(header_start + header_len)
+        arrays: Dict[str, np.ndarray] = {}
+        for key, spec in header["arrays"].items():
+            arrays[key] = np.frombuffer(
+                mm, dtype=np.dtype(spec["dtype"]), count=spec["count"], offset=data_start + spec["offset"]
+            )
+        return cls(
+            name,
+            _ChunkIdTable(arrays["id_offsets"], arrays["id_blob"]),
+            arrays["doc_lens"],
+            arrays["terms"],
+            arrays["indptr"],
+            arrays["postings"],
+            arrays["tfs"],
+            total_len=header["total_len"],
+        )
+
+
+def _aligned(n: int) -> int:
+    return (n + 7) // 8 * 8
+
+
+class _MemTable:
+    # 追記専用の書き込みバッファ / Append-only write buffer flushed into segments
+    def __init__(self) -> None:
+        self.chunk_ids: List[str] = []
+        self.token_ids: List[List[int]] = []
+        self.doc_lens: List[int] = []
+        self.postings: Dict[int, List[Tuple[int, int]]] = {}
+        self.total_len = 0
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def add(self, chunk_id: str, ids: List[int]) -> None:
+        local_idx = len(self.chunk_ids)
+        for term_id, tf in Counter(ids).items():
+            self.postings.setdefault(term_id, []).append((local_idx, tf))
+        self.token_ids.append(ids)
+        self.doc_lens.append(len(ids))
+        self.total_len += len(ids)
+        # chunk_ids は最後に追加し、検索側のスナップショット境界とする / appended last as the reader's snapshot boundary
+        self.chunk_ids.append(chunk_id)
+
+    def lookup(self, term_id: int, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        entries = [e for e in self.postings.get(term_id, ()) if e[0] < limit]
+        if not entries:
+            return _EMPTY_INT, _EMPTY_FLOAT
+        arr = np.asarray(entries, dtype=np.int64)
+        return arr[:, 0].astype(np.int32), arr[:, 1].astype(np.float32)
+
 
 class BM25Index:
-    def __init__(self, *, base_dir: Optional[Path] = None) -> None:
+    """
+    セグメント分割された増分 BM25 インデックス / Incremental, segment-based BM25 index.
+
+    追加されたチャンクはメモリ上の memtable に入り、一定件数でセグメントへ flush される。
+    セグメントは LSM 風にバックグラウンドでマージされ、検索時は全セグメントを横断して
+    グローバルな IDF / 平均文書長でスコアリングする。
+    """
+
+    def __init__(
+        self,
+        *,
+        base_dir: Optional[Path] = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        flush_threshold: int = 1024,
+        merge_factor: int = 4,
+    ) -> None:
+        # bm25s / chromadb は使うときに import する (import memolla を軽く保つ) / Heavy deps load on first use
+        from bm25s import Tokenizer
+
         self.tokenizer = Tokenizer()
-        self.bm25 = BM25()
-        self._encoded_corpus: List[str] = []
-        self._chunk_map: Dict[str, ChunkRecord] = {}
+        self.k1 = k1
+        self.b = b
+        self.flush_threshold = flush_threshold
+        self.merge_factor = merge_factor
+        self._segments: Tuple[_Segment, ...] = ()
+        self._memtable = _MemTable()
+        self._next_segment = 0
+        self._lock = threading.RLock()
+        self._merge_thread: Optional[threading.Thread] = None
+        self._merging: set[str] = set()
+        # 削除済み (未コンパクション) のチャンク ID / Tombstoned chunk ids awaiting compaction
+        self._deleted: FrozenSet[str] = frozenset()
+        self._compact_lock = threading.Lock()
+        self._vocab_size_saved = 0
         self.base_dir = base_dir
         if self.base_dir:
             self.base_dir.mkdir(parents=True, exist_ok=True)
+            (self.base_dir / "segments").mkdir(exist_ok=True)
             self._load()
 
-    def _encode_entry(self, chunk: ChunkRecord) -> str:
-        return f"{chunk.chunk_id}||{chunk.text}"
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._segments) + len(self._memtable)
 
     def add_chunks(self, chunks: List[ChunkRecord]) -> None:
         if not chunks:
             return
-        for chunk in chunks:
-            self._chunk_map[chunk.chunk_id] = chunk
-            self._encoded_corpus.append(self._encode_entry(chunk))
+        with self._lock:
+            # 新規チャンクのみトークナイズする / Tokenize only the new chunks
+            token_ids = list(
+                self.tokenizer.streaming_tokenize([c.text for c in chunks], update_vocab=True, allow_empty=False)
+            )
+            self._append_vocab()
+            self._append_wal(chunks, token_ids)
+            for chunk, ids in zip(chunks, token_ids):
+                self._memtable.add(chunk.chunk_id, ids)
+            if len(self._memtable) >= self.flush_threshold:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        # memtable を強制的にセグメント化する / Force the memtable into a segment
+        with self._lock:
+            self._flush_locked()
+
+    def wait_for_merges(self) -> None:
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join()
 
-        tokenized = self.tokenizer.tokenize(self._encoded_corpus, return_as="tuple", show_progress=False)
-        # チャンク全体で再構築する / Rebuild index over full corpus
-        self.bm25.index(tokenized, show_progress=False)
-        self._save()
+    def delete(self, chunk_ids: Iterable[str]) -> None:
+        # 即座に検索対象から外し、物理削除は compact で行う / Hide immediately, purge on compact()
+        with self._lock:
+            self._deleted = self._deleted | frozenset(chunk_ids)
 
-    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
-        if not self._encoded_corpus:
+    def compact(self) -> Set[str]:
+        """
+        削除済みチャンクをセグメントから物理的に取り除く / Purge tombstoned chunks from segments.
+        対象セグメントを書き直してから差し替えるため、実行中も検索はブロックされない。
+        """
+        with self._compact_lock:
+            return self._compact()
+
+    def _compact(self) -> Set[str]:
+        while True:
+            self.wait_for_merges()
+            with self._lock:
+                # 実行中のマージが無い状態で全セグメントを確保 / Claim every segment while no merge runs
+                if self._merging or self._merge_thread is not None:
+                    continue
+                self._flush_locked(schedule=False)
+                deleted = self._deleted
+                targets = list(self._segments)
+                self._merging.update(s.name for s in targets)
+                break
+        if not deleted:
+            with self._lock:
+                self._merging.difference_update(s.name for s in targets)
+            return set()
+        rewritten: Dict[str, Optional[_Segment]] = {}
+        try:
+            for seg in targets:
+                mask = seg.deleted_mask(deleted)
+                if mask is None:
+                    continue
+                if mask.all():
+                    rewritten[seg.name] = None
+                    continue
+                with self._lock:
+                    name = self._new_segment_name()
+                new_seg = _Segment.merge(name, [seg], deleted)
+                self._write_segment(new_seg)
+                rewritten[seg.name] = new_seg
+        except Exception:
+            with self._lock:
+                self._merging.difference_update(s.name for s in targets)
+            for new_seg in rewritten.values():
+                if new_seg is not None:
+                    self._remove_segment(new_seg)
+            raise
+        with self._lock:
+            segments: List[_Segment] = []
+            for seg in self._segments:
+                if seg.name not in rewritten:
+                    segments.append(seg)
+                elif rewritten[seg.name] is not None:
+                    segments.append(rewritten[seg.name])  # type: ignore[arg-type]
+            self._segments = tuple(segments)
+            self._merging.difference_update(s.name for s in targets)
+            self._deleted = self._deleted - deleted
+            self._save_manifest()
+            self._schedule_merge()
+        for seg in targets:
+            if seg.name in rewritten:
+                self._remove_segment(seg)
+        return set(deleted)
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        *,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[Tuple[str, float]]:
+        # allowed を指定すると top-k 選択の前に候補を絞り込む / `allowed` filters candidates before top-k
+        if allowed is not None and not allowed:
             return []
-        tokenized_query = self.tokenizer.tokenize([query], return_as="tuple", update_vocab=False, show_progress=False)
-        res = self.bm25.retrieve(
-            tokenized_query,
-            corpus=self._encoded_corpus,
-            k=top_k,
-            return_as="tuple",
-            show_progress=False,
-            leave_progress=False,
-        )
-        documents = res.documents[0]
-        scores = res.scores[0]
-        hits: List[Tuple[str, float]] = []
-        for doc, score in zip(documents, scores):
-            chunk_id, text = doc.split("||", 1)
-            stored = self._chunk_map.get(chunk_id)
-            if stored is None:
+        with self._lock:
+            segments = self._segments
+            memtable = self._memtable
+            deleted = self._deleted
+            mem_len = len(memtable)
+            mem_total = memtable.total_len
+            query_ids = list(
+                self.tokenizer.streaming_tokenize([query], update_vocab=False, allow_empty=False)
+            )[0]
+            term_ids = sorted(set(query_ids))
+            mem_postings = {t: memtable.lookup(t, mem_len) for t in term_ids}
+        n_docs = sum(len(s) for s in segments) + mem_len
+        if n_docs == 0 or not term_ids:
+            return []
+        avgdl = (sum(s.total_len for s in segments) + mem_total) / n_docs or 1.0
+
+        # 全セグメント横断で df を集計し、IDF をグローバルに揃える / Global IDF across all segments
+        idf: Dict[int, float] = {}
+        for t in term_ids:
+            df = sum(s.df(t) for s in segments) + len(mem_postings[t][0])
+            if df:
+                idf[t] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        if not idf:
+            return []
+
+        cand_ids: List[str] = []
+        cand_scores: List[np.ndarray] = []
+        for seg in segments:
+            self._score_into(
+                seg.chunk_ids, seg.doc_lens, seg.lookup, idf, avgdl, top_k, cand_ids, cand_scores, allowed, deleted
+            )
+        if mem_len:
+            mem_lens = np.asarray(memtable.doc_lens[:mem_len], dtype=np.int32)
+            self._score_into(
+                memtable.chunk_ids[:mem_len],
+                mem_lens,
+                mem_postings.__getitem__,
+                idf,
+                avgdl,
+                top_k,
+                cand_ids,
+                cand_scores,
+                allowed,
+                deleted,
+            )
+        if not cand_ids:
+            return []
+        scores = np.concatenate(cand_scores)
+        top = _top_k_indices(scores, top_k)
+        return [(cand_ids[i], float(scores[i])) for i in top]
+
+    def _score_into(
+        self,
+        chunk_ids: List[str],
+        doc_lens: np.ndarray,
+        lookup: Any,
+        idf: Dict[int, float],
+        avgdl: float,
+        top_k: int,
+        out_ids: List[str],
+        out_scores: List[np.ndarray],
+        allowed: Optional[AbstractSet[str]] = None,
+        deleted: AbstractSet[str] = frozenset(),
+    ) -> None:
+        scores = np.zeros(len(chunk_ids), dtype=np.float32)
+        for t, weight in idf.items():
+            docs, tfs = lookup(t)
+            if len(docs):
+                norm = self.k1 * (1 - self.b + self.b * doc_lens[docs] / avgdl)
+                scores[docs] += weight * tfs / (tfs + norm)
+        matched = np.flatnonzero(scores)
+        if allowed is not None and len(matched):
+            # ヒットした文書のみ ID を引いて判定 / Only decode ids of documents that matched
+            keep = np.fromiter((chunk_ids[i] in allowed for i in matched), dtype=bool, count=len(matched))
+            matched = matched[keep]
+        if deleted and len(matched):
+            keep = np.fromiter((chunk_ids[i] not in deleted for i in matched), dtype=bool, count=len(matched))
+            matched = matched[keep]
+        if not len(matched):
+            return
+        best = matched[_top_k_indices(scores[matched], top_k)]
+        out_ids.extend(chunk_ids[i] for i in best)
+        out_scores.append(scores[best])
+
+    def _flush_locked(self, schedule: bool = True) -> None:
+        if not len(self._memtable):
+            return
+        memtable = self._memtable
+        live = [i for i, cid in enumerate(memtable.chunk_ids) if cid not in self._deleted]
+        if live:
+            seg = _Segment.build(
+                self._new_segment_name(),
+                [memtable.chunk_ids[i] for i in live],
+                [memtable.token_ids[i] for i in live],
+            )
+            self._write_segment(seg)
+            self._segments = self._segments + (seg,)
+        self._memtable = _MemTable()
+        self._save_manifest()
+        self._reset_wal()
+        if schedule:
+            self._schedule_merge()
+
+    def _new_segment_name(self) -> str:
+        name = f"seg_{self._next_segment:06d}"
+        self._next_segment += 1
+        return name
+
+    # --- バックグラウンドマージ / background merging ---
+    def _tier(self, seg: _Segment) -> int:
+        size = max(1, len(seg))
+        base = max(1, self.flush_threshold)
+        return int(math.log(max(1.0, size / base), self.merge_factor)) if self.merge_factor > 1 else 0
+
+    def _pick_merge(self) -> List[_Segment]:
+        tiers: Dict[int, List[_Segment]] = {}
+        for seg in self._segments:
+            if seg.name in self._merging:
                 continue
-            hits.append((chunk_id, float(score)))
-        return hits
+            tiers.setdefault(self._tier(seg), []).append(seg)
+        for tier in sorted(tiers):
+            group = tiers[tier]
+            if len(group) >= self.merge_factor:
+                return group[: self.merge_factor]
+        return []
+
+    def _schedule_merge(self) -> None:
+        if self.merge_factor < 2:
+            return
+        if self._merge_thread is not None:
+            return
+        if not self._pick_merge():
+            return
+        self._merge_thread = threading.Thread(target=self._merge_loop, name="memolla-bm25-merge", daemon=True)
+        self._merge_thread.start()
+
+    def _merge_loop(self) -> None:
+        while True:
+            with self._lock:
+                group = self._pick_merge()
+                if not group:
+                    self._merge_thread = None
+                    return
+                name = self._new_segment_name()
+                self._merging.update(s.name for s in group)
+                deleted = self._deleted
+            try:
+                merged = _Segment.merge(name, group, deleted)
+                self._write_segment(merged)
+            except Exception:
+                logger.exception("Failed to merge BM25 segments")
+                with self._lock:
+                    self._merging.difference_update(s.name for s in group)
+                    self._merge_thread = None
+                return
+            with self._lock:
+                merged_names = {s.name for s in group}
+                remaining = tuple(s for s in self._segments if s.name not in merged_names)
+                self._segments = remaining + (merged,)
+                self._merging.difference_update(merged_names)
+                self._save_manifest()
+            for old in group:
+                self._remove_segment(old)
+
+    # --- 永続化 / persistence ---
+    def _segment_path(self, name: str) -> Path:
+        assert self.base_dir is not None
+        return self.base_dir / "segments" / f"{name}.seg"
+
+    def _write_segment(self, seg: _Segment) -> None:
+        if self.base_dir:
+            seg.write(self._segment_path(seg.name))
 
-    def _save(self) -> None:
+    def _remove_segment(self, seg: _Segment) -> None:
         if not self.base_dir:
             return
-        data_path = self.base_dir / "bm25_corpus.json"
-        map_path = self.base_dir / "bm25_chunks.json"
-        model_dir = self.base_dir / "bm25_model"
         try:
-            data_path.write_text(json.dumps(self._encoded_corpus, ensure_ascii=False))
-            map_payload = {cid: {"doc_id": c.doc_id, "seq": c.seq, "text": c.text} for cid, c in self._chunk_map.items()}
-            map_path.write_text(json.dumps(map_payload, ensure_ascii=False))
-            model_dir.mkdir(parents=True, exist_ok=True)
-            self.bm25.save(model_dir)
-        except Exception:
-            logger.exception("Failed to save BM25 index")
+            self._segment_path(seg.name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _save_manifest(self) -> None:
+        if not self.base_dir:
+            return
+        payload = {"segments": [s.name for s in self._segments], "next_segment": self._next_segment}
+        tmp = self.base_dir / "manifest.json.tmp"
+        tmp.write_text(json.dumps(payload))
+        os.replace(tmp, self.base_dir / "manifest.json")
+
+    def _append_vocab(self) -> None:
+        # 語彙は追記のみ (行番号 = 語 ID) / Vocabulary is append-only (line number = term id)
+        words = list(self.tokenizer.word_to_id)
+        if len(words) == self._vocab_size_saved:
+            return
+        if self.base_dir:
+            with open(self.base_dir / "vocab.txt", "a", encoding="utf-8") as f:
+                f.write("".join(w + "\n" for w in words[self._vocab_size_saved :]))
+        self._vocab_size_saved = len(words)
+
+    def _append_wal(self, chunks: List[ChunkRecord], token_ids: List[List[int]]) -> None:
+        # レコード: [id 長 u32][chunk_id][語数 u32][語 ID int32 ...] / binary append-only records
+        if not self.base_dir:
+            return
+        buf = bytearray()
+        for chunk, ids in zip(chunks, token_ids):
+            cid = chunk.chunk_id.encode("utf-8")
+            buf += struct.pack("<I", len(cid)) + cid + struct.pack("<I", len(ids))
+            buf += np.asarray(ids, dtype="<i4").tobytes()
+        with open(self.base_dir / "memtable.wal", "ab") as f:
+            f.write(buf)
+
+    def _replay_wal(self, path: Path) -> None:
+        data = path.read_bytes()
+        pos = 0
+        while pos + 4 <= len(data):
+            (id_len,) = struct.unpack_from("<I", data, pos)
+            if pos + 8 + id_len > len(data):
+                break
+            cid = data[pos + 4 : pos + 4 + id_len].decode("utf-8")
+            (n_ids,) = struct.unpack_from("<I", data, pos + 4 + id_len)
+            ids_start = pos + 8 + id_len
+            ids_end = ids_start + 4 * n_ids
+            if ids_end > len(data):
+                # 書き込み途中で終了した末尾レコードは捨てる / Drop a torn trailing record
+                break
+            self._memtable.add(cid, np.frombuffer(data, dtype="<i4", count=n_ids, offset=ids_start).tolist())
+            pos = ids_end
+
+    def _reset_wal(self) -> None:
+        if self.base_dir:
+            (self.base_dir / "memtable.wal").write_bytes(b"")
 
     def _load(self) -> None:
-        data_path = self.base_dir / "bm25_corpus.json"
+        assert self.base_dir is not None
+        manifest_path = self.base_dir / "manifest.json"
+        vocab_path = self.base_dir / "vocab.txt"
+        wal_path = self.base_dir / "memtable.wal"
+        if not manifest_path.exists() and not vocab_path.exists():
+            self._migrate_legacy()
+            return
+        try:
+            if vocab_path.exists():
+                words = vocab_path.read_text(encoding="utf-8").splitlines()
+                self.tokenizer.word_to_id = {w: i for i, w in enumerate(words)}
+                self._vocab_size_saved = len(words)
+            if manifest_path.exists():
+                manifest = json.loads(manifest_path.read_text())
+                self._next_segment = manifest.get("next_segment", 0)
+                self._segments = tuple(
+                    _Segment.open(name, self._segment_path(name)) for name in manifest.get("segments", [])
+                )
+            if wal_path.exists():
+                self._replay_wal(wal_path)
+        except Exception:
+            logger.exception("Failed to load BM25 index; falling back to empty index")
+            self.tokenizer.reset_vocab()
+            self._vocab_size_saved = 0
+            self._segments = ()
+            self._memtable = _MemTable()
+        # マニフェストに無いセグメントファイル (中断したマージ等) を掃除 / Drop orphaned segment files
+        live = {s.name for s in self._segments}
+        for path in (self.base_dir / "segments").iterdir():
+            if path.name.split(".", 1)[0] not in live or path.suffix != ".seg":
+                path.unlink()
+
+    def _migrate_legacy(self) -> None:
+        # 旧 JSON 形式 (bm25_chunks.json) からセグメントを再構築 / Rebuild from the legacy JSON layout
+        assert self.base_dir is not None
         map_path = self.base_dir / "bm25_chunks.json"
-        model_dir = self.base_dir / "bm25_model"
-        if not data_path.exists() or not map_path.exists() or not model_dir.exists():
+        if not map_path.exists():
             return
         try:
-            self._encoded_corpus = json.loads(data_path.read_text())
             raw_map = json.loads(map_path.read_text())
-            for cid, val in raw_map.items():
-                self._chunk_map[cid] = ChunkRecord(chunk_id=cid, doc_id=val["doc_id"], seq=val["seq"], text=val["text"])
-            self.bm25.load(model_dir)
+            chunks = [
+                ChunkRecord(chunk_id=cid, doc_id=val["doc_id"], seq=val["seq"], text=val["text"])
+                for cid, val in raw_map.items()
+            ]
+            self.add_chunks(chunks)
+            self.flush()
         except Exception:
-            logger.exception("Failed to load BM25 index; falling back to empty index")
-            self._encoded_corpus = []
-            self._chunk_map = {}
+            logger.exception("Failed to migrate legacy BM25 index; falling back to empty index")
+            return
+        logger.info("Migrated legacy BM25 index (%d chunks) to segment format", len(chunks))
+        for name in ("bm25_corpus.json", "bm25_chunks.json"):
+            (self.base_dir / name).unlink(missing_ok=True)
+        shutil.rmtree(self.base_dir / "bm25_model", ignore_errors=True)
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition で部分選択してから整列 / Partial selection, then sort the winners
+    if len(scores) > k:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
 
 
 class DenseIndex:
-    def __init__(self, *, persist_dir: Optional[str], embedding: EmbeddingProvider):
+    def __init__(
+        self,
+        *,
+        persist_dir: Optional[str],
+        embedding: EmbeddingProvider,
+        collection: str = "memolla_chunks",
+    ):
+        import chromadb
+        from chromadb.config import Settings
+
         self.embedding = embedding
         if persist_dir:
             settings = Settings(is_persistent=True, persist_directory=persist_dir, anonymized_telemetry=False)
         else:
             settings = Settings(anonymized_telemetry=False)
         self.client = chromadb.Client(settings)
-        self.collection = self.client.get_or_create_collection(name="memolla_chunks")
-        self._chunk_cache: Dict[str, ChunkRecord] = {}
+        self.collection = self.client.get_or_create_collection(name=collection)
+        # 永続化済みコレクションも再起動後に検索できるよう件数で判定 / Persisted data stays searchable after restart
+        self._has_data = self.collection.count() > 0
+        self._deleted: FrozenSet[str] = frozenset()
+        self._lock = threading.Lock()
 
-    def add_chunks(self, chunks: List[ChunkRecord]) -> None:
+    def add_chunks(self, chunks: List[ChunkRecord], metadatas: Optional[List[Dict[str, Any]]] = None) -> None:
+        if not chunks:
+            return
+        embeddings = self.embedding.embed_texts([c.text for c in chunks])
+        self.add_embeddings(chunks, embeddings, metadatas)
+
+    def add_embeddings(
+        self,
+        chunks: List[ChunkRecord],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        # 埋め込み済みチャンクを登録 (非同期 API からも利用) / Register pre-computed embeddings
         if not chunks:
             return
-        texts = [c.text for c in chunks]
-        embeddings = self.embedding.embed_texts(texts)
         ids = [c.chunk_id for c in chunks]
-        metadatas = [{"doc_id": c.doc_id, "seq": c.seq} for c in chunks]
-        self.collection.add(documents=texts, embeddings=embeddings, ids=ids, metadatas=metadatas)
-        for chunk in chunks:
-            self._chunk_cache[chunk.chunk_id] = chunk
+        if metadatas is None:
+            metadatas = [{"doc_id": c.doc_id, "seq": c.seq} for c in chunks]
+        # Chroma の 1 回あたりの上限件数で分割 / Respect Chroma's max batch size
+        step = self._max_batch_size()
+        for start in range(0, len(ids), step):
+            end = start + step
+            # 再投入 (クラッシュ後の再インデックス) でも重複しないよう upsert / Upsert so re-indexing is idempotent
+            # 本文は SQLite にのみ保持し Chroma には渡さない / Text lives only in SQLite, not in Chroma
+            self.collection.upsert(
+                embeddings=embeddings[start:end],
+                ids=ids[start:end],
+                metadatas=metadatas[start:end],
+            )
+        self._has_data = True
+
+    def update_metadata(self, chunk_ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        # 再埋め込みせずにメタデータだけ更新 / Update metadata without re-embedding
+        step = self._max_batch_size()
+        for start in range(0, len(chunk_ids), step):
+            end = start + step
+            self.collection.update(ids=chunk_ids[start:end], metadatas=metadatas[start:end])
+
+    def delete(self, chunk_ids: Iterable[str]) -> None:
+        # 即座に検索対象から外し、物理削除は compact で行う / Hide immediately, purge on compact()
+        with self._lock:
+            self._deleted = self._deleted | frozenset(chunk_ids)
+
+    def compact(self) -> Set[str]:
+        deleted = self._deleted
+        ids = sorted(deleted)
+        step = self._max_batch_size()
+        for start in range(0, len(ids), step):
+            self.collection.delete(ids=ids[start : start + step])
+        with self._lock:
+            self._deleted = self._deleted - deleted
+        return set(deleted)
+
+    def _max_batch_size(self) -> int:
+        try:
+            return max(1, int(self.client.get_max_batch_size()))
+        except Exception:
+            return 5000
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[Tuple[str, float]]:
+        if not self._has_data:
+            return []
+        query_emb = self.embedding.embed_query(query)
+        return self.search_by_vector(query_emb, top_k, where=where, allowed=allowed)
 
-    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
-        if not self._chunk_cache:
+    def search_by_vector(
+        self,
+        query_emb: List[float],
+        top_k: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[Tuple[str, float]]:
+        # Chroma では where 句で絞り込むため allowed は使わない / Chroma filters with `where`; `allowed` is unused
+        if not self._has_data:
             return []
-        query_emb = self.embedding.embed_texts([query])[0]
-        res = self.collection.query(query_embeddings=[query_emb], n_results=top_k)
-        ids = res.get("ids", [[]])[0]
-        scores = res.get("distances") or res.get("embeddings") or [[]]
-        score_list: List[float] = []
-        if scores:
-            # Chroma returns distance; convert to similarity / 類似度に変換
-            for d in scores[0]:
-                score_list.append(float(1 / (1 + d)))
-        hits: List[Tuple[str, float]] = []
-        for chunk_id, score in zip(ids, score_list):
-            if chunk_id in self._chunk_cache:
-                hits.append((chunk_id, score))
-        return hits
+        deleted = self._deleted
+        # 削除済みで欠ける分を見越して多めに取得し、足りなければ件数を広げて再検索
+        # / Over-fetch for tombstoned hits and widen the query until top_k live hits or the collection runs out
+        limit = top_k + len(deleted)
+        n_results = min(top_k + min(len(deleted), top_k), limit)
+        while True:
+            res = self.collection.query(query_embeddings=[query_emb], n_results=n_results, where=where or None)
+            ids = res.get("ids", [[]])[0]
+            scores = res.get("distances") or res.get("embeddings") or [[]]
+            score_list: List[float] = []
+            if scores:
+                # Chroma returns distance; convert to similarity / 類似度に変換
+                for d in scores[0]:
+                    score_list.append(float(1 / (1 + d)))
+            hits = [(chunk_id, score) for chunk_id, score in zip(ids, score_list) if chunk_id not in deleted]
+            if len(hits) >= top_k or len(ids) < n_results or n_results >= limit:
+                return hits[:top_k]
+            n_results = min(n_results * 2, limit)
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .models import StageEvent
+
+logger = logging.getLogger(__name__)
+
+Tracer = Callable[[StageEvent], None]
+
+# ヒストグラムのバケット上限 (ミリ秒) / Histogram bucket upper bounds in milliseconds
+_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    # 固定バケットの累積ヒストグラム (パーセンタイルはバケット上限で近似) / Fixed-bucket histogram
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed_ms: float) -> None:
+        self.counts[bisect.bisect_left(_BUCKETS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total += elapsed_ms
+        if elapsed_ms > self.max:
+            self.max = elapsed_ms
+
+    def percentile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                # 最後のバケットは上限がないため最大値を返す / The overflow bucket reports the max
+                return min(_BUCKETS_MS[i], self.max) if i < len(_BUCKETS_MS) else self.max
+        return 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max, 3),
+            "p50_ms": round(self.percentile(0.50), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "buckets": {
+                (f"<={bound}" if i < len(_BUCKETS_MS) else f">{_BUCKETS_MS[-1]}"): n
+                for i, (bound, n) in enumerate(zip(_BUCKETS_MS + (None,), self.counts))
+                if n
+            },
+        }
+
+
+class Instrumentation:
+    """
+    段階ごとの計測と通知 / Per-stage timings, counters and tracer callbacks.
+    stage() で囲んだ処理の所要時間をヒストグラムに記録し、登録済みのトレーサへ StageEvent を渡す。
+    Memory は無効時にこのクラスを作らないため、フックが無ければ計測コストはかからない。
+    """
+
+    def __init__(self) -> None:
+        self._tracers: List[Tracer] = []
+        self._stages: Dict[str, LatencyHistogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add_tracer(self, tracer: Tracer) -> None:
+        with self._lock:
+            self._tracers = [*self._tracers, tracer]
+
+    def remove_tracer(self, tracer: Tracer) -> None:
+        with self._lock:
+            self._tracers = [t for t in self._tracers if t is not tracer]
+
+    def stage(self, name: str) -> "_Stage":
+        return _Stage(self, name)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def record(self, name: str, elapsed_sec: float, items: int = 0, detail: Any = None) -> None:
+        with self._lock:
+            hist = self._stages.get(name)
+            if hist is None:
+                hist = self._stages[name] = LatencyHistogram()
+            hist.record(elapsed_sec * 1000)
+        tracers = self._tracers
+        if tracers:
+            event = StageEvent(name=name, elapsed_sec=elapsed_sec, items=items, detail=detail)
+            for tracer in tracers:
+                try:
+                    tracer(event)
+                except Exception:  # pragma: no cover - tracer bugs must not break search
+                    logger.exception("Tracer failed for stage %s", name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stages": {name: hist.snapshot() for name, hist in sorted(self._stages.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+
+class _Stage:
+    # with 文で所要時間を計る / Times the body of a `with` block
+    __slots__ = ("_owner", "_name", "_started", "items", "detail")
+
+    def __init__(self, owner: Instrumentation, name: str) -> None:
+        self._owner = owner
+        self._name = name
+        self._started = 0.0
+        self.items = 0
+        self.detail: Any = None
+
+    def __enter__(self) -> "_Stage":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._owner.record(self._name, time.perf_counter() - self._started, self.items, self.detail)
+
+
+class _NullStage:
+    # 計測無効時に使う何もしない段階 / No-op stage used when instrumentation is off
+    __slots__ = ("items", "detail")
+
+    def __init__(self) -> None:
+        self.items = 0
+        self.detail: Any = None
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+NULL_STAGE = _NullStage()
+
+
+def stage_for(instrumentation: Optional[Instrumentation], name: str) -> Any:
+    # 無効なら共有の no-op を返す / Shared no-op when instrumentation is off
+    if instrumentation is None:
+        return NULL_STAGE
+    return instrumentation.stage(name)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import unicodedata
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 多項式ハッシュの基数 (32bit FNV の素数) / Polynomial hash base (the 32-bit FNV prime)
+_BASE = np.uint32(0x01000193)
+# 特徴の種類ごとの塩 / Per-feature-kind salts
+_WORD_SALT = np.uint32(0x9E3779B9)
+_CHAR_SALT = np.uint32(0x85EBCA6B)
+# 一度に処理するテキスト数 (一時配列を CPU キャッシュに収める) / Texts per block, keeps temporaries cache-sized
+_BLOCK = 128
+# 単語の区切りとみなす文字の表 (BMP のみ、\x00 と空白を含む) / Lookup table of word-breaking characters
+_BREAKS = np.zeros(0x10000, dtype=bool)
+_BREAKS[[ord(c) for c in "\x00 !\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~、。，．・：；！？「」『』（）［］【】〈〉《》〔〕…―〜"]] = True
+
+
+class LocalEmbedder:
+    """
+    ネットワーク不要の埋め込み (特徴ハッシング) / Offline embedder based on signed feature hashing.
+    単語と文字 n-gram をプロセスに依らない 32bit ハッシュで dim 個のバケットへ符号付きで加算し、
+    任意で IDF 重みを掛けて L2 正規化する。テキストはブロック単位に連結して NumPy でまとめて計算する。
+    日本語のように空白で区切らない文章も文字 n-gram で近さを表せる。
+    """
+
+    def __init__(
+        self,
+        dim: int = 256,
+        *,
+        char_ngrams: Tuple[int, int] = (2, 4),
+        word_weight: float = 1.0,
+        char_weight: float = 0.5,
+        sublinear_tf: bool = True,
+        idf: Optional[Sequence[float]] = None,
+    ) -> None:
+        lo, hi = char_ngrams
+        if dim <= 0 or lo <= 0 or hi < lo:
+            raise ValueError("[mem][E004] dim and char_ngrams must be positive")
+        self.dim = dim
+        self.char_ngrams = (lo, hi)
+        self.word_weight = word_weight
+        self.char_weight = char_weight
+        self.sublinear_tf = sublinear_tf
+        self.idf: Optional[np.ndarray] = None
+        if idf is not None:
+            self.set_idf(idf)
+
+    @property
+    def name(self) -> str:
+        # 埋め込み空間の識別子 (設定が変わるとベクトルの互換性がなくなる) / Identifies the vector space
+        lo, hi = self.char_ngrams
+        return f"local-hash-{self.dim}-c{lo}{hi}" + ("-idf" if self.idf is not None else "")
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed([text])[0].tolist()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        # (len(texts), dim) の float32 行列を返す / Returns a float32 (n, dim) matrix
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), _BLOCK):
+            counts = self._counts(texts[start : start + _BLOCK])
+            matrix = counts[:, :, 0] - counts[:, :, 1]
+            if self.sublinear_tf:
+                # 頻出特徴の影響を抑える / Dampen repeated features
+                matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+            if self.idf is not None:
+                matrix *= self.idf
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            out[start : start + len(matrix)] = matrix / norms
+        return out
+
+    def fit(self, texts: Iterable[str]) -> "LocalEmbedder":
+        """
+        バケット単位の IDF を推定する / Estimate per-bucket IDF weights from a corpus.
+        推定後のベクトルは推定前と互換性がないため、登録前に 1 度だけ行う。
+        """
+        df = np.zeros(self.dim, dtype=np.float64)
+        total = 0
+        batch: List[str] = []
+        for text in [*texts, None]:
+            if text is not None:
+                batch.append(text)
+                if len(batch) < _BLOCK:
+                    continue
+            if batch:
+                df += (self._counts(batch).sum(axis=2) > 0).sum(axis=0)
+                total += len(batch)
+                batch = []
+        self.set_idf(np.log((1.0 + total) / (1.0 + df)) + 1.0)
+        return self
+
+    def set_idf(self, idf: Sequence[float]) -> None:
+        weights = np.asarray(idf, dtype=np.float64)
+        if weights.shape != (self.dim,):
+            raise ValueError("[mem][E004] idf must have one weight per dimension")
+        self.idf = weights
+
+    def _counts(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        (len(texts), dim, 2) の重み付き出現数 (正/負の符号別) / Weighted counts per bucket and sign.
+        全テキストを \x00 区切りで連結し、コードポイント列の上でまとめてハッシュする。
+        """
+        n_docs, slots = len(texts), 2 * self.dim
+        cps = np.frombuffer("\x00".join(map(_normalize, texts)).encode("utf-32-le"), dtype=np.uint32)
+        # 各位置が属する文書番号 / Document index of every position
+        seps = np.concatenate(([0], np.cumsum(cps == 0)))
+        # 各位置の文書の先頭キー / Key offset of the document at every position
+        base = seps[:-1] * slots
+        counts = np.zeros((n_docs + 1) * slots, dtype=np.float64)
+
+        # 単語: 区切り文字以外の連続区間 / Words: maximal runs of non-break characters
+        word_pos = np.flatnonzero(~_BREAKS[np.minimum(cps, 0xFFFF)])
+        if len(word_pos):
+            starts = np.flatnonzero(np.diff(word_pos, prepend=-2) != 1)
+            lengths = np.diff(np.append(starts, len(word_pos)))
+            offsets = np.arange(len(word_pos)) - np.repeat(starts, lengths)
+            terms = cps[word_pos] * _powers(int(lengths.max()))[offsets]
+            hashes = np.add.reduceat(terms, starts, dtype=np.uint32) ^ _WORD_SALT
+            counts += self.word_weight * self._bincount(hashes, base[word_pos[starts]], counts.size)
+
+        # 文字 n-gram。(n-1)-gram のハッシュから順に伸ばす / Character n-grams, extended one char at a time
+        lo, hi = self.char_ngrams
+        grams = np.zeros(len(cps), dtype=np.uint32)
+        for n in range(1, hi + 1):
+            m = len(cps) - n + 1
+            if m <= 0:
+                break
+            grams = grams[:m] * _BASE + cps[n - 1 :]
+            if n < lo:
+                continue
+            # \x00 をまたぐ窓は捨てる行 (n_docs) へ / Windows spanning a text boundary go to a discarded row
+            docs = np.where(seps[n:] == seps[:m], base[:m], n_docs * slots)
+            salt = np.uint32((int(_CHAR_SALT) * n) & 0xFFFFFFFF)
+            counts += self.char_weight * self._bincount(grams ^ salt, docs, counts.size)
+        return counts.reshape(n_docs + 1, self.dim, 2)[:n_docs]
+
+    def _bincount(self, hashes: np.ndarray, base: np.ndarray, size: int) -> np.ndarray:
+        # 最上位ビットで符号を決め、衝突の偏りを打ち消す / The top bit picks the sign so collisions cancel out
+        mixed = _mix(hashes)
+        slot = (mixed % np.uint32(self.dim)) << np.uint32(1) | (mixed >> np.uint32(31))
+        return np.bincount(base + slot, minlength=size)
+
+
+def _normalize(text: str) -> str:
+    # NFKC・小文字化・空白の正規化。前後に空白を付けて語頭・語末を n-gram に含める / Pad so n-grams see word edges
+    body = " ".join(unicodedata.normalize("NFKC", text).lower().replace("\x00", " ").split())
+    return f" {body} " if body else ""
+
+
+def _powers(length: int) -> np.ndarray:
+    # BASE^0 .. BASE^(length-1) (2^32 を法とする) / Powers of the base, modulo 2^32
+    powers = np.full(max(length, 1), _BASE, dtype=np.uint32)
+    powers[0] = 1
+    return np.cumprod(powers, dtype=np.uint32)
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    # MurmurHash3 の最終化関数 (fmix32) / MurmurHash3 32-bit finalizer
+    h = h ^ (h >> np.uint32(16))
+    h = h * np.uint32(0x85EBCA6B)
+    h = h ^ (h >> np.uint32(13))
+    h = h * np.uint32(0xC2B2AE35)
+    return h ^ (h >> np.uint32(16))
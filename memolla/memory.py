@@ -2,29 +2,48 @@ from __future__ import annotations
 
 import logging
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from dataclasses import asdict
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Sequence
+from typing import AbstractSet, Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
+from .cache import EmbeddingCache, QueryCache, RerankCache, SummaryCache
 from .config import load_provider_settings
-from .indexes import BM25Index, DenseIndex
+from .filters import chroma_metadata, normalize_where, where_key
+from .fusion import FUSION_MODES, FusionStrategy, ThresholdFusion, build_strategy, fuse, single_report
+from .indexes import BM25Index
+from .instrumentation import Instrumentation, Tracer, stage_for
 from .models import (
     ChunkRecord,
     DocumentRecord,
+    IngestReport,
     MessageRecord,
     OptimizeResult,
     SearchResult,
+    SessionSummary,
     TrialConfig,
     TrialResult,
     EvalMetrics,
 )
-from .providers import EmbeddingProvider, LLMProvider, build_client
+from .providers import EmbeddingProvider, EmbeddingScheduler, LLMProvider, build_client
+from .rerank import LLMReranker
 from .storage import SQLiteRepository
-from .utils import chunk_text
+from .summarize import MapReduceSummarizer, chunk_leaves, message_leaves
+from .utils import LRUCache, chunk_spans, epoch_seconds, iter_chunks, iter_text, normalize_text
+from .vectors import VECTOR_BACKENDS, VECTOR_DTYPES, VectorIndex, build_vector_index
 
 logger = logging.getLogger(__name__)
 
+_CHUNK_SIZE = 512
+_CHUNK_OVERLAP = 32
+# 旧形式の版付きチャンク ID "<doc_id>:v<版>:<seq>" と同じ形になりうる doc_id / doc_ids shaped like the legacy scheme
+_LEGACY_VERSIONED = re.compile(r":v[0-9]+$")
+
 
 class Memory:
     @staticmethod
@@ -36,6 +55,8 @@ class Memory:
             "bm25": "lexical",
             "lexical": "lexical",
             "chroma": "vector",
+            "numpy": "vector",
+            "ivf": "vector",
             "vector": "vector",
             "dense": "vector",
         }
@@ -69,11 +90,41 @@ class Memory:
         self.fanout = fanout
         self.rerank_mode = rerank_mode
         self.lexical_backend = "bm25"
-        self.vector_backend = "chroma"
+        # search_modes に "numpy" / "ivf" を含めるか backend_options の vector_backend で選ぶ / Pick the vector backend
+        modes = [search_modes] if isinstance(search_modes, str) else list(search_modes)
+        self.vector_backend = backend_options.get("vector_backend", "chroma")
+        for m in modes:
+            if m.lower() in ("numpy", "ivf"):
+                self.vector_backend = m.lower()
+        if self.vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"[mem][E004] unsupported vector backend: {self.vector_backend}")
+        if backend_options.get("vector_dtype") not in (None, *VECTOR_DTYPES):
+            raise ValueError(f"[mem][E004] unsupported vector dtype: {backend_options['vector_dtype']}")
+        if any(backend_options.get(k) is not None and backend_options[k] <= 0 for k in ("ivf_nlist", "ivf_nprobe")):
+            raise ValueError("[mem][E004] ivf_nlist and ivf_nprobe must be positive")
+        # 融合方式: "weighted" (正規化スコアの加重和) / "rrf"、fusion_adaptive で閾値アルゴリズム / Rank fusion
+        self.fusion_mode = backend_options.get("fusion", "weighted")
+        if self.fusion_mode not in FUSION_MODES:
+            raise ValueError(f"[mem][E004] unsupported fusion mode: {self.fusion_mode}")
+        self.fusion_adaptive = bool(backend_options.get("fusion_adaptive", False))
+        self.rrf_k = backend_options.get("rrf_k", 60)
+        self.fusion_max_candidates: Optional[int] = backend_options.get("fusion_max_candidates")
+        if self.rrf_k <= 0 or (self.fusion_max_candidates is not None and self.fusion_max_candidates <= 0):
+            raise ValueError("[mem][E004] rrf_k and fusion_max_candidates must be positive")
+        embedding_backend = backend_options.get("embedding_backend", "openai")
+        if embedding_backend not in ("openai", "local"):
+            raise ValueError(f"[mem][E004] unsupported embedding backend: {embedding_backend}")
+        # 検索ごとのリトリーバ別タイムアウト (秒) / Per-retriever timeouts in seconds
+        self.lexical_timeout: Optional[float] = backend_options.get("lexical_timeout")
+        self.dense_timeout: Optional[float] = backend_options.get("dense_timeout")
+        self._search_workers = backend_options.get("search_workers", 4)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
 
         self.db_path = Path(db_path or os.getenv("MEMOLLA_DB_PATH", ".memolla/db.sqlite"))
         self.repo = SQLiteRepository(self.db_path)
         self.base_dir = self.db_path.parent
+        self._chunk_cache: LRUCache[str, ChunkRecord] = LRUCache(backend_options.get("chunk_cache_size", 4096))
 
         provider_settings = load_provider_settings(
             model=backend_options.get("model"),
@@ -81,19 +132,204 @@ class Memory:
             api_key=backend_options.get("api_key"),
             base_url=backend_options.get("base_url"),
         )
+        self.provider_settings = provider_settings
+        self.backend_options = backend_options
         client = build_client(provider_settings.api_key, provider_settings.base_url)
-        self.embedding = EmbeddingProvider(client=client, model=provider_settings.embedding_model)
+        embedding_cache = None
+        if backend_options.get("embedding_cache", True):
+            embedding_cache = EmbeddingCache(self.repo, memory_size=backend_options.get("embedding_cache_size", 1024))
+        local_embedder = None
+        if embedding_backend == "local":
+            from .local_embedding import LocalEmbedder
+
+            local_embedder = LocalEmbedder(dim=backend_options.get("local_embedding_dim", 256))
+        self.embedding = EmbeddingProvider(
+            client=client,
+            model=provider_settings.embedding_model,
+            cache=embedding_cache,
+            local=local_embedder,
+            scheduler=EmbeddingScheduler(
+                max_batch_tokens=backend_options.get("embedding_max_batch_tokens", 8000),
+                max_batch_size=backend_options.get("embedding_batch_size", 256),
+                concurrency=backend_options.get("embedding_concurrency", 4),
+                requests_per_minute=backend_options.get("embedding_rpm"),
+                tokens_per_minute=backend_options.get("embedding_tpm"),
+                max_retries=backend_options.get("embedding_max_retries", 2),
+                timeout=backend_options.get("embedding_timeout", 30.0),
+            ),
+        )
         self.llm = LLMProvider(client=client, model=provider_settings.model)
+        # LLM リランクは融合結果の先頭 rerank_candidates 件 (既定 top_k * fanout) のみ / Only the head is reranked
+        self.rerank_candidates: Optional[int] = backend_options.get("rerank_candidates")
+        if self.rerank_candidates is not None and self.rerank_candidates <= 0:
+            raise ValueError("[mem][E004] rerank_candidates must be positive")
+        self.reranker: Optional[LLMReranker] = None
+        if rerank_mode == "llm":
+            self.reranker = LLMReranker(
+                self.llm,
+                batch_size=backend_options.get("rerank_batch_size", 8),
+                concurrency=backend_options.get("rerank_concurrency", 4),
+                budget=backend_options.get("rerank_budget", 2.0),
+                cache=RerankCache(backend_options.get("rerank_cache_size", 4096))
+                if backend_options.get("rerank_cache", True)
+                else None,
+            )
+        self._rerank_warned = False
+        # 長い文書・会話は map-reduce で要約する / Long documents and sessions are summarized map-reduce style
+        self.summarizer = MapReduceSummarizer(
+            self.llm,
+            cache=SummaryCache(self.repo) if backend_options.get("summary_cache", True) else None,
+            concurrency=backend_options.get("summary_concurrency", 4),
+            fan_in=backend_options.get("summary_fan_in", 8),
+            max_tokens=backend_options.get("summary_max_tokens", 3000),
+        )
+        self._summary_leaf_chunks = backend_options.get("summary_leaf_chunks", 8)
+        if self._summary_leaf_chunks <= 0:
+            raise ValueError("[mem][E004] summary_leaf_chunks must be positive")
+        # 会話の逐次要約: 未要約分が閾値を超えたらバックグラウンドで畳み込む / Rolling session summaries
+        self.summary_rolling = bool(backend_options.get("summary_rolling", True))
+        self._fold_messages = backend_options.get("summary_fold_messages", 20)
+        self._fold_tokens = backend_options.get("summary_fold_tokens", 2000)
+        if self._fold_messages <= 0 or self._fold_tokens <= 0:
+            raise ValueError("[mem][E004] summary_fold_messages and summary_fold_tokens must be positive")
+        self._fold_lock = threading.Lock()
+        self._fold_queue_lock = threading.Lock()
+        self._fold_queue: Dict[str, None] = {}
+        self._fold_thread: Optional[threading.Thread] = None
+        self.query_cache: Optional[QueryCache] = None
+        if backend_options.get("query_cache", False):
+            self.query_cache = QueryCache(
+                max_entries=backend_options.get("query_cache_size", 1024),
+                max_bytes=backend_options.get("query_cache_bytes", 32 * 1024 * 1024),
+            )
+        # 縮退した検索の累計 (stats 用。キャッシュ可否は検索ごとのフラグで判定)
+        # / Running total of degraded searches for stats only; cacheability uses the per-search flag
+        self._degraded_searches = 0
+        self._degraded_lock = threading.Lock()
+        # 計測はフック登録か instrumentation=True のときだけ有効 / Only instrumented with a hook or instrumentation=True
+        self._instrumentation: Optional[Instrumentation] = (
+            Instrumentation() if backend_options.get("instrumentation", False) else None
+        )
+        self._index_generation = 0
+        self._knowledge_lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._compact_thread: Optional[threading.Thread] = None
+        self._compaction_threshold = backend_options.get("compaction_threshold", 1000)
+        self._filter_cache: LRUCache[Tuple[int, str], FrozenSet[str]] = LRUCache(16)
 
         chroma_dir = os.getenv("MEMOLLA_CHROMA_PERSIST_DIR") or str(self.base_dir / "chroma")
-        self.bm25_index = BM25Index(base_dir=self.base_dir / "bm25")
+        self._vector_options: Dict[str, Any] = {
+            "embedding": self.embedding,
+            "persist_dir": chroma_dir,
+            "base_dir": self.base_dir / "vectors",
+            "dtype": backend_options.get("vector_dtype"),
+            "rescore": backend_options.get("vector_rescore", 4),
+            "nlist": backend_options.get("ivf_nlist"),
+            "nprobe": backend_options.get("ivf_nprobe"),
+        }
+        # インデックスは初回利用時に生成する (_index 参照) / Indexes are built on first use, see _index
+        self._indexes: Dict[str, Any] = {}
+        self._index_lock = threading.RLock()
+        self._message_lock = threading.RLock()
+        self._pending_messages: List[Tuple[int, ChunkRecord, Dict[str, Any]]] = []
+        self._message_batch = max(1, backend_options.get("message_embedding_batch", 32))
+        self._messages_recovered = False
+        self._pending_tombstones = len(self.repo.tombstoned_chunk_ids())
+
+    @property
+    def bm25_index(self) -> BM25Index:
+        return self._index("bm25_index", lambda: self._with_tombstones(BM25Index(base_dir=self.base_dir / "bm25")))
+
+    @property
+    def message_bm25(self) -> BM25Index:
+        # 会話ログ用のインデックス (ナレッジとは別管理) / Separate indexes for conversation messages
+        return self._index("message_bm25", lambda: BM25Index(base_dir=self.base_dir / "bm25_messages"))
+
+    @property
+    def dense_index(self) -> Optional[VectorIndex]:
+        return self._index("dense_index", lambda: self._with_tombstones(self._build_dense("memolla_chunks")))
+
+    @property
+    def message_dense(self) -> Optional[VectorIndex]:
+        return self._index("message_dense", lambda: self._build_dense("memolla_messages"))
+
+    @property
+    def dense_available(self) -> bool:
+        return self.dense_index is not None
+
+    def _index(self, name: str, factory: Callable[[], Any]) -> Any:
+        # 初回アクセス時に生成してキャッシュ (bm25 のみなら Chroma を import しない) / Build once, on first access
         try:
-            self.dense_index = DenseIndex(persist_dir=chroma_dir, embedding=self.embedding)
-            self.dense_available = True
+            return self._indexes[name]
+        except KeyError:
+            pass
+        with self._index_lock:
+            if name not in self._indexes:
+                self._indexes[name] = factory()
+            return self._indexes[name]
+
+    def _build_dense(self, collection: str) -> Optional[VectorIndex]:
+        # ベクトル検索を使わない構成ではベクトルインデックスを持たない / No vector index unless vector search is enabled
+        if "vector" not in self.search_modes:
+            return None
+        try:
+            return build_vector_index(self.vector_backend, collection=collection, **self._vector_options)
         except Exception as exc:  # pragma: no cover - defensive fallback
             logger.warning("[mem][W01] dense index unavailable, fallback to bm25 (%s)", exc)
-            self.dense_available = False
-            self.dense_index = None  # type: ignore
+            return None
+
+    # 計測フック / instrumentation hooks
+    def add_tracer(self, tracer: Tracer) -> None:
+        """
+        段階ごとの計測結果を受け取るコールバックを登録する / Register a callback receiving StageEvent per stage.
+        例外は記録して握りつぶす。検索・登録の呼び出しスレッド (並列検索時はワーカースレッド) で同期的に呼ばれる。
+        """
+        if self._instrumentation is None:
+            self._instrumentation = Instrumentation()
+        self._instrumentation.add_tracer(tracer)
+
+    def remove_tracer(self, tracer: Tracer) -> None:
+        if self._instrumentation is not None:
+            self._instrumentation.remove_tracer(tracer)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        計測値のスナップショット / Snapshot of stage latency histograms, counters and cache stats.
+        stages・counters は計測が有効なときのみ埋まる (add_tracer または instrumentation=True)。
+        """
+        snapshot = (
+            self._instrumentation.snapshot() if self._instrumentation is not None else {"stages": {}, "counters": {}}
+        )
+        cache = self.embedding.cache
+        rerank_cache = self.reranker.cache if self.reranker is not None else None
+        return {
+            "enabled": self._instrumentation is not None,
+            **snapshot,
+            "degraded_searches": self._degraded_count(),
+            "embedding_cache": cache.stats() if cache is not None else None,
+            "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+            "rerank_cache": rerank_cache.stats() if rerank_cache is not None else None,
+            "summary_cache": self.summarizer.cache.stats() if self.summarizer.cache is not None else None,
+        }
+
+    def reset_stats(self) -> None:
+        if self._instrumentation is not None:
+            self._instrumentation.reset()
+
+    def _stage(self, name: str) -> Any:
+        # 無効時は共有の no-op を返すだけ / Returns a shared no-op unless instrumented
+        return stage_for(self._instrumentation, name)
+
+    def _count(self, name: str, n: int = 1) -> None:
+        if self._instrumentation is not None:
+            self._instrumentation.count(name, n)
+
+    def _with_tombstones(self, index: Any) -> Any:
+        # 未コンパクションの tombstone を再起動後も適用 / Re-apply tombstones that survived a restart
+        tombstones = self.repo.tombstoned_chunk_ids()
+        if index is not None and tombstones:
+            index.delete(tombstones)
+        return index
 
     # 会話ログ追加 / add conversation log
     def add_conversation(
@@ -111,11 +347,119 @@ class Memory:
             session_id=session_id,
             role=role,
             raw_content=content,
-            normalized_content=None,
+            normalized_content=normalize_text(content),
             metadata=metadata or {},
             created_at=now,
         )
-        self.repo.save_message(msg)
+        with self._message_lock:
+            self._recover_messages_locked()
+            msg_id = self.repo.save_message(msg)
+            self._index_messages_locked([(msg_id, msg)])
+        if self._rolling_enabled():
+            self._maybe_fold(session_id)
+
+    # 会話の逐次要約 / rolling session summaries
+    def refresh_summary(self, session_id: str) -> Optional[SessionSummary]:
+        """
+        未要約のメッセージを逐次要約に畳み込んで返す / Fold messages past the watermark into the rolling summary.
+        閾値によるバックグラウンド更新を待たずに呼べる。メッセージが無い場合や LLM クライアントが無い場合は保存済みの要約 (無ければ None)。
+        """
+        with self._fold_lock:
+            current = self.repo.get_session_summary(session_id)
+            if not self.llm.client:
+                return current
+            items = self.repo.session_messages_after(session_id, current.last_message_id if current else 0)
+            if not items:
+                return current
+            with self._stage("summary.fold") as stage:
+                summary = self.summarizer.fold(current.summary if current else "", [msg for _, msg in items])
+                stage.items = len(items)
+            record = SessionSummary(
+                session_id=session_id,
+                summary=summary,
+                last_message_id=items[-1][0],
+                message_count=(current.message_count if current else 0) + len(items),
+                updated_at=datetime.utcnow(),
+            )
+            self.repo.save_session_summary(record)
+            return record
+
+    def _rolling_enabled(self) -> bool:
+        # フォールバック要約 (切り詰め) は畳み込めないため LLM クライアント必須 / Truncation cannot be folded
+        return self.summary_rolling and bool(self.llm.client)
+
+    def _maybe_fold(self, session_id: str) -> None:
+        count, size = self.repo.pending_summary_stats(session_id)
+        # estimate_tokens と同じ見積もり (UTF-8 バイト数 / 3) / Same estimate as providers.estimate_tokens
+        if count >= self._fold_messages or size // 3 + count >= self._fold_tokens:
+            self._schedule_fold(session_id)
+
+    def _schedule_fold(self, session_id: str) -> None:
+        with self._fold_queue_lock:
+            self._fold_queue[session_id] = None
+            if self._fold_thread is None:
+                self._fold_thread = threading.Thread(target=self._fold_background, name="memolla-summary", daemon=True)
+                self._fold_thread.start()
+
+    def _fold_background(self) -> None:
+        try:
+            while True:
+                with self._fold_queue_lock:
+                    if not self._fold_queue:
+                        self._fold_thread = None
+                        return
+                    session_id = next(iter(self._fold_queue))
+                    del self._fold_queue[session_id]
+                try:
+                    self.refresh_summary(session_id)
+                except Exception:
+                    logger.exception("Failed to update the rolling summary of session %s", session_id)
+        finally:
+            self.repo.release_thread()
+
+    def _recover_messages_locked(self) -> None:
+        # 未反映のメッセージ (既存 DB・前回の異常終了) を初回に取り込む / Index leftovers once per process
+        if self._messages_recovered:
+            return
+        self._messages_recovered = True
+        backlog = self.repo.unindexed_messages()
+        if backlog:
+            logger.info("Indexing %d conversation messages", len(backlog))
+        for start in range(0, len(backlog), 1024):
+            self._index_messages_locked(backlog[start : start + 1024])
+
+    def _index_messages_locked(self, items: List[Tuple[int, MessageRecord]]) -> None:
+        # BM25 には即時追加、埋め込みはバッチ単位で送る / BM25 immediately, embeddings in batches
+        records = [
+            (
+                msg_id,
+                ChunkRecord(chunk_id=f"msg:{msg_id}", doc_id=msg.session_id, seq=msg_id, text=msg.raw_content),
+                {"session_id": msg.session_id, "role": msg.role, "created_at": epoch_seconds(msg.created_at)},
+            )
+            for msg_id, msg in items
+        ]
+        self.message_bm25.add_chunks([chunk for _, chunk, _ in records])
+        if self.dense_available and self.message_dense is not None:
+            self._pending_messages.extend(records)
+            if len(self._pending_messages) >= self._message_batch:
+                self._flush_messages_locked()
+        else:
+            self.repo.mark_messages_indexed(msg_id for msg_id, _, _ in records)
+
+    def _flush_messages_locked(self) -> None:
+        pending, self._pending_messages = self._pending_messages, []
+        if not pending:
+            return
+        chunks = [chunk for _, chunk, _ in pending]
+        try:
+            embeddings = self.embedding.embed_texts([c.text for c in chunks])
+            self.message_dense.add_embeddings(chunks, embeddings, [meta for _, _, meta in pending])
+        except Exception as exc:
+            # 未反映のまま残し次回に再送する / Keep them pending and retry on the next flush
+            self._pending_messages = pending + self._pending_messages
+            logger.warning("[mem][W01] %s message indexing failed, will retry (%s)", self.vector_backend, exc)
+            return
+        self.repo.mark_messages_indexed(msg_id for msg_id, _, _ in pending)
 
     # ナレッジ追加 / add knowledge
     def add_knowledge(
@@ -124,26 +468,350 @@ class Memory:
         text: str,
         metadata: Optional[Dict[str, Any]] = None,
     ) -> None:
-        if self.repo.document_exists(doc_id):
-            raise ValueError("[mem][E002] doc_id already exists")
-        now = datetime.utcnow()
+        chunks = self._store_document(doc_id, text, metadata)
+        self._index_chunks(chunks)
+
+    def _store_document(self, doc_id: str, text: str, metadata: Optional[Dict[str, Any]]) -> List[ChunkRecord]:
+        with self._knowledge_lock:
+            if self.repo.document_exists(doc_id):
+                raise ValueError("[mem][E002] doc_id already exists")
+            version = self.repo.tombstone_versions([doc_id]).get(doc_id, 0) + 1
+            with self._stage("ingest.chunk") as stage:
+                doc, chunks = self._build_document(doc_id, text, metadata, datetime.utcnow(), version)
+                stage.items = len(chunks)
+            with self._stage("ingest.sqlite") as stage:
+                self.repo.save_document(doc, chunks)
+                stage.items = len(chunks)
+        return chunks
+
+    # ナレッジ更新 / update knowledge
+    def update_knowledge(
+        self,
+        doc_id: str,
+        text: str,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> DocumentRecord:
+        """
+        文書を置き換え、version を 1 上げる / Replace a document and bump its version.
+        内容が変わらないチャンクは ID と埋め込みをそのまま使い、変わったチャンクのみ再埋め込みする。
+        古いチャンクは tombstone として即座に検索対象から外れる。metadata=None なら既存のメタデータを保持する。
+        """
+        doc, new_chunks, kept, removed = self._store_update(doc_id, text, metadata)
+        self._index_chunks(new_chunks)
+        if kept and self.dense_available and self.dense_index:
+            self.dense_index.update_metadata([c.chunk_id for c in kept], self._chunk_metadatas(kept))
+        return doc
+
+    def _store_update(
+        self,
+        doc_id: str,
+        text: str,
+        metadata: Optional[Dict[str, Any]],
+    ) -> Tuple[DocumentRecord, List[ChunkRecord], List[ChunkRecord], List[str]]:
+        with self._knowledge_lock:
+            current = self.repo.get_document(doc_id)
+            if not current:
+                raise ValueError("[mem][E006] target not found")
+            now = datetime.utcnow()
+            doc, chunks = self._build_document(
+                doc_id, text, current.metadata if metadata is None else metadata, now, current.version + 1
+            )
+            doc.created_at = current.created_at
+            # 同じ本文のチャンクは旧 ID を引き継ぐ / Chunks with unchanged text keep their old ids
+            old_by_text: Dict[str, List[str]] = {}
+            for old in self.repo.list_chunks(doc_id):
+                old_by_text.setdefault(old.text, []).append(old.chunk_id)
+            new_chunks: List[ChunkRecord] = []
+            kept: List[ChunkRecord] = []
+            for chunk in chunks:
+                reusable = old_by_text.get(chunk.text)
+                if reusable:
+                    chunk.chunk_id = reusable.pop(0)
+                    kept.append(chunk)
+                else:
+                    new_chunks.append(chunk)
+            removed = [cid for ids in old_by_text.values() for cid in ids]
+            self.repo.replace_document(doc, new_chunks, kept, removed, now)
+            self._tombstone(removed, [c.chunk_id for c in kept])
+        return doc, new_chunks, kept, removed
+
+    # ナレッジ削除 / delete knowledge
+    def delete_knowledge(self, doc_id: str) -> None:
+        with self._knowledge_lock:
+            chunk_ids = self.repo.delete_document(doc_id, datetime.utcnow())
+            if chunk_ids is None:
+                raise ValueError("[mem][E006] target not found")
+            self._tombstone(chunk_ids)
+
+    def _tombstone(self, chunk_ids: List[str], refreshed: Sequence[str] = ()) -> None:
+        # インデックスから即座に外し、物理削除はコンパクションで行う / Hide from indexes now, purge on compaction
+        if chunk_ids:
+            self.bm25_index.delete(chunk_ids)
+            if self.dense_available and self.dense_index:
+                self.dense_index.delete(chunk_ids)
+        # 引き継いだチャンクも seq が変わりうるためキャッシュを捨てる / Kept chunks may have a new seq
+        for cid in [*chunk_ids, *refreshed]:
+            self._chunk_cache.discard(cid)
+        self._bump_index_generation()
+        self._pending_tombstones += len(chunk_ids)
+        if self._pending_tombstones >= self._compaction_threshold:
+            self._schedule_compaction()
+
+    # コンパクション / compaction
+    def compact(self) -> int:
+        """
+        tombstone 済みチャンクを BM25・Chroma から物理削除する / Purge tombstoned chunks from BM25 and Chroma.
+        インデックスを書き直してから差し替えるため、実行中も検索はブロックされない。戻り値は削除したチャンク数。
+        """
+        with self._compact_lock:
+            with self._knowledge_lock:
+                # ここで読んだ tombstone は全てインデックスにも反映済み / All of these are already hidden in the indexes
+                tombstones = self.repo.tombstoned_chunk_ids()
+                self._pending_tombstones = 0
+            if not tombstones:
+                return 0
+            self.bm25_index.compact()
+            if self.dense_available and self.dense_index:
+                self.dense_index.compact()
+            self.repo.purge_tombstones(tombstones)
+            logger.info("Compacted %d tombstoned chunks", len(tombstones))
+            return len(tombstones)
+
+    def _schedule_compaction(self) -> None:
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+        self._compact_thread = threading.Thread(target=self._compact_background, name="memolla-compact", daemon=True)
+        self._compact_thread.start()
+
+    def _compact_background(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Failed to compact indexes")
+        finally:
+            self.repo.release_thread()
+
+    # ナレッジ一括追加 / bulk add knowledge
+    def add_knowledge_many(
+        self,
+        items: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]],
+        *,
+        batch_size: int = 256,
+        skip_existing: bool = False,
+    ) -> IngestReport:
+        """
+        (doc_id, text, metadata) の列を一括登録する / Bulk-ingest (doc_id, text, metadata) tuples.
+        batch_size 文書ごとに重複確認 1 クエリ・SQLite 1 トランザクション・インデックス更新 1 回で処理する。
+        skip_existing=False の場合、重複を含むバッチは保存せず E002 を送出する（先行バッチは保存済み）。
+        """
+        if batch_size <= 0:
+            raise ValueError("[mem][E004] batch_size must be positive")
+        started = time.perf_counter()
+        total_docs = total_chunks = skipped = 0
+        for batch, duplicates in self._iter_batches(items, batch_size, skip_existing):
+            records, existing = self._store_batch(batch, skip_existing)
+            skipped += duplicates + existing
+            chunks = [c for _, doc_chunks in records for c in doc_chunks]
+            self._index_chunks(chunks)
+            total_docs += len(records)
+            total_chunks += len(chunks)
+        return self._ingest_report(started, total_docs, total_chunks, skipped)
+
+    # ナレッジのストリーム登録 / streaming knowledge ingestion
+    def add_knowledge_stream(
+        self,
+        doc_id: str,
+        source: Any,
+        metadata: Optional[Dict[str, Any]] = None,
+        *,
+        batch_chunks: int = 256,
+        encoding: str = "utf-8",
+    ) -> IngestReport:
+        """
+        巨大な文書を一定のメモリ使用量で登録する / Ingest a huge document with flat memory use.
+        source はファイルパス (str / PathLike)・ファイルオブジェクト・str/bytes の iterable。
+        batch_chunks チャンクごとに SQLite 保存・埋め込み・インデックス登録を行う。失敗時は登録済みの分を削除する。
+        """
+        if batch_chunks <= 0:
+            raise ValueError("[mem][E004] batch_chunks must be positive")
+        started = time.perf_counter()
+        with self._knowledge_lock:
+            if self.repo.document_exists(doc_id):
+                raise ValueError("[mem][E002] doc_id already exists")
+            version = self.repo.tombstone_versions([doc_id]).get(doc_id, 0) + 1
+            now = datetime.utcnow()
+            doc = DocumentRecord(
+                doc_id=doc_id, corpus="", metadata=metadata or {}, created_at=now, updated_at=now, version=version
+            )
+            # ロックを離す前に documents 行を入れて doc_id を予約する / Reserve the doc_id before releasing the lock
+            self.repo.save_document(doc, [])
+        stride = _CHUNK_SIZE - _CHUNK_OVERLAP
+        # stored: 保存済みの本文長, length: 読み込み済みの本文長 / Corpus chars persisted / read so far
+        stored = length = total = 0
+        batch: List[ChunkRecord] = []
+        parts: List[str] = []
+        try:
+            pieces = iter_text(source, encoding=encoding)
+            for seq, text in enumerate(iter_chunks(pieces, chunk_size=_CHUNK_SIZE, overlap=_CHUNK_OVERLAP)):
+                # iter_chunks の窓は stride 文字ずつ進む / iter_chunks windows advance by `stride` chars
+                start = seq * stride
+                batch.append(
+                    ChunkRecord(
+                        chunk_id=_chunk_id(doc_id, version, seq),
+                        doc_id=doc_id,
+                        seq=seq,
+                        text=text,
+                        start=start,
+                        end=start + len(text),
+                    )
+                )
+                # 本文にはチャンクの重なりを除いた続きだけを足す / Append only the part not stored yet
+                parts.append(text[length - start :])
+                length = start + len(text)
+                if len(batch) >= batch_chunks:
+                    self._store_stream_batch(doc, stored, parts, batch)
+                    stored, total = length, total + len(batch)
+                    batch, parts = [], []
+            if batch:
+                self._store_stream_batch(doc, stored, parts, batch)
+                stored, total = length, total + len(batch)
+        except BaseException:
+            # 予約した行・保存済みのバッチ (索引登録前に失敗した分も) を消す / Undo the reservation and every stored batch
+            self.delete_knowledge(doc_id)
+            raise
+        return self._ingest_report(started, 1, total, 0)
+
+    def _store_stream_batch(self, doc: DocumentRecord, start: int, parts: List[str], chunks: List[ChunkRecord]) -> None:
+        with self._stage("ingest.sqlite") as stage:
+            self.repo.append_document_text(doc.doc_id, start, "".join(parts), chunks)
+            stage.items = len(chunks)
+        self._index_chunks(chunks)
+
+    @staticmethod
+    def _iter_batches(
+        items: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]],
+        batch_size: int,
+        skip_existing: bool,
+    ) -> Iterator[Tuple[List[Tuple[str, str, Optional[Dict[str, Any]]]], int]]:
+        # 入力内の重複を除きつつ batch_size 件ずつ返す / Yield batches, dropping in-input duplicates
+        seen: Set[str] = set()
+        batch: List[Tuple[str, str, Optional[Dict[str, Any]]]] = []
+        duplicates = 0
+        for item in items:
+            doc_id, text = item[0], item[1]
+            metadata = item[2] if len(item) > 2 else None
+            if doc_id in seen:
+                if not skip_existing:
+                    raise ValueError("[mem][E002] doc_id already exists")
+                duplicates += 1
+                continue
+            seen.add(doc_id)
+            batch.append((doc_id, text, metadata))
+            if len(batch) >= batch_size:
+                yield batch, duplicates
+                batch, duplicates = [], 0
+        if batch or duplicates:
+            yield batch, duplicates
+
+    def _store_batch(
+        self,
+        batch: List[Tuple[str, str, Optional[Dict[str, Any]]]],
+        skip_existing: bool,
+    ) -> Tuple[List[Tuple[DocumentRecord, List[ChunkRecord]]], int]:
+        # 重複確認 1 クエリ + 1 トランザクションで保存 / One duplicate query and one transaction per batch
+        if not batch:
+            return [], 0
+        with self._knowledge_lock:
+            existing = self.repo.existing_doc_ids(doc_id for doc_id, _, _ in batch)
+            if existing and not skip_existing:
+                raise ValueError("[mem][E002] doc_id already exists")
+            now = datetime.utcnow()
+            versions = self.repo.tombstone_versions(doc_id for doc_id, _, _ in batch if doc_id not in existing)
+            with self._stage("ingest.chunk") as stage:
+                records = [
+                    self._build_document(doc_id, text, metadata, now, versions.get(doc_id, 0) + 1)
+                    for doc_id, text, metadata in batch
+                    if doc_id not in existing
+                ]
+                stage.items = sum(len(chunks) for _, chunks in records)
+            if records:
+                with self._stage("ingest.sqlite") as stage:
+                    self.repo.save_documents(records)
+                    stage.items = sum(len(chunks) for _, chunks in records)
+        return records, len(batch) - len(records)
+
+    @staticmethod
+    def _ingest_report(started: float, documents: int, chunks: int, skipped: int) -> IngestReport:
+        report = IngestReport(
+            documents=documents,
+            chunks=chunks,
+            skipped=skipped,
+            elapsed_sec=time.perf_counter() - started,
+        )
+        logger.info(
+            "Ingested %d docs / %d chunks in %.2fs (%.1f docs/s, %.1f chunks/s)",
+            report.documents,
+            report.chunks,
+            report.elapsed_sec,
+            report.docs_per_sec,
+            report.chunks_per_sec,
+        )
+        return report
+
+    def _build_document(
+        self,
+        doc_id: str,
+        text: str,
+        metadata: Optional[Dict[str, Any]],
+        now: datetime,
+        version: int = 1,
+    ) -> Tuple[DocumentRecord, List[ChunkRecord]]:
         doc = DocumentRecord(
             doc_id=doc_id,
             corpus=text,
             metadata=metadata or {},
             created_at=now,
             updated_at=now,
-            version=1,
+            version=version,
         )
-        chunks_raw = chunk_text(text, chunk_size=512, overlap=32)
+        spans = chunk_spans(len(text), chunk_size=_CHUNK_SIZE, overlap=_CHUNK_OVERLAP)
         chunks: List[ChunkRecord] = []
-        for idx, chunk_text_value in enumerate(chunks_raw):
-            chunk_id = f"{doc_id}:{idx}"
-            chunks.append(ChunkRecord(chunk_id=chunk_id, doc_id=doc_id, seq=idx, text=chunk_text_value))
-        self.repo.save_document(doc, chunks)
-        self.bm25_index.add_chunks(chunks)
-        if self.dense_available and self.dense_index:
-            self.dense_index.add_chunks(chunks)
+        for idx, (start, end) in enumerate(spans):
+            chunk_id = _chunk_id(doc_id, version, idx)
+            chunks.append(
+                ChunkRecord(chunk_id=chunk_id, doc_id=doc_id, seq=idx, text=text[start:end], start=start, end=end)
+            )
+        return doc, chunks
+
+    def _index_chunks(self, chunks: List[ChunkRecord], embeddings: Optional[List[List[float]]] = None) -> None:
+        try:
+            with self._stage("ingest.bm25") as stage:
+                self.bm25_index.add_chunks(chunks)
+                stage.items = len(chunks)
+            if self.dense_available and self.dense_index and chunks:
+                metadatas = self._chunk_metadatas(chunks)
+                if embeddings is None:
+                    # add_chunks と同じ処理を埋め込みと登録に分けて計測 / Same as add_chunks, timed in two stages
+                    with self._stage("ingest.embed") as stage:
+                        embeddings = self.embedding.embed_texts([c.text for c in chunks])
+                        stage.items = len(chunks)
+                with self._stage("ingest.vector") as stage:
+                    self.dense_index.add_embeddings(chunks, embeddings, metadatas)
+                    stage.items = len(chunks)
+        finally:
+            # 途中で失敗しても反映済みの分があるため必ず世代を進める / Always invalidate, even on partial failure
+            self._bump_index_generation()
+
+    def _chunk_metadatas(self, chunks: List[ChunkRecord]) -> List[Dict[str, Any]]:
+        # where 句で絞り込めるよう文書メタデータをチャンクへ複製 / Copy document metadata onto chunks for `where`
+        doc_meta = self.repo.get_documents_metadata(c.doc_id for c in chunks)
+        return [{**chroma_metadata(doc_meta.get(c.doc_id, {})), "doc_id": c.doc_id, "seq": c.seq} for c in chunks]
+
+    def _bump_index_generation(self) -> None:
+        # インデックス内容が変わったら検索結果キャッシュを無効化 / Invalidate cached results on index changes
+        self._index_generation += 1
+        if self.query_cache is not None:
+            self.query_cache.bump()
 
     # 会話取得 / get conversation
     def get_conversation(self, session_id: str) -> List[MessageRecord]:
@@ -157,75 +825,387 @@ class Memory:
         return doc
 
     # 検索 / search
-    def search(self, query: str, top_k: int = 5) -> List[SearchResult]:
+    def search(self, query: str, top_k: int = 5, *, where: Optional[Dict[str, Any]] = None) -> List[SearchResult]:
+        """
+        ナレッジをハイブリッド検索する / Hybrid search over knowledge chunks.
+        where は文書メタデータに対する Chroma 形式の条件 ($eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$and/$or)。
+        """
         if top_k <= 0:
             raise ValueError("[mem][E004] top_k must be positive")
+        with self._stage("search.total") as stage:
+            results = self._search(query, top_k, where)
+            stage.items = len(results)
+        return results
 
+    def _search(self, query: str, top_k: int, where: Optional[Dict[str, Any]]) -> List[SearchResult]:
         use_lexical = "lexical" in self.search_modes
         use_vector = "vector" in self.search_modes
+        where = normalize_where(where) if where is not None else None
 
-        bm25_hits: List[tuple[str, float]] = []
-        dense_hits: List[tuple[str, float]] = []
+        cache_key, generation = self._query_cache_key(query, top_k, where), 0
+        if cache_key is not None:
+            generation = self.query_cache.generation
+            cached = self.query_cache.get(cache_key)
+            self._count("search.query_cache_hits" if cached is not None else "search.query_cache_misses")
+            if cached is not None:
+                return cached
 
-        if use_lexical:
-            lexical_k = max(top_k, top_k * self.fanout)
-            bm25_hits = self.bm25_index.search(query, top_k=lexical_k)
+        allowed = self._allowed_chunks(where)
+        if allowed is not None and not allowed:
+            return []
+        fusion: Optional[ThresholdFusion] = None
+        if self._adaptive_fusion(use_lexical, use_vector):
+            fusion, degraded = self._retrieve_adaptive(query, top_k, allowed=allowed, where=where)
+            bm25_hits, dense_hits = fusion.lists
+        else:
+            candidate_k = max(top_k, top_k * self.fanout)
+            bm25_hits, dense_hits, degraded = self._retrieve(
+                query, candidate_k, use_lexical=use_lexical, use_vector=use_vector, allowed=allowed, where=where
+            )
+        results, partial = self._finalize_search(query, top_k, bm25_hits, dense_hits, fusion=fusion)
+        self._store_query_cache(cache_key, results, generation, degraded or partial)
+        return results
 
-        if use_vector:
-            if self.dense_available and self.dense_index:
-                try:
-                    vector_k = max(top_k, top_k * self.fanout)
-                    dense_hits = self.dense_index.search(query, top_k=vector_k)
-                except Exception as exc:  # pragma: no cover - defensive fallback
-                    logger.warning("[mem][W01] %s index unavailable, fallback to bm25 (%s)", self.vector_backend, exc)
-                    dense_hits = []
-            else:
-                logger.warning("[mem][W01] %s index unavailable, fallback to bm25", self.vector_backend)
-                dense_hits = []
+    # 会話検索 / search conversation
+    def search_conversation(
+        self,
+        query: str,
+        top_k: int = 5,
+        *,
+        session_id: Optional[str] = None,
+        role: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[SearchResult]:
+        """
+        会話ログをハイブリッド検索する / Hybrid search over conversation messages.
+        session_id・role・期間 (since 以上 until 未満) で絞り込める。結果の doc_id は session_id。
+        """
+        if top_k <= 0:
+            raise ValueError("[mem][E004] top_k must be positive")
+        self._prepare_message_search()
+        allowed, where = self._message_filters(session_id, role, since, until)
+        if allowed is not None and not allowed:
+            return []
+
+        use_lexical = "lexical" in self.search_modes
+        use_vector = "vector" in self.search_modes
+        indexes = {"lexical_index": self.message_bm25, "dense_index": self.message_dense}
+        fusion: Optional[ThresholdFusion] = None
+        if self._adaptive_fusion(use_lexical, use_vector):
+            fusion, _ = self._retrieve_adaptive(query, top_k, allowed=allowed, where=where, **indexes)
+            bm25_hits, dense_hits = fusion.lists
+        else:
+            candidate_k = max(top_k, top_k * self.fanout)
+            bm25_hits, dense_hits, _ = self._retrieve(
+                query,
+                candidate_k,
+                use_lexical=use_lexical,
+                use_vector=use_vector,
+                allowed=allowed,
+                where=where,
+                **indexes,
+            )
+        results, _ = self._finalize_search(
+            query, top_k, bm25_hits, dense_hits, resolve=self._resolve_messages, fusion=fusion
+        )
+        return results
+
+    def _prepare_message_search(self) -> None:
+        # 検索前に保留中の埋め込みを反映 / Make pending messages visible to dense search
+        with self._message_lock:
+            self._recover_messages_locked()
+            self._flush_messages_locked()
+
+    def _message_filters(
+        self,
+        session_id: Optional[str],
+        role: Optional[str],
+        since: Optional[datetime],
+        until: Optional[datetime],
+    ) -> Tuple[Optional[Set[str]], Optional[Dict[str, Any]]]:
+        # BM25 用の許可 ID 集合と Chroma 用の where 句 / Allowed ids for BM25, where clause for Chroma
+        if session_id is None and role is None and since is None and until is None:
+            return None, None
+        ids = self.repo.find_message_ids(session_id=session_id, role=role, since=since, until=until)
+        clauses: List[Dict[str, Any]] = []
+        if session_id is not None:
+            clauses.append({"session_id": session_id})
+        if role is not None:
+            clauses.append({"role": role})
+        if since is not None:
+            clauses.append({"created_at": {"$gte": epoch_seconds(since)}})
+        if until is not None:
+            clauses.append({"created_at": {"$lt": epoch_seconds(until)}})
+        where = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+        return {f"msg:{i}" for i in ids}, where
 
+    def _allowed_chunks(self, where: Optional[Dict[str, Any]]) -> Optional[AbstractSet[str]]:
+        # where に一致するチャンク ID 集合をインデックス世代ごとにキャッシュ / Allowed-set cached per index generation
+        if where is None:
+            return None
+        key = (self._index_generation, where_key(where))
+        allowed = self._filter_cache.get(key)
+        if allowed is None:
+            with self._stage("search.filter") as stage:
+                allowed = frozenset(self.repo.chunk_ids_matching(where))
+                stage.items = len(allowed)
+            self._filter_cache.put(key, allowed)
+        else:
+            self._count("search.filter_cache_hits")
+        return allowed
+
+    def _query_cache_key(self, query: str, top_k: int, where: Optional[Dict[str, Any]] = None) -> Optional[tuple]:
+        if self.query_cache is None:
+            return None
+        return (
+            QueryCache.normalize(query),
+            top_k,
+            tuple(self.search_modes),
+            self.hybrid_alpha,
+            self.fanout,
+            self.rerank_mode,
+            self.fusion_mode,
+            self.fusion_adaptive,
+            where_key(where) if where is not None else None,
+        )
+
+    def _store_query_cache(
+        self,
+        cache_key: Optional[tuple],
+        results: List[SearchResult],
+        generation: int,
+        degraded: bool,
+    ) -> None:
+        # タイムアウト等で縮退した結果はキャッシュしない / Never cache degraded (timed-out) results
+        if cache_key is None or degraded:
+            return
+        self.query_cache.put(cache_key, results, generation)
+
+    def _finalize_search(
+        self,
+        query: str,
+        top_k: int,
+        bm25_hits: List[tuple[str, float]],
+        dense_hits: List[tuple[str, float]],
+        resolve: Optional[Callable[[List[str]], Dict[str, Tuple[str, str, Dict[str, Any]]]]] = None,
+        fusion: Optional[ThresholdFusion] = None,
+    ) -> Tuple[List[SearchResult], bool]:
+        # 融合・リランク・ハイドレーション (同期/非同期 API 共通) / Fusion, rerank and hydration
+        # 戻り値の bool は LLM リランクが予算切れで欠けたかどうか / The flag tells whether the LLM rerank was cut short
+        resolve = resolve or self._resolve_chunks
+        use_lexical = "lexical" in self.search_modes
+        use_vector = "vector" in self.search_modes
         if use_lexical and not use_vector:
-            return self._hits_to_results(bm25_hits, top_k, use_bm25=True, use_dense=False)
+            return self._hits_to_results(bm25_hits, top_k, use_bm25=True, use_dense=False, resolve=resolve), False
         if use_vector and not use_lexical:
-            return self._hits_to_results(dense_hits, top_k, use_bm25=False, use_dense=True)
+            return self._hits_to_results(dense_hits, top_k, use_bm25=False, use_dense=True, resolve=resolve), False
 
-        merged = self._merge_scores(bm25_hits, dense_hits, alpha=self.hybrid_alpha)
+        # リランクしない場合は top_k 件だけをヒープで選ぶ / Partial top-k selection unless reranking
+        limit = None if self.rerank_mode == "llm" else top_k
+        with self._stage("search.merge") as stage:
+            if fusion is not None:
+                merged, report = fusion.result(limit), fusion.report
+            else:
+                lists = (bm25_hits, dense_hits)
+                merged, report = fuse(self._fusion_strategy(), lists, limit), single_report(self.fusion_mode, lists)
+            stage.items = report.candidates
+            stage.detail = report
+        self._count("fusion.rounds", report.rounds)
+        self._count("fusion.candidates_bm25", report.candidates_bm25)
+        self._count("fusion.candidates_dense", report.candidates_dense)
+        resolved, partial = None, False
         if self.rerank_mode == "llm":
-            merged = self._rerank_llm(merged, query, top_k)
-        return self._merged_to_results(merged, top_k)
+            merged, resolved, partial = self._rerank_llm(merged, query, top_k, resolve)
+        return self._merged_to_results(merged, top_k, resolve, resolved), partial
+
+    def _fusion_strategy(self) -> FusionStrategy:
+        return build_strategy(self.fusion_mode, alpha=self.hybrid_alpha, rrf_k=self.rrf_k)
+
+    def _adaptive_fusion(self, use_lexical: bool, use_vector: bool) -> bool:
+        # 閾値アルゴリズムはハイブリッド検索のときのみ / Threshold fusion only applies to hybrid search
+        return self.fusion_adaptive and use_lexical and use_vector
+
+    def _threshold_fusion(self, top_k: int) -> ThresholdFusion:
+        # top_k * fanout 件から始め、top-k が変わりうる間だけ倍々に深く取る / Deepen only while top-k may change
+        start = max(top_k, top_k * self.fanout)
+        max_depth = self.fusion_max_candidates or start * 4
+        return ThresholdFusion(self._fusion_strategy(), top_k, start=start, max_depth=max_depth)
 
-    def _get_chunk(self, doc_id: str, chunk_id: str) -> Optional[ChunkRecord]:
-        chunks = self.repo.list_chunks(doc_id)
-        for c in chunks:
-            if c.chunk_id == chunk_id:
-                return c
-        return None
+    def _retrieve_adaptive(self, query: str, top_k: int, **options: Any) -> Tuple[ThresholdFusion, bool]:
+        fusion = self._threshold_fusion(top_k)
+        *lists, degraded = self._retrieve(query, fusion.depth, use_lexical=True, use_vector=True, **options)
+        while fusion.update(tuple(lists)):
+            lexical, vector = fusion.wants
+            *lists, again = self._retrieve(query, fusion.depth, use_lexical=lexical, use_vector=vector, **options)
+            degraded = degraded or again
+        return fusion, degraded
 
-    def _merge_scores(
+    def _retrieve(
         self,
-        bm25_hits: List[tuple[str, float]],
-        dense_hits: List[tuple[str, float]],
-        alpha: float = 0.5,
-    ) -> List[tuple[str, float, Optional[float], Optional[float]]]:
-        scores: Dict[str, Dict[str, float]] = {}
-        if bm25_hits:
-            max_bm = max(score for _, score in bm25_hits) or 1.0
-            for chunk_id, score in bm25_hits:
-                scores.setdefault(chunk_id, {})["bm25"] = score / max_bm
-        if dense_hits:
-            max_dense = max(score for _, score in dense_hits) or 1.0
-            for chunk_id, score in dense_hits:
-                scores.setdefault(chunk_id, {})["dense"] = score / max_dense
-
-        merged: List[tuple[str, float, Optional[float], Optional[float]]] = []
-        for chunk_id, val in scores.items():
-            s_bm = val.get("bm25")
-            s_de = val.get("dense")
-            if s_bm is None and s_de is None:
-                continue
-            score = (alpha * (s_de or 0)) + ((1 - alpha) * (s_bm or 0))
-            merged.append((chunk_id, score, s_bm, s_de))
-        merged.sort(key=lambda x: x[1], reverse=True)
-        return merged
+        query: str,
+        k: int,
+        *,
+        use_lexical: bool,
+        use_vector: bool,
+        lexical_index: Optional[BM25Index] = None,
+        dense_index: Optional[VectorIndex] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[tuple[str, float]], List[tuple[str, float]], bool]:
+        # BM25 とベクトル検索を並列に実行する / Run lexical and dense retrieval concurrently
+        # 3 つ目の戻り値はこの検索が縮退したかどうか / The third value tells whether this search degraded
+        if lexical_index is None:
+            lexical_index = self.bm25_index
+        if dense_index is None:
+            dense_index = self.dense_index
+        dense_ready = use_vector and self.dense_available and dense_index is not None
+        if use_vector and not dense_ready:
+            logger.warning("[mem][W01] %s index unavailable, fallback to bm25", self.vector_backend)
+        if not (use_lexical and dense_ready):
+            # 片側のみなら呼び出しスレッドで実行 / Single retriever: run inline
+            bm25_hits = self._lexical_search(lexical_index, query, k, allowed) if use_lexical else []
+            dense_hits: List[tuple[str, float]] = []
+            if dense_ready:
+                try:
+                    dense_hits = self._dense_search(query, k, index=dense_index, where=where, allowed=allowed)
+                except Exception as exc:  # pragma: no cover - defensive fallback
+                    self._dense_failed(exc)
+                    return bm25_hits, [], True
+            return bm25_hits, dense_hits, False
+
+        executor = self._get_executor()
+        started = time.monotonic()
+        dense_future = executor.submit(self._dense_search, query, k, index=dense_index, where=where, allowed=allowed)
+        bm25_future = executor.submit(self._lexical_search, lexical_index, query, k, allowed)
+        bm25_hits: List[tuple[str, float]] = []
+        dense_hits = []
+        degraded = False
+        try:
+            bm25_hits = bm25_future.result(timeout=self._remaining(self.lexical_timeout, started))
+        except FutureTimeoutError:
+            degraded = True
+            self._mark_degraded()
+            logger.warning("[mem][W02] %s index timed out, using %s results only", self.lexical_backend, self.vector_backend)
+        try:
+            dense_hits = dense_future.result(timeout=self._remaining(self.dense_timeout, started))
+        except FutureTimeoutError:
+            degraded = True
+            self._mark_degraded()
+            logger.warning(
+                "[mem][W01] %s index timed out after %.2fs, fallback to bm25", self.vector_backend, self.dense_timeout
+            )
+        except Exception as exc:  # pragma: no cover - defensive fallback
+            degraded = True
+            self._dense_failed(exc)
+        return bm25_hits, dense_hits, degraded
+
+    def _mark_degraded(self) -> None:
+        # 検索スレッドから並行に呼ばれるためロック下で加算 / Called concurrently from search threads
+        with self._degraded_lock:
+            self._degraded_searches += 1
+
+    def _degraded_count(self) -> int:
+        with self._degraded_lock:
+            return self._degraded_searches
+
+    def _dense_failed(self, exc: Exception) -> None:
+        self._mark_degraded()
+        logger.warning("[mem][W01] %s index unavailable, fallback to bm25 (%s)", self.vector_backend, exc)
+
+    def _lexical_search(
+        self, index: BM25Index, query: str, k: int, allowed: Optional[AbstractSet[str]]
+    ) -> List[tuple[str, float]]:
+        with self._stage("search.bm25") as stage:
+            hits = index.search(query, k, allowed=allowed)
+            stage.items = len(hits)
+        return hits
+
+    def _dense_search(
+        self,
+        query: str,
+        k: int,
+        *,
+        index: Optional[VectorIndex] = None,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[tuple[str, float]]:
+        # クエリの埋め込みを含む。失敗は _retrieve が縮退として扱う / Includes embedding the query; _retrieve handles failures
+        with self._stage("search.vector") as stage:
+            hits = (index or self.dense_index).search(query, top_k=k, where=where, allowed=allowed)
+            stage.items = len(hits)
+        return hits
+
+    @staticmethod
+    def _remaining(timeout: Optional[float], started: float) -> Optional[float]:
+        if timeout is None:
+            return None
+        return max(0.0, timeout - (time.monotonic() - started))
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._search_workers, thread_name_prefix="memolla-search"
+                    )
+        return self._executor
+
+    def close(self) -> None:
+        # バックグラウンドのスレッドを停止 / Release background threads
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.reranker is not None:
+            self.reranker.close()
+        with self._message_lock:
+            self._flush_messages_locked()
+        with self._fold_queue_lock:
+            # 未着手の畳み込みは次回の create_summary で行う / Pending folds happen on the next create_summary
+            self._fold_queue.clear()
+            fold_thread = self._fold_thread
+        if fold_thread is not None:
+            fold_thread.join()
+        if self._compact_thread is not None:
+            self._compact_thread.join()
+        for name in ("bm25_index", "message_bm25"):
+            if name in self._indexes:
+                self._indexes[name].wait_for_merges()
+        self.repo.close()
+
+    def _hydrate(self, chunk_ids: List[str]) -> Dict[str, ChunkRecord]:
+        # LRU で引けないチャンクだけを 1 クエリで取得 / Fetch cache misses in one query
+        found = self._chunk_cache.get_many(chunk_ids)
+        missing = [cid for cid in chunk_ids if cid not in found]
+        self._count("hydrate.lru_hits", len(found))
+        if missing:
+            with self._stage("search.hydrate") as stage:
+                fetched = self.repo.get_chunks(missing)
+                stage.items = len(missing)
+            self._count("hydrate.queries")
+            for cid, chunk in fetched.items():
+                self._chunk_cache.put(cid, chunk)
+            found.update(fetched)
+        return found
+
+    def _resolve_chunks(self, chunk_ids: List[str]) -> Dict[str, Tuple[str, str, Dict[str, Any]]]:
+        # ID → (doc_id, 本文, 文書メタデータ) / id -> (doc_id, text, document metadata)
+        chunks = self._hydrate(chunk_ids)
+        doc_meta = self.repo.get_documents_metadata(chunk.doc_id for chunk in chunks.values())
+        return {
+            cid: (chunk.doc_id, chunk.text, dict(doc_meta.get(chunk.doc_id, {}))) for cid, chunk in chunks.items()
+        }
+
+    def _resolve_messages(self, hit_ids: List[str]) -> Dict[str, Tuple[str, str, Dict[str, Any]]]:
+        messages = self.repo.get_messages(int(hit_id.split(":", 1)[1]) for hit_id in hit_ids)
+        return {
+            f"msg:{msg_id}": (
+                msg.session_id,
+                msg.raw_content,
+                {**msg.metadata, "role": msg.role, "created_at": msg.created_at.isoformat()},
+            )
+            for msg_id, msg in messages.items()
+        }
 
     def _hits_to_results(
         self,
@@ -234,26 +1214,37 @@ class Memory:
         *,
         use_bm25: bool,
         use_dense: bool,
+        resolve: Callable[[List[str]], Dict[str, Tuple[str, str, Dict[str, Any]]]],
     ) -> List[SearchResult]:
         results: List[SearchResult] = []
         if not hits:
             return results
         max_score = max(score for _, score in hits) or 1.0
-        for chunk_id, score in hits[:top_k]:
-            doc_id = chunk_id.split(":", 1)[0]
-            chunk = self._get_chunk(doc_id, chunk_id)
-            if not chunk:
+        # 同一 ID の重複ヒットは最初のものだけ使う / Keep the first hit per id
+        top: List[tuple[str, float]] = []
+        seen: Set[str] = set()
+        for hit_id, score in hits:
+            if hit_id not in seen:
+                seen.add(hit_id)
+                top.append((hit_id, score))
+                if len(top) >= top_k:
+                    break
+        resolved = resolve([hit_id for hit_id, _ in top])
+        for hit_id, score in top:
+            entry = resolved.get(hit_id)
+            if not entry:
                 continue
+            doc_id, text, metadata = entry
             score_norm = score / max_score
             results.append(
                 SearchResult(
                     doc_id=doc_id,
-                    chunk_id=chunk_id,
-                    text=chunk.text,
+                    chunk_id=hit_id,
+                    text=text,
                     score=score_norm,
                     score_bm25=score_norm if use_bm25 else None,
                     score_dense=score_norm if use_dense else None,
-                    metadata={},
+                    metadata=metadata,
                 )
             )
         return results
@@ -262,22 +1253,26 @@ class Memory:
         self,
         merged: List[tuple[str, float, Optional[float], Optional[float]]],
         top_k: int,
+        resolve: Callable[[List[str]], Dict[str, Tuple[str, str, Dict[str, Any]]]],
+        resolved: Optional[Dict[str, Tuple[str, str, Dict[str, Any]]]] = None,
     ) -> List[SearchResult]:
         results: List[SearchResult] = []
-        for chunk_id, score, sbm25, sdense in merged[:top_k]:
-            doc_id = chunk_id.split(":", 1)[0]
-            chunk = self._get_chunk(doc_id, chunk_id)
-            if not chunk:
+        if resolved is None:
+            resolved = resolve([hit_id for hit_id, *_ in merged[:top_k]])
+        for hit_id, score, sbm25, sdense in merged[:top_k]:
+            entry = resolved.get(hit_id)
+            if not entry:
                 continue
+            doc_id, text, metadata = entry
             results.append(
                 SearchResult(
                     doc_id=doc_id,
-                    chunk_id=chunk_id,
-                    text=chunk.text,
+                    chunk_id=hit_id,
+                    text=text,
                     score=score,
                     score_bm25=sbm25,
                     score_dense=sdense,
-                    metadata={},
+                    metadata=metadata,
                 )
             )
         return results
@@ -287,12 +1282,37 @@ class Memory:
         merged: List[tuple[str, float, Optional[float], Optional[float]]],
         query: str,
         top_k: int,
-    ) -> List[tuple[str, float, Optional[float], Optional[float]]]:
-        # TODO: implement true LLM reranking; for now, passthrough with warning.
-        if not isinstance(self.llm.client, object):
-            logger.warning("[mem][W01] LLM reranker unavailable, using normalized scores")
-            return merged
-        return merged
+        resolve: Callable[[List[str]], Dict[str, Tuple[str, str, Dict[str, Any]]]],
+    ) -> Tuple[
+        List[tuple[str, float, Optional[float], Optional[float]]], Dict[str, Tuple[str, str, Dict[str, Any]]], bool
+    ]:
+        # 先頭の候補を LLM で採点し直す。復元した本文は結果の組み立てに再利用 / Reuse hydrated texts for results
+        # 最後の値は予算切れで採点が欠けたかどうか / The flag tells whether the budget cut scoring short
+        pool = merged[: max(top_k, self.rerank_candidates or top_k * self.fanout)]
+        resolved = resolve([hit_id for hit_id, *_ in pool])
+        if not self.reranker.available:
+            if not self._rerank_warned:
+                self._rerank_warned = True
+                logger.warning("[mem][W03] LLM reranker unavailable, using fused scores")
+            return merged, resolved, False
+        with self._stage("search.rerank") as stage:
+            texts = {hit_id: entry[1] for hit_id, entry in resolved.items()}
+            reranked, report = self.reranker.rerank(query, pool, texts)
+            stage.items = report.scored
+            stage.detail = report
+        self._count("rerank.cache_hits", report.cached)
+        self._count("rerank.scored", report.scored)
+        self._count("rerank.batches", report.batches)
+        if report.partial:
+            # 予算切れの結果はキャッシュしない / Do not cache partially reranked results
+            self._mark_degraded()
+            self._count("rerank.partial")
+            logger.warning(
+                "[mem][W03] LLM rerank incomplete (budget %.2fs), %d candidates keep fused scores",
+                self.reranker.budget,
+                report.unscored,
+            )
+        return reranked + merged[len(pool) :], resolved, report.partial
 
     # 要約 / create_summary
     def create_summary(
@@ -302,24 +1322,42 @@ class Memory:
         doc_id: Optional[str] = None,
         **options: Any,
     ) -> str:
-        if (session_id and doc_id) or (not session_id and not doc_id):
-            raise ValueError("[mem][E003] specify either session_id or doc_id")
+        summarizer = options.get("summarizer")
+        if summarizer:
+            # 独自の要約関数には従来どおり全文を渡す / Custom summarizers still receive the full text
+            return summarizer(self._summary_source(session_id=session_id, doc_id=doc_id))
+        if session_id and not doc_id and self._rolling_enabled():
+            # 逐次要約はウォーターマーク以降の分だけ畳み込む / Only messages past the watermark are summarized
+            record = self.refresh_summary(session_id)
+            if record is None:
+                raise ValueError("[mem][E006] target not found")
+            return record.summary
+        return self.summarizer.summarize(self._summary_leaves(session_id=session_id, doc_id=doc_id))
 
+    def _summary_leaves(self, *, session_id: Optional[str], doc_id: Optional[str]) -> List[str]:
+        # 要約木の葉。文書は保存済みのチャンクから組み立てる / Tree leaves; documents reuse the stored chunks
+        _check_summary_target(session_id, doc_id)
         if session_id:
             messages = self.repo.get_session_messages(session_id)
             if not messages:
                 raise ValueError("[mem][E006] target not found")
-            text = "\n".join(f"{m.role}: {m.raw_content}" for m in messages)
-        else:
-            doc = self.repo.get_document(doc_id or "")
-            if not doc:
-                raise ValueError("[mem][E006] target not found")
-            text = doc.corpus
+            return message_leaves(messages, max_tokens=self.summarizer.max_tokens)
+        if not self.repo.document_exists(doc_id or ""):
+            raise ValueError("[mem][E006] target not found")
+        chunks = self.repo.list_chunks(doc_id or "")
+        return chunk_leaves(chunks, max_tokens=self.summarizer.max_tokens, max_chunks=self._summary_leaf_chunks)
 
-        summarizer = options.get("summarizer")
-        if summarizer:
-            return summarizer(text)
-        return self.llm.summarize(text)
+    def _summary_source(self, *, session_id: Optional[str], doc_id: Optional[str]) -> str:
+        _check_summary_target(session_id, doc_id)
+        if session_id:
+            messages = self.repo.get_session_messages(session_id)
+            if not messages:
+                raise ValueError("[mem][E006] target not found")
+            return "\n".join(f"{m.role}: {m.raw_content}" for m in messages)
+        doc = self.repo.get_document(doc_id or "")
+        if not doc:
+            raise ValueError("[mem][E006] target not found")
+        return doc.corpus
 
     # 最適化 / optimize
     def optimize(
@@ -333,3 +1371,22 @@ class Memory:
         dry_run: bool = False,
     ) -> OptimizeResult:
         raise NotImplementedError("[mem][E005] optimize level not implemented")
+
+
+def _chunk_id(doc_id: str, version: int, seq: int) -> str:
+    """
+    チャンク ID / Chunk id of `seq` in `version` of a document.
+    版 1 は "<doc_id>:<seq>"、2 版目以降は "<doc_id>:<seq>:v<版>" (tombstone 済み ID を再利用しない)。
+    末尾が数字か "v<数字>" かで区別でき、末尾から分解すると一意なので doc_id の形によらず衝突しない。
+    旧形式の "<doc_id>:v<版>:<seq>" と重ならないよう、":v<数字>" で終わる doc_id は版 1 でも版を付ける。
+    """
+    if version == 1 and not _LEGACY_VERSIONED.search(doc_id):
+        return f"{doc_id}:{seq}"
+    return f"{doc_id}:{seq}:v{version}"
+
+
+def _check_summary_target(session_id: Optional[str], doc_id: Optional[str]) -> None:
+    if (session_id and doc_id) or (not session_id and not doc_id):
+        raise ValueError("[mem][E003] specify either session_id or doc_id")
+
+
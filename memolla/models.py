@@ -15,12 +15,15 @@ class DocumentRecord:
     version: int = 1
 
 
-@dataclass
+@dataclass(slots=True)
 class ChunkRecord:
     chunk_id: str
     doc_id: str
     seq: int
     text: str
+    # 文書本文内の文字オフセット [start, end) / Character span within the document corpus
+    start: Optional[int] = None
+    end: Optional[int] = None
 
 
 @dataclass
@@ -33,6 +36,16 @@ class MessageRecord:
     created_at: datetime
 
 
+@dataclass
+class SessionSummary:
+    # 会話の逐次要約と、要約済みの最後のメッセージ ID (ウォーターマーク) / Rolling summary and its watermark
+    session_id: str
+    summary: str
+    last_message_id: int
+    message_count: int
+    updated_at: datetime
+
+
 @dataclass
 class SearchResult:
     doc_id: str
@@ -44,6 +57,59 @@ class SearchResult:
     metadata: Dict[str, Any]
 
 
+@dataclass
+class IngestReport:
+    documents: int
+    chunks: int
+    skipped: int
+    elapsed_sec: float
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.documents / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+
+@dataclass(slots=True)
+class StageEvent:
+    # 計測した処理段階 1 回分 (name 例: "search.bm25", "ingest.embed") / One timed stage, passed to tracers
+    name: str
+    elapsed_sec: float
+    # その段階で扱った件数 (候補数・チャンク数など) / Items handled: candidates, chunks, ids
+    items: int = 0
+    # 段階ごとの付加情報 (search.merge では FusionReport) / Stage-specific detail, e.g. a FusionReport
+    detail: Any = None
+
+
+@dataclass
+class FusionReport:
+    # 1 クエリの融合で実際に使った候補数 / Candidates one query actually consumed
+    mode: str
+    candidates_bm25: int
+    candidates_dense: int
+    rounds: int = 1
+
+    @property
+    def candidates(self) -> int:
+        return self.candidates_bm25 + self.candidates_dense
+
+
+@dataclass
+class RerankReport:
+    # 1 クエリの LLM リランクの内訳 / Breakdown of one query's LLM rerank
+    candidates: int
+    cached: int = 0
+    scored: int = 0
+    batches: int = 0
+    # 融合スコアのまま残った候補 / Candidates left with their fused score
+    unscored: int = 0
+    # 予算切れ・失敗で採点が欠けた / Some batches timed out or failed
+    partial: bool = False
+
+
 @dataclass
 class EvalMetrics:
     recall_at_5: Optional[float]
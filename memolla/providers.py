@@ -1,36 +1,326 @@
 from __future__ import annotations
 
-import hashlib
+import asyncio
+import email.utils
 import logging
 import math
-from typing import Any, List, Optional
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, List, Optional, Sequence
 
-from openai import OpenAI
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+    from .cache import EmbeddingCache
+    from .local_embedding import LocalEmbedder
 
 logger = logging.getLogger(__name__)
 
 
-def _hash_vector(text: str, dim: int = 256) -> List[float]:
-    # API キーが無い場合のフォールバック埋め込み / Fallback embedding when API key is missing
-    digest = hashlib.sha256(text.encode("utf-8")).digest()
-    vals = []
-    for i in range(dim):
-        b = digest[i % len(digest)]
-        vals.append((b - 128) / 128.0)
-    return vals
+def _fallback_embedder(local: Optional["LocalEmbedder"], client: Any) -> Optional["LocalEmbedder"]:
+    # 明示指定、または API クライアントが無い場合はローカル埋め込み / Local embedder if selected or without a client
+    if local is None and not client:
+        from .local_embedding import LocalEmbedder
+
+        logger.warning("OpenAI client unavailable; using the local hashing embedder.")
+        local = LocalEmbedder()
+    return local
+
+
+def estimate_tokens(text: str) -> int:
+    # UTF-8 バイト数 / 3 の保守的な見積もり (英語は過大、日本語は約 1 文字 1 トークン)
+    # Conservative estimate: overestimates English, ~1 token per char for CJK
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def pack_batches(texts: Sequence[str], *, max_tokens: int, max_items: int) -> List[List[int]]:
+    # 入力順を保ったまま推定トークン数の予算でバッチに詰める / Pack indices by token budget, in order
+    batches: List[List[int]] = []
+    current: List[int] = []
+    budget = 0
+    for idx, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (budget + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, budget = [], 0
+        current.append(idx)
+        budget += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class RateLimiter:
+    """
+    requests/min と tokens/min のトークンバケット / Token buckets for requests and tokens per minute.
+    reserve() は待つべき秒数を返すので、同期・非同期の両方から利用できる。
+    """
+
+    def __init__(self, *, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._req_level = float(requests_per_minute or 0)
+        self._tok_level = float(tokens_per_minute or 0)
+        self._updated = now
+
+    def reserve(self, tokens: int) -> float:
+        if not self.rpm and not self.tpm:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            wait = 0.0
+            if self.rpm:
+                self._req_level = min(self.rpm, self._req_level + elapsed * self.rpm / 60.0) - 1
+                if self._req_level < 0:
+                    wait = max(wait, -self._req_level * 60.0 / self.rpm)
+            if self.tpm:
+                # 1 バッチが tpm を超える場合でも永久に待たないよう上限を設ける / Cap so oversize batches still run
+                cost = min(tokens, self.tpm)
+                self._tok_level = min(self.tpm, self._tok_level + elapsed * self.tpm / 60.0) - cost
+                if self._tok_level < 0:
+                    wait = max(wait, -self._tok_level * 60.0 / self.tpm)
+            return wait
+
+    def acquire(self, tokens: int) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    # 4xx (408/409/429 を除く) はリトライしない / Do not retry client errors except 408/409/429
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 409, 429):
+        return False
+    return True
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    # 応答の Retry-After (-ms / 秒 / HTTP 日付) を秒で返す / Seconds requested by Retry-After(-ms), if any
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return max(0.0, float(value) / 1000.0)
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            when = email.utils.parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class EmbeddingScheduler:
+    """
+    Embedding リクエストのスケジューラ / Embedding request scheduler.
+    推定トークン数でバッチを詰め、複数バッチを並行実行しつつ rpm/tpm 制限・指数バックオフ付きリトライを適用し、
+    結果は入力順で返す。
+    """
+
+    def __init__(
+        self,
+        *,
+        max_batch_tokens: int = 8000,
+        max_batch_size: int = 256,
+        concurrency: int = 4,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 2,
+        timeout: float = 30.0,
+        backoff: float = 1.0,
+    ) -> None:
+        self.max_batch_tokens = max(1, max_batch_tokens)
+        self.max_batch_size = max(1, max_batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(0, max_retries)
+        self.timeout = timeout
+        self.backoff = backoff
+        self.limiter = RateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+
+    def _delay(self, attempt: int, exc: Exception) -> float:
+        # サーバーが Retry-After を返した場合はそれを最小の待ち時間とする / Retry-After is the minimum backoff
+        delay = self.backoff * (2**attempt) * (1 + random.random() * 0.1)
+        return max(delay, _retry_after(exc) or 0.0)
+
+    def run(self, texts: List[str], request: Callable[[List[str], float], List[List[float]]]) -> List[List[float]]:
+        batches = pack_batches(texts, max_tokens=self.max_batch_tokens, max_items=self.max_batch_size)
+        results: List[Optional[List[List[float]]]] = [None] * len(batches)
+
+        def call(batch_no: int) -> None:
+            batch = [texts[i] for i in batches[batch_no]]
+            tokens = sum(estimate_tokens(t) for t in batch)
+            for attempt in range(self.max_retries + 1):
+                # リトライも 1 リクエストとして rpm/tpm を消費する / Retries count against rpm/tpm too
+                self.limiter.acquire(tokens)
+                try:
+                    results[batch_no] = request(batch, self.timeout)
+                    return
+                except Exception as exc:
+                    if attempt >= self.max_retries or not _is_retryable(exc):
+                        raise
+                    logger.warning("Embedding request failed (%s); retrying (%d/%d)", exc, attempt + 1, self.max_retries)
+                    time.sleep(self._delay(attempt, exc))
+
+        if len(batches) <= 1 or self.concurrency == 1:
+            for batch_no in range(len(batches)):
+                call(batch_no)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+                for future in [pool.submit(call, n) for n in range(len(batches))]:
+                    future.result()
+        return [vec for part in results for vec in (part or [])]
+
+    async def arun(
+        self,
+        texts: List[str],
+        request: Callable[[List[str], float], Awaitable[List[List[float]]]],
+    ) -> List[List[float]]:
+        batches = pack_batches(texts, max_tokens=self.max_batch_tokens, max_items=self.max_batch_size)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def call(indices: List[int]) -> List[List[float]]:
+            batch = [texts[i] for i in indices]
+            tokens = sum(estimate_tokens(t) for t in batch)
+            async with semaphore:
+                for attempt in range(self.max_retries + 1):
+                    wait = self.limiter.reserve(tokens)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    try:
+                        return await request(batch, self.timeout)
+                    except Exception as exc:
+                        if attempt >= self.max_retries or not _is_retryable(exc):
+                            raise
+                        logger.warning(
+                            "Embedding request failed (%s); retrying (%d/%d)", exc, attempt + 1, self.max_retries
+                        )
+                        await asyncio.sleep(self._delay(attempt, exc))
+            raise AssertionError("unreachable")
+
+        parts = await asyncio.gather(*(call(indices) for indices in batches))
+        return [vec for part in parts for vec in part]
 
 
 class EmbeddingProvider:
-    def __init__(self, *, client: Optional[OpenAI], model: str):
+    def __init__(
+        self,
+        *,
+        client: Optional[OpenAI],
+        model: str,
+        batch_size: int = 256,
+        cache: Optional["EmbeddingCache"] = None,
+        scheduler: Optional[EmbeddingScheduler] = None,
+        local: Optional["LocalEmbedder"] = None,
+    ):
         self.client = client
         self.model = model
+        self.cache = cache
+        self.scheduler = scheduler or EmbeddingScheduler(max_batch_size=batch_size)
+        # ローカル埋め込み (指定時は API より優先、キャッシュは使わない) / Local embedder: wins over the API, uncached
+        self.local = local
 
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        if not self.client:
-            logger.warning("Using hash-based fallback embedding due to missing OpenAI client.")
-            return [_hash_vector(t) for t in texts]
-        resp = self.client.embeddings.create(model=self.model, input=texts, timeout=30)
-        return [item.embedding for item in resp.data]
+        self.local = _fallback_embedder(self.local, self.client)
+        if self.local is not None:
+            return self.local.embed_texts(texts)
+        if self.cache is None:
+            return self._request(texts)
+        # キャッシュに無いテキストだけを API に送る / Only cache misses go to the provider
+        hashes, found, missing = self.cache.lookup(self.model, texts)
+        vectors = self._request(list(missing.values())) if missing else []
+        return self.cache.fill(self.model, hashes, found, missing, vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.local is not None or not self.client or self.cache is None:
+            return self.embed_texts([text])[0]
+        vector = self.cache.get_query(self.model, text)
+        if vector is None:
+            vector = self.embed_texts([text])[0]
+            self.cache.put_query(self.model, text, vector)
+        return vector
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        # リトライはスケジューラ側で行うためクライアントの再試行は無効化 / Scheduler owns retries
+        client = self.client.with_options(max_retries=0) if hasattr(self.client, "with_options") else self.client
+
+        def request(batch: List[str], timeout: float) -> List[List[float]]:
+            resp = client.embeddings.create(model=self.model, input=batch, timeout=timeout)
+            return [item.embedding for item in resp.data]
+
+        return self.scheduler.run(texts, request)
+
+
+class AsyncEmbeddingProvider:
+    # EmbeddingProvider の非同期版 / asyncio counterpart of EmbeddingProvider
+    def __init__(
+        self,
+        *,
+        client: Optional[AsyncOpenAI],
+        model: str,
+        batch_size: int = 256,
+        cache: Optional["EmbeddingCache"] = None,
+        scheduler: Optional[EmbeddingScheduler] = None,
+        local: Optional["LocalEmbedder"] = None,
+    ):
+        self.client = client
+        self.model = model
+        self.cache = cache
+        self.scheduler = scheduler or EmbeddingScheduler(max_batch_size=batch_size)
+        self.local = local
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        self.local = _fallback_embedder(self.local, self.client)
+        if self.local is not None:
+            return await asyncio.to_thread(self.local.embed_texts, texts)
+        if self.cache is None:
+            return await self._request(texts)
+        hashes, found, missing = await asyncio.to_thread(self.cache.lookup, self.model, texts)
+        vectors = await self._request(list(missing.values())) if missing else []
+        return await asyncio.to_thread(self.cache.fill, self.model, hashes, found, missing, vectors)
+
+    async def embed_query(self, text: str) -> List[float]:
+        if self.local is not None or not self.client or self.cache is None:
+            return (await self.embed_texts([text]))[0]
+        vector = self.cache.get_query(self.model, text)
+        if vector is None:
+            vector = (await self.embed_texts([text]))[0]
+            self.cache.put_query(self.model, text, vector)
+        return vector
+
+    async def _request(self, texts: List[str]) -> List[List[float]]:
+        client = self.client.with_options(max_retries=0) if hasattr(self.client, "with_options") else self.client
+
+        async def request(batch: List[str], timeout: float) -> List[List[float]]:
+            resp = await client.embeddings.create(model=self.model, input=batch, timeout=timeout)
+            return [item.embedding for item in resp.data]
+
+        return await self.scheduler.arun(texts, request)
+
+
+SUMMARY_PROMPT = "Summarize the provided content in concise form."
+# 要約木の上位段 (部分要約の統合) / Upper levels of the map-reduce summary tree
+MERGE_PROMPT = (
+    "The content is a sequence of summaries of consecutive parts of one text, in order. "
+    "Merge them into one concise summary that keeps the key facts."
+)
+# 会話の逐次要約への追記 / Folding new messages into a rolling conversation summary
+FOLD_PROMPT = (
+    "The content is the running summary of a conversation followed by what was said since. "
+    "Rewrite it as one concise, updated summary of the whole conversation that keeps the key facts and decisions."
+)
 
 
 class LLMProvider:
@@ -38,12 +328,12 @@ class LLMProvider:
         self.client = client
         self.model = model
 
-    def summarize(self, text: str) -> str:
+    def summarize(self, text: str, *, prompt: str = SUMMARY_PROMPT) -> str:
         if not self.client:
             # 簡易フォールバック要約 / Simple fallback summary
             return text[:512] + ("..." if len(text) > 512 else "")
         messages = [
-            {"role": "system", "content": "Summarize the provided content in concise form."},
+            {"role": "system", "content": prompt},
             {"role": "user", "content": text},
         ]
         resp = self.client.chat.completions.create(
@@ -55,9 +345,130 @@ class LLMProvider:
         choice = resp.choices[0].message.content or ""
         return choice.strip()
 
+    def score_relevance(
+        self,
+        query: str,
+        passages: Sequence[str],
+        *,
+        timeout: float = 30.0,
+        max_chars: int = 1000,
+    ) -> List[Optional[float]]:
+        """
+        1 回の呼び出しで複数の文章をクエリとの関連度で採点する / Score many passages against a query in one call.
+        0〜1 に正規化した値を返す。クライアントが無い場合や応答に含まれない文章は None。
+        """
+        if not self.client or not passages:
+            return [None] * len(passages)
+        resp = self.client.chat.completions.create(
+            model=self.model,
+            messages=relevance_messages(query, passages, max_chars=max_chars),
+            timeout=timeout,
+            temperature=0,
+            max_tokens=8 * len(passages) + 16,
+        )
+        return parse_relevance(resp.choices[0].message.content or "", len(passages))
+
+
+_RELEVANCE_PROMPT = (
+    "Rate how relevant each numbered passage is to the query, from 0 (unrelated) to 10 (answers it directly). "
+    'Reply with one JSON object mapping every passage number to its score, e.g. {"1": 7, "2": 0}, and nothing else.'
+)
+# "3": 7 / [3]: 7 / 3=7.5 などの 1 件分 / One "number: score" pair in any of the usual shapes
+_SCORE_PAIR = re.compile(r'"?\[?(\d+)\]?"?\s*[:=]\s*"?(-?\d+(?:\.\d+)?)')
+
+
+def relevance_messages(query: str, passages: Sequence[str], *, max_chars: int = 1000) -> List[dict]:
+    # 長い文章は切り詰めてプロンプトの大きさを抑える / Truncate long passages to bound the prompt size
+    body = "\n\n".join(f"[{i}] {' '.join(text[:max_chars].split())}" for i, text in enumerate(passages, 1))
+    return [
+        {"role": "system", "content": _RELEVANCE_PROMPT},
+        {"role": "user", "content": f"Query: {query}\n\nPassages:\n{body}"},
+    ]
+
+
+def parse_relevance(content: str, count: int) -> List[Optional[float]]:
+    # 番号付きの採点を 0〜1 へ。番号の無い配列 [7, 0, ...] も受け付ける / Numbered scores, or a bare JSON array
+    scores: List[Optional[float]] = [None] * count
+    pairs = _SCORE_PAIR.findall(content)
+    if not pairs:
+        values = re.findall(r"-?\d+(?:\.\d+)?", content) if content.lstrip().startswith("[") else []
+        pairs = [(str(i), value) for i, value in enumerate(values[:count], 1)]
+    for number, value in pairs:
+        index = int(number) - 1
+        if 0 <= index < count and scores[index] is None:
+            scores[index] = min(max(float(value), 0.0), 10.0) / 10.0
+    return scores
+
+
+class AsyncLLMProvider:
+    # LLMProvider の非同期版 / asyncio counterpart of LLMProvider
+    def __init__(self, *, client: Optional[AsyncOpenAI], model: str):
+        self.client = client
+        self.model = model
+
+    async def summarize(self, text: str, *, prompt: str = SUMMARY_PROMPT) -> str:
+        if not self.client:
+            return text[:512] + ("..." if len(text) > 512 else "")
+        messages = [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": text},
+        ]
+        resp = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            timeout=30,
+            max_tokens=256,
+        )
+        choice = resp.choices[0].message.content or ""
+        return choice.strip()
+
+
+class LazyClient:
+    """
+    初回の属性アクセスでクライアントを生成するプロキシ / Proxy that builds the client on first attribute access.
+    openai の import (約 1 秒) を API を実際に呼ぶまで遅らせる。
+    """
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        self._factory = factory
+        self._client: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._client is not None
+
+    def __getattr__(self, name: str) -> Any:
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return getattr(client, name)
+
 
 def build_client(api_key: Optional[str], base_url: Optional[str]) -> Optional[OpenAI]:
     if not api_key:
         logger.warning("OPENAI_API_KEY is not set; falling back to local stub providers.")
         return None
-    return OpenAI(api_key=api_key, base_url=base_url)
+
+    def factory() -> OpenAI:
+        from openai import OpenAI
+
+        return OpenAI(api_key=api_key, base_url=base_url)
+
+    return LazyClient(factory)  # type: ignore[return-value]
+
+
+def build_async_client(api_key: Optional[str], base_url: Optional[str]) -> Optional[AsyncOpenAI]:
+    if not api_key:
+        logger.warning("OPENAI_API_KEY is not set; falling back to local stub providers.")
+        return None
+
+    def factory() -> AsyncOpenAI:
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+    return LazyClient(factory)  # type: ignore[return-value]
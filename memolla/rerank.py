@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
+
+from .cache import RerankCache
+from .fusion import Fused
+from .models import RerankReport
+from .providers import LLMProvider
+
+logger = logging.getLogger(__name__)
+
+
+class LLMReranker:
+    """
+    LLM による上位候補のリランク / Rerank the head of the fused list with an LLM.
+    1 プロンプトで batch_size 件をまとめて採点し (batched pointwise)、バッチは concurrency 本まで並列に投げる。
+    採点は (クエリ, チャンク ID, モデル) でキャッシュする。budget 秒以内に返らなかったバッチの候補は
+    融合スコアのまま残り、遅れて返った採点は次回のためにキャッシュへ入る。
+    """
+
+    def __init__(
+        self,
+        llm: LLMProvider,
+        *,
+        batch_size: int = 8,
+        concurrency: int = 4,
+        budget: float = 2.0,
+        cache: Optional[RerankCache] = None,
+        max_chars: int = 1000,
+    ) -> None:
+        if batch_size <= 0 or concurrency <= 0 or budget <= 0:
+            raise ValueError("[mem][E004] rerank_batch_size, rerank_concurrency and rerank_budget must be positive")
+        self.llm = llm
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.budget = budget
+        self.cache = cache
+        self.max_chars = max_chars
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return bool(self.llm.client)
+
+    def rerank(self, query: str, candidates: List[Fused], texts: Dict[str, str]) -> Tuple[List[Fused], RerankReport]:
+        """
+        candidates を採点して並べ替える / Score and reorder candidates (best first).
+        採点できた候補は LLM の関連度 (0〜1) 順に先頭へ、採点できなかった候補は融合スコアのまま
+        元の順でその後ろに並べる (尺度の異なるスコアを混ぜて比較しない)。
+        """
+        report = RerankReport(candidates=len(candidates))
+        model = self.llm.model
+        scores = self.cache.get_many(query, model, texts) if self.cache is not None else {}
+        report.cached = len(scores)
+        pending = [hit_id for hit_id, *_ in candidates if hit_id in texts and hit_id not in scores]
+        if pending and self.available:
+            fresh, report.batches, report.partial = self._score(query, pending, texts)
+            scores.update(fresh)
+        report.scored = len(scores) - report.cached
+        report.unscored = len(candidates) - len(scores)
+        scored = [(hit_id, scores[hit_id], s_bm, s_de) for hit_id, _, s_bm, s_de in candidates if hit_id in scores]
+        unscored = [hit for hit in candidates if hit[0] not in scores]
+        return sorted(scored, key=itemgetter(1), reverse=True) + unscored, report
+
+    def _score(self, query: str, ids: List[str], texts: Dict[str, str]) -> Tuple[Dict[str, float], int, bool]:
+        # (採点, バッチ数, 予算切れ・失敗で欠けたか) / (scores, batch count, whether any batch was lost)
+        deadline = time.monotonic() + self.budget
+        batches = [ids[i : i + self.batch_size] for i in range(0, len(ids), self.batch_size)]
+        futures: Dict[Future, List[str]] = {}
+        executor = self._get_executor()
+        for batch in batches:
+            future = executor.submit(
+                self.llm.score_relevance,
+                query,
+                [texts[hit_id] for hit_id in batch],
+                timeout=self.budget,
+                max_chars=self.max_chars,
+            )
+            futures[future] = batch
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        for future in not_done:
+            # 予算切れ後に返った採点もキャッシュする / Cache scores that arrive after the budget too
+            if not future.cancel():
+                future.add_done_callback(lambda f, batch=futures[future]: self._store(query, batch, texts, f))
+        scores: Dict[str, float] = {}
+        partial = bool(not_done)
+        for future in done:
+            # 完了コールバックは wait() の復帰より後に走りうるため、ここで同期的に保存する
+            # / Done callbacks may run after wait() returns, so store completed batches here
+            self._store(query, futures[future], texts, future)
+            if future.exception() is not None:
+                partial = True
+                continue
+            for hit_id, score in zip(futures[future], future.result()):
+                if score is not None:
+                    scores[hit_id] = score
+        return scores, len(batches), partial
+
+    def _store(self, query: str, batch: List[str], texts: Dict[str, str], future: Future) -> None:
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            logger.warning("[mem][W03] LLM rerank batch failed, keeping fused scores (%s)", exc)
+            return
+        if self.cache is not None:
+            scored = {hit_id: (texts[hit_id], s) for hit_id, s in zip(batch, future.result()) if s is not None}
+            self.cache.put_many(query, self.llm.model, scored)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="memolla-rerank")
+        return self._executor
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -1,23 +1,164 @@
 from __future__ import annotations
 
+import functools
 import json
 import sqlite3
+import threading
+import weakref
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, TypeVar
 
-from .models import ChunkRecord, DocumentRecord, MessageRecord
+from .filters import where_to_sql
+from .models import ChunkRecord, DocumentRecord, MessageRecord, SessionSummary
+from .utils import epoch_seconds
+
+_MAX_VARIABLES = 900
+# 本文ページの文字数 (チャンク 1 件は高々 2 ページにまたがる) / Characters per corpus page
+_PAGE_CHARS = 8192
+_CHUNK_COLUMNS = "chunk_id, doc_id, seq, text, start_offset, end_offset"
+
+# PRAGMA user_version で管理するスキーマ移行 (index i → version i+1) / Schema migrations keyed by user_version
+_MIGRATIONS: List[Tuple[str, ...]] = [
+    (
+        "CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (doc_id, seq)",
+    ),
+    (
+        # 検索インデックスへの反映済みフラグ / Whether the message reached the search indexes
+        "ALTER TABLE messages ADD COLUMN indexed INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_messages_unindexed ON messages (id) WHERE indexed = 0",
+    ),
+    (
+        # 更新・削除で置き換えられ、インデックスからの物理削除待ちのチャンク / Chunks awaiting index compaction
+        """
+        CREATE TABLE IF NOT EXISTS tombstones (
+            chunk_id TEXT PRIMARY KEY,
+            doc_id TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            deleted_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tombstones_doc ON tombstones (doc_id, version)",
+    ),
+    (
+        # ストリーム登録した文書の本文 (重なり無しの断片) / Corpus of streamed documents, in non-overlapping pages
+        """
+        CREATE TABLE IF NOT EXISTS corpus_pages (
+            doc_id TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (doc_id, page)
+        ) WITHOUT ROWID
+        """,
+    ),
+    (
+        # チャンクは本文ページへのオフセットのみ保持 (text は旧データ用) / Chunks become spans over the paged corpus
+        "ALTER TABLE chunks ADD COLUMN start_offset INTEGER",
+        "ALTER TABLE chunks ADD COLUMN end_offset INTEGER",
+    ),
+    (
+        # 要約木の各ノードの要約 (入力テキストの SHA-256 がキー) / Map-reduce summaries keyed by input hash
+        """
+        CREATE TABLE IF NOT EXISTS chunk_summaries (
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        ) WITHOUT ROWID
+        """,
+    ),
+    (
+        # 会話の逐次要約とウォーターマーク / Rolling session summaries and their watermark
+        """
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+        # ウォーターマーク以降のメッセージを範囲検索する / Range scans past the watermark
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)",
+    ),
+    (
+        # 時刻の絞り込み用の UTC エポック秒 (Chroma の created_at と同じ値) / UTC epoch seconds, as stored in Chroma
+        "ALTER TABLE messages ADD COLUMN created_epoch REAL",
+        # 整数マイクロ秒から 1 回の除算で求める (Python の timestamp() と同値) / Same rounding as datetime.timestamp()
+        """
+        UPDATE messages SET created_epoch = (
+            CAST(strftime('%s', created_at) AS INTEGER) * 1000000
+            + CASE WHEN substr(created_at, 20, 1) = '.' THEN CAST(substr(created_at, 21, 6) AS INTEGER) ELSE 0 END
+        ) / 1000000.0
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_epoch ON messages (session_id, created_epoch)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_role_epoch ON messages (role, created_epoch)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_epoch ON messages (created_epoch)",
+    ),
+]
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def _writer(fn: F) -> F:
+    # 書き込みは単一ライターに直列化、読み取りはスレッド毎の接続で並行 / Single writer, concurrent readers
+    @functools.wraps(fn)
+    def wrapper(self: "SQLiteRepository", *args: Any, **kwargs: Any) -> Any:
+        with self._write_lock:
+            return fn(self, *args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
 
 
 class SQLiteRepository:
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, *, busy_timeout: float = 30.0):
         self.path = path
         self.path.parent.mkdir(parents=True, exist_ok=True)
-        self.conn = sqlite3.connect(self.path)
-        self.conn.row_factory = sqlite3.Row
+        self.busy_timeout = busy_timeout
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
         self._init_schema()
 
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # スレッドごとに接続を 1 本生成して再利用 / One connection per thread, created lazily
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ThreadConnection(self._connect())
+            # スレッド終了で thread-local が破棄されたら接続も閉じる / Close once the owning thread's locals are dropped
+            weakref.finalize(holder, _release, holder.conn, self._connections, self._connections_lock)
+        return holder.conn
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # WAL では NORMAL でもコミット済みデータは壊れない / NORMAL is durable enough under WAL
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def release_thread(self) -> None:
+        # 終了前のワーカースレッドから呼び、接続をすぐに閉じる / Close the calling thread's connection right away
+        holder = getattr(self._local, "holder", None)
+        if holder is not None:
+            self._local.holder = None
+            _release(holder.conn, self._connections, self._connections_lock)
+
+    def close(self) -> None:
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    @_writer
     def _init_schema(self) -> None:
+        # WAL モードはデータベースファイルに永続化される / journal_mode=WAL persists in the database file
+        self.conn.execute("PRAGMA journal_mode=WAL")
         cur = self.conn.cursor()
         cur.execute(
             """
@@ -54,38 +195,186 @@ class SQLiteRepository:
             )
             """
         )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+            """
+        )
         self.conn.commit()
+        self._migrate()
+
+    def _migrate(self) -> None:
+        # sqlite3 (3.10) は DDL の前にトランザクションを開始しないため明示的に BEGIN する。版は書き込みロック取得後に
+        # 読み直すので、同時に開いた別プロセスが同じ段を二重に適用することもない
+        # / sqlite3 does not begin a transaction before DDL, so each step runs in an explicit BEGIN ... COMMIT
+        while True:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(_MIGRATIONS):
+                    self.conn.commit()
+                    return
+                for statement in _MIGRATIONS[version]:
+                    self.conn.execute(statement)
+                self.conn.execute(f"PRAGMA user_version = {version + 1}")
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
 
     def save_document(self, doc: DocumentRecord, chunks: List[ChunkRecord]) -> None:
-        cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO documents (doc_id, corpus, metadata, created_at, updated_at, version) VALUES (?, ?, ?, ?, ?, ?)",
-            (
-                doc.doc_id,
-                doc.corpus,
-                json.dumps(doc.metadata),
-                doc.created_at.isoformat(),
-                doc.updated_at.isoformat(),
-                doc.version,
-            ),
+        self.save_documents([(doc, chunks)])
+
+    @_writer
+    def save_documents(self, items: Sequence[Tuple[DocumentRecord, List[ChunkRecord]]]) -> None:
+        # 複数文書を 1 トランザクションで保存 / Save many documents in a single transaction
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO documents (doc_id, corpus, metadata, created_at, updated_at, version) VALUES (?, '', ?, ?, ?, ?)",
+                [_document_row(doc) for doc, _ in items],
+            )
+            self.conn.executemany(
+                "INSERT INTO corpus_pages (doc_id, page, text) VALUES (?, ?, ?)",
+                [(doc.doc_id, page, text) for doc, _ in items for page, text in _split_pages(doc.corpus)],
+            )
+            self._insert_chunks_locked([c for _, chunks in items for c in chunks])
+
+    @_writer
+    def append_document_text(self, doc_id: str, start: int, text: str, chunks: List[ChunkRecord]) -> None:
+        # ストリーム登録の 1 バッチ分 (本文の続き + チャンク) を保存 / Persist one batch of a streamed document
+        # documents 行は登録開始時に save_document で予約済み / The documents row is reserved up front
+        with self.conn:
+            first_page, filled = divmod(start, _PAGE_CHARS)
+            if filled:
+                # 書きかけの末尾ページに続けて書く / Continue the partially filled last page
+                row = self.conn.execute(
+                    "SELECT text FROM corpus_pages WHERE doc_id = ? AND page = ?", (doc_id, first_page)
+                ).fetchone()
+                text = row["text"][:filled] + text
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO corpus_pages (doc_id, page, text) VALUES (?, ?, ?)",
+                [(doc_id, page, part) for page, part in _split_pages(text, first_page)],
+            )
+            self._insert_chunks_locked(chunks)
+
+    def _insert_chunks_locked(self, chunks: List[ChunkRecord]) -> None:
+        # オフセットを持つチャンクは本文を複製しない / Chunks with offsets do not duplicate the corpus text
+        self.conn.executemany(
+            f"INSERT INTO chunks ({_CHUNK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+            [(c.chunk_id, c.doc_id, c.seq, "" if c.start is not None else c.text, c.start, c.end) for c in chunks],
         )
-        cur.executemany(
-            "INSERT INTO chunks (chunk_id, doc_id, seq, text) VALUES (?, ?, ?, ?)",
-            [(c.chunk_id, c.doc_id, c.seq, c.text) for c in chunks],
+
+    @_writer
+    def replace_document(
+        self,
+        doc: DocumentRecord,
+        new_chunks: List[ChunkRecord],
+        kept_chunks: List[ChunkRecord],
+        removed_chunk_ids: List[str],
+        deleted_at: datetime,
+    ) -> None:
+        # 文書の更新を 1 トランザクションで反映 / Apply a document update in one transaction
+        with self.conn:
+            self.conn.execute(
+                "UPDATE documents SET corpus = '', metadata = ?, updated_at = ?, version = ? WHERE doc_id = ?",
+                (json.dumps(doc.metadata), doc.updated_at.isoformat(), doc.version, doc.doc_id),
+            )
+            self.conn.execute("DELETE FROM corpus_pages WHERE doc_id = ?", (doc.doc_id,))
+            self.conn.executemany(
+                "INSERT INTO corpus_pages (doc_id, page, text) VALUES (?, ?, ?)",
+                [(doc.doc_id, page, text) for page, text in _split_pages(doc.corpus)],
+            )
+            self._tombstone_locked(doc.doc_id, doc.version - 1, removed_chunk_ids, deleted_at)
+            # 引き継いだチャンクも新しい本文上の位置へ付け替える / Re-point kept chunks at the new corpus
+            self.conn.executemany(
+                "UPDATE chunks SET seq = ?, text = '', start_offset = ?, end_offset = ? WHERE chunk_id = ?",
+                [(c.seq, c.start, c.end, c.chunk_id) for c in kept_chunks],
+            )
+            self._insert_chunks_locked(new_chunks)
+
+    @_writer
+    def delete_document(self, doc_id: str, deleted_at: datetime) -> Optional[List[str]]:
+        # 文書とチャンクを削除し、チャンクを tombstone に記録 / Delete and tombstone; None when missing
+        with self.conn:
+            row = self.conn.execute("SELECT version FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return None
+            chunk_ids = [
+                r["chunk_id"] for r in self.conn.execute("SELECT chunk_id FROM chunks WHERE doc_id = ?", (doc_id,))
+            ]
+            self._tombstone_locked(doc_id, row["version"], chunk_ids, deleted_at)
+            self.conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM corpus_pages WHERE doc_id = ?", (doc_id,))
+        return chunk_ids
+
+    def _tombstone_locked(self, doc_id: str, version: int, chunk_ids: List[str], deleted_at: datetime) -> None:
+        for start in range(0, len(chunk_ids), _MAX_VARIABLES):
+            part = chunk_ids[start : start + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(part))
+            self.conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", part)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tombstones (chunk_id, doc_id, version, deleted_at) VALUES (?, ?, ?, ?)",
+            [(cid, doc_id, version, deleted_at.isoformat()) for cid in chunk_ids],
         )
-        self.conn.commit()
+
+    def tombstoned_chunk_ids(self) -> Set[str]:
+        cur = self.conn.cursor()
+        cur.execute("SELECT chunk_id FROM tombstones")
+        return {row["chunk_id"] for row in cur.fetchall()}
+
+    def tombstone_versions(self, doc_ids: Iterable[str]) -> Dict[str, int]:
+        # 削除済み文書の最終版 (チャンク ID の再利用防止) / Last version of deleted docs, to avoid id reuse
+        ids = list(doc_ids)
+        found: Dict[str, int] = {}
+        cur = self.conn.cursor()
+        for start in range(0, len(ids), _MAX_VARIABLES):
+            part = ids[start : start + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(part))
+            cur.execute(
+                f"SELECT doc_id, MAX(version) AS version FROM tombstones WHERE doc_id IN ({placeholders}) GROUP BY doc_id",
+                part,
+            )
+            found.update((row["doc_id"], row["version"]) for row in cur.fetchall())
+        return found
+
+    @_writer
+    def purge_tombstones(self, chunk_ids: Iterable[str]) -> None:
+        ids = list(chunk_ids)
+        with self.conn:
+            for start in range(0, len(ids), _MAX_VARIABLES):
+                part = ids[start : start + _MAX_VARIABLES]
+                placeholders = ",".join("?" * len(part))
+                self.conn.execute(f"DELETE FROM tombstones WHERE chunk_id IN ({placeholders})", part)
 
     def document_exists(self, doc_id: str) -> bool:
         cur = self.conn.cursor()
         cur.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,))
         return cur.fetchone() is not None
 
-    def save_message(self, msg: MessageRecord) -> None:
+    def existing_doc_ids(self, doc_ids: Iterable[str]) -> Set[str]:
+        ids = list(doc_ids)
+        found: Set[str] = set()
+        cur = self.conn.cursor()
+        # SQLite のバインド変数上限に合わせて分割 / Split to stay under SQLite's bind-variable limit
+        for start in range(0, len(ids), _MAX_VARIABLES):
+            part = ids[start : start + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(part))
+            cur.execute(f"SELECT doc_id FROM documents WHERE doc_id IN ({placeholders})", part)
+            found.update(row["doc_id"] for row in cur.fetchall())
+        return found
+
+    @_writer
+    def save_message(self, msg: MessageRecord) -> int:
         cur = self.conn.cursor()
         cur.execute(
             """
-            INSERT INTO messages (session_id, role, raw_content, normalized_content, metadata, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO messages (session_id, role, raw_content, normalized_content, metadata, created_at, created_epoch)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 msg.session_id,
@@ -94,28 +383,126 @@ class SQLiteRepository:
                 msg.normalized_content,
                 json.dumps(msg.metadata),
                 msg.created_at.isoformat(),
+                epoch_seconds(msg.created_at),
             ),
         )
         self.conn.commit()
+        return int(cur.lastrowid)
+
+    @_writer
+    def mark_messages_indexed(self, message_ids: Iterable[int]) -> None:
+        ids = list(message_ids)
+        with self.conn:
+            for start in range(0, len(ids), _MAX_VARIABLES):
+                part = ids[start : start + _MAX_VARIABLES]
+                placeholders = ",".join("?" * len(part))
+                self.conn.execute(f"UPDATE messages SET indexed = 1 WHERE id IN ({placeholders})", part)
+
+    def unindexed_messages(self) -> List[Tuple[int, MessageRecord]]:
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT id, session_id, role, raw_content, normalized_content, metadata, created_at FROM messages WHERE indexed = 0 ORDER BY id ASC"
+        )
+        return [(row["id"], _row_to_message(row)) for row in cur.fetchall()]
+
+    def get_messages(self, message_ids: Iterable[int]) -> Dict[int, MessageRecord]:
+        ids = list(dict.fromkeys(message_ids))
+        found: Dict[int, MessageRecord] = {}
+        cur = self.conn.cursor()
+        for start in range(0, len(ids), _MAX_VARIABLES):
+            part = ids[start : start + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(part))
+            cur.execute(
+                f"SELECT id, session_id, role, raw_content, normalized_content, metadata, created_at FROM messages WHERE id IN ({placeholders})",
+                part,
+            )
+            found.update((row["id"], _row_to_message(row)) for row in cur.fetchall())
+        return found
+
+    def find_message_ids(
+        self,
+        *,
+        session_id: Optional[str] = None,
+        role: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> Set[int]:
+        # 条件はすべて SQL で評価する。時刻は UTC エポック秒で比較 (索引付き) / Filters run in SQL; time on indexed epochs
+        clauses: List[str] = []
+        params: List[Any] = []
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if role is not None:
+            clauses.append("role = ?")
+            params.append(role)
+        if since is not None:
+            clauses.append("created_epoch >= ?")
+            params.append(epoch_seconds(since))
+        if until is not None:
+            clauses.append("created_epoch < ?")
+            params.append(epoch_seconds(until))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT id FROM messages{where}", params)
+        return {row["id"] for row in cur.fetchall()}
 
     def get_session_messages(self, session_id: str) -> List[MessageRecord]:
         cur = self.conn.cursor()
         cur.execute(
-            "SELECT session_id, role, raw_content, normalized_content, metadata, created_at FROM messages WHERE session_id = ? ORDER BY created_at ASC",
+            "SELECT session_id, role, raw_content, normalized_content, metadata, created_at FROM messages WHERE session_id = ? ORDER BY created_at ASC, id ASC",
+            (session_id,),
+        )
+        return [_row_to_message(row) for row in cur.fetchall()]
+
+    def session_messages_after(self, session_id: str, after_id: int) -> List[Tuple[int, MessageRecord]]:
+        # ウォーターマークより後のメッセージを登録順に / Messages past the watermark, in insertion order
+        cur = self.conn.cursor()
+        cur.execute(
+            "SELECT id, session_id, role, raw_content, normalized_content, metadata, created_at FROM messages "
+            "WHERE session_id = ? AND id > ? ORDER BY id ASC",
+            (session_id, after_id),
+        )
+        return [(row["id"], _row_to_message(row)) for row in cur.fetchall()]
+
+    def pending_summary_stats(self, session_id: str) -> Tuple[int, int]:
+        # 未要約のメッセージ数と UTF-8 バイト数 / Count and UTF-8 bytes of messages not yet summarized
+        row = self.conn.execute(
+            "SELECT COUNT(*) AS n, COALESCE(SUM(LENGTH(CAST(raw_content AS BLOB))), 0) AS size FROM messages "
+            "WHERE session_id = ? AND id > COALESCE((SELECT last_message_id FROM session_summaries WHERE session_id = ?), 0)",
+            (session_id, session_id),
+        ).fetchone()
+        return row["n"], row["size"]
+
+    def get_session_summary(self, session_id: str) -> Optional[SessionSummary]:
+        row = self.conn.execute(
+            "SELECT session_id, summary, last_message_id, message_count, updated_at FROM session_summaries WHERE session_id = ?",
             (session_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return SessionSummary(
+            session_id=row["session_id"],
+            summary=row["summary"],
+            last_message_id=row["last_message_id"],
+            message_count=row["message_count"],
+            updated_at=datetime.fromisoformat(row["updated_at"]),
         )
-        rows = cur.fetchall()
-        return [
-            MessageRecord(
-                session_id=row["session_id"],
-                role=row["role"],
-                raw_content=row["raw_content"],
-                normalized_content=row["normalized_content"],
-                metadata=json.loads(row["metadata"]),
-                created_at=datetime.fromisoformat(row["created_at"]),
-            )
-            for row in rows
-        ]
+
+    @_writer
+    def save_session_summary(self, record: SessionSummary) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO session_summaries (session_id, summary, last_message_id, message_count, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    record.session_id,
+                    record.summary,
+                    record.last_message_id,
+                    record.message_count,
+                    record.updated_at.isoformat(),
+                ),
+            )
 
     def get_document(self, doc_id: str) -> Optional[DocumentRecord]:
         cur = self.conn.cursor()
@@ -126,9 +513,14 @@ class SQLiteRepository:
         row = cur.fetchone()
         if not row:
             return None
+        corpus = row["corpus"]
+        cur.execute("SELECT text FROM corpus_pages WHERE doc_id = ? ORDER BY page ASC", (doc_id,))
+        pages = [page["text"] for page in cur.fetchall()]
+        if pages:
+            corpus = "".join(pages)
         return DocumentRecord(
             doc_id=row["doc_id"],
-            corpus=row["corpus"],
+            corpus=corpus,
             metadata=json.loads(row["metadata"]),
             created_at=datetime.fromisoformat(row["created_at"]),
             updated_at=datetime.fromisoformat(row["updated_at"]),
@@ -137,9 +529,161 @@ class SQLiteRepository:
 
     def list_chunks(self, doc_id: str) -> List[ChunkRecord]:
         cur = self.conn.cursor()
-        cur.execute("SELECT chunk_id, doc_id, seq, text FROM chunks WHERE doc_id = ? ORDER BY seq ASC", (doc_id,))
-        rows = cur.fetchall()
-        return [
-            ChunkRecord(chunk_id=row["chunk_id"], doc_id=row["doc_id"], seq=row["seq"], text=row["text"])
-            for row in rows
-        ]
+        cur.execute(f"SELECT {_CHUNK_COLUMNS} FROM chunks WHERE doc_id = ? ORDER BY seq ASC", (doc_id,))
+        return self._rows_to_chunks(cur.fetchall())
+
+    def get_chunks(self, chunk_ids: Iterable[str]) -> Dict[str, ChunkRecord]:
+        # 主キー (chunk_id) で直接引く / Direct primary-key lookup by chunk_id
+        ids = list(dict.fromkeys(chunk_ids))
+        rows: List[sqlite3.Row] = []
+        cur = self.conn.cursor()
+        for start in range(0, len(ids), _MAX_VARIABLES):
+            part = ids[start : start + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(part))
+            cur.execute(f"SELECT {_CHUNK_COLUMNS} FROM chunks WHERE chunk_id IN ({placeholders})", part)
+            rows.extend(cur.fetchall())
+        return {chunk.chunk_id: chunk for chunk in self._rows_to_chunks(rows)}
+
+    def _rows_to_chunks(self, rows: List[sqlite3.Row]) -> List[ChunkRecord]:
+        # 本文は必要なページだけ読んで切り出す / Slice chunk text out of just the pages it spans
+        pages = self._get_pages(
+            {
+                (row["doc_id"], page)
+                for row in rows
+                if row["start_offset"] is not None
+                for page in range(row["start_offset"] // _PAGE_CHARS, (row["end_offset"] - 1) // _PAGE_CHARS + 1)
+            }
+        )
+        chunks: List[ChunkRecord] = []
+        for row in rows:
+            start, end = row["start_offset"], row["end_offset"]
+            if start is None:
+                # 旧形式のチャンクは本文を自身で持つ / Legacy rows carry their own text
+                text = row["text"]
+            else:
+                first = start // _PAGE_CHARS
+                span = range(first, (end - 1) // _PAGE_CHARS + 1)
+                base = first * _PAGE_CHARS
+                text = "".join(pages.get((row["doc_id"], page), "") for page in span)[start - base : end - base]
+            chunks.append(
+                ChunkRecord(
+                    chunk_id=row["chunk_id"], doc_id=row["doc_id"], seq=row["seq"], text=text, start=start, end=end
+                )
+            )
+        return chunks
+
+    def _get_pages(self, keys: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], str]:
+        pairs = list(keys)
+        found: Dict[Tuple[str, int], str] = {}
+        cur = self.conn.cursor()
+        step = _MAX_VARIABLES // 2
+        for start in range(0, len(pairs), step):
+            part = pairs[start : start + step]
+            values = ",".join(["(?, ?)"] * len(part))
+            cur.execute(
+                # (doc_id, page) の組ごとに主キー検索させる / One primary-key probe per (doc_id, page) pair
+                f"SELECT p.doc_id, p.page, p.text FROM (VALUES {values}) AS k "
+                "JOIN corpus_pages AS p ON p.doc_id = k.column1 AND p.page = k.column2",
+                [v for pair in part for v in pair],
+            )
+            found.update(((row["doc_id"], row["page"]), row["text"]) for row in cur.fetchall())
+        return found
+
+    def chunk_ids_matching(self, where: Dict[str, Any]) -> Set[str]:
+        # 正規化済み where に一致する文書のチャンク ID / Chunk ids of documents matching a normalized filter
+        sql, params = where_to_sql(where)
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT chunks.chunk_id FROM chunks JOIN documents ON documents.doc_id = chunks.doc_id WHERE {sql}", params)
+        return {row["chunk_id"] for row in cur.fetchall()}
+
+    def get_documents_metadata(self, doc_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        ids = list(dict.fromkeys(doc_ids))
+        found: Dict[str, Dict[str, Any]] = {}
+        cur = self.conn.cursor()
+        for start in range(0, len(ids), _MAX_VARIABLES):
+            part = ids[start : start + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(part))
+            cur.execute(f"SELECT doc_id, metadata FROM documents WHERE doc_id IN ({placeholders})", part)
+            found.update((row["doc_id"], json.loads(row["metadata"])) for row in cur.fetchall())
+        return found
+
+    def get_embeddings(self, model: str, text_hashes: Iterable[str]) -> Dict[str, bytes]:
+        hashes = list(dict.fromkeys(text_hashes))
+        found: Dict[str, bytes] = {}
+        cur = self.conn.cursor()
+        for start in range(0, len(hashes), _MAX_VARIABLES):
+            part = hashes[start : start + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(part))
+            cur.execute(
+                f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *part],
+            )
+            found.update((row["text_hash"], row["vector"]) for row in cur.fetchall())
+        return found
+
+    @_writer
+    def save_embeddings(self, model: str, items: Iterable[Tuple[str, bytes]]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model, text_hash, vector) for text_hash, vector in items],
+            )
+
+    def get_summaries(self, model: str, text_hashes: Iterable[str]) -> Dict[str, str]:
+        hashes = list(dict.fromkeys(text_hashes))
+        found: Dict[str, str] = {}
+        cur = self.conn.cursor()
+        for start in range(0, len(hashes), _MAX_VARIABLES):
+            part = hashes[start : start + _MAX_VARIABLES]
+            placeholders = ",".join("?" * len(part))
+            cur.execute(
+                f"SELECT text_hash, summary FROM chunk_summaries WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *part],
+            )
+            found.update((row["text_hash"], row["summary"]) for row in cur.fetchall())
+        return found
+
+    @_writer
+    def save_summaries(self, model: str, items: Iterable[Tuple[str, str]]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunk_summaries (model, text_hash, summary) VALUES (?, ?, ?)",
+                [(model, text_hash, summary) for text_hash, summary in items],
+            )
+
+
+class _ThreadConnection:
+    # スレッドごとの接続の入れ物 (weakref で寿命を追う) / Per-thread connection holder, tracked by weakref
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+
+
+def _release(conn: sqlite3.Connection, connections: List[sqlite3.Connection], lock: threading.Lock) -> None:
+    with lock:
+        if conn not in connections:
+            # close() 済み / Already closed by close()
+            return
+        connections.remove(conn)
+    conn.close()
+
+
+def _document_row(doc: DocumentRecord) -> Tuple[Any, ...]:
+    # 本文は corpus_pages 側に保存する / The corpus itself lives in corpus_pages
+    return (doc.doc_id, json.dumps(doc.metadata), doc.created_at.isoformat(), doc.updated_at.isoformat(), doc.version)
+
+
+def _split_pages(text: str, first_page: int = 0) -> List[Tuple[int, str]]:
+    return [(first_page + i, text[pos : pos + _PAGE_CHARS]) for i, pos in enumerate(range(0, len(text), _PAGE_CHARS))]
+
+
+def _row_to_message(row: sqlite3.Row) -> MessageRecord:
+    return MessageRecord(
+        session_id=row["session_id"],
+        role=row["role"],
+        raw_content=row["raw_content"],
+        normalized_content=row["normalized_content"],
+        metadata=json.loads(row["metadata"]),
+        created_at=datetime.fromisoformat(row["created_at"]),
+    )
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .cache import SummaryCache
+from .models import ChunkRecord, MessageRecord
+from .providers import FOLD_PROMPT, MERGE_PROMPT, SUMMARY_PROMPT, AsyncLLMProvider, LLMProvider, pack_batches
+
+
+def chunk_leaves(chunks: Sequence[ChunkRecord], *, max_tokens: int, max_chunks: int) -> List[str]:
+    # 連続するチャンクを予算内で 1 枚の葉に束ねる (重なりは除く) / Pack consecutive chunks into leaves, overlap removed
+    leaves: List[str] = []
+    for group in pack_batches([c.text for c in chunks], max_tokens=max_tokens, max_items=max_chunks):
+        parts: List[str] = []
+        prev_end: Optional[int] = None
+        for chunk in (chunks[i] for i in group):
+            text = chunk.text
+            if prev_end is not None and chunk.start is not None and chunk.start < prev_end:
+                text = text[prev_end - chunk.start :]
+            parts.append(text)
+            prev_end = chunk.end
+        leaves.append("".join(parts))
+    return leaves
+
+
+def message_leaves(messages: Sequence[MessageRecord], *, max_tokens: int) -> List[str]:
+    # 発言を順に予算内で束ねる。追記では末尾の葉だけが変わる / Appending messages only changes the last leaf
+    lines = [f"{m.role}: {m.normalized_content or m.raw_content}" for m in messages]
+    groups = pack_batches(lines, max_tokens=max_tokens, max_items=max(1, len(lines)))
+    return ["\n".join(lines[i] for i in group) for group in groups]
+
+
+def merge_groups(summaries: Sequence[str], *, max_tokens: int, fan_in: int) -> List[str]:
+    # 部分要約を fan_in 件・max_tokens 以内ずつ連結 / Concatenate partial summaries in bounded groups
+    groups = pack_batches(summaries, max_tokens=max_tokens, max_items=fan_in)
+    if len(groups) == len(summaries):
+        # 1 件ずつしか入らない場合も木が縮むよう 2 件ずつ束ねる / Always shrink the tree, pairwise at worst
+        groups = [list(range(i, min(i + 2, len(summaries)))) for i in range(0, len(summaries), 2)]
+    return ["\n\n".join(summaries[i] for i in group) for group in groups]
+
+
+def fold_input(previous: str, new: str) -> str:
+    return f"Summary so far:\n{previous}\n\nSince then:\n{new}"
+
+
+class _MapReduce:
+    def __init__(
+        self,
+        llm: "LLMProvider | AsyncLLMProvider",
+        *,
+        cache: Optional[SummaryCache] = None,
+        concurrency: int = 4,
+        fan_in: int = 8,
+        max_tokens: int = 3000,
+    ) -> None:
+        if concurrency <= 0 or fan_in < 2 or max_tokens <= 0:
+            raise ValueError("[mem][E004] summary_concurrency, summary_fan_in (>= 2) and summary_max_tokens must be positive")
+        self.llm = llm
+        self.cache = cache
+        self.concurrency = concurrency
+        self.fan_in = fan_in
+        self.max_tokens = max_tokens
+
+    def _lookup(self, texts: Sequence[str], stage: str) -> Tuple[Dict[str, str], List[str]]:
+        # (キャッシュ済みの要約, 要約が必要なテキスト) / (cached summaries, texts still to summarize)
+        # フォールバック要約 (クライアント無し) はキャッシュしない / Fallback summaries are never cached
+        found = self.cache.get_many(self._key(stage), texts) if self.cache is not None and self.llm.client else {}
+        return found, list(dict.fromkeys(t for t in texts if t not in found))
+
+    def _store(self, stage: str, found: Dict[str, str], missing: List[str], fresh: Sequence[str]) -> None:
+        summaries = dict(zip(missing, fresh))
+        found.update(summaries)
+        if self.cache is not None and self.llm.client:
+            self.cache.put_many(self._key(stage), summaries)
+
+    def _key(self, stage: str) -> str:
+        return f"{self.llm.model}:{stage}"
+
+
+class MapReduceSummarizer(_MapReduce):
+    """
+    長い文書・会話の階層要約 / Hierarchical (map-reduce) summarization.
+    葉 (チャンク群・発言群) を並列に要約し、部分要約を束ねて要約し直す操作を 1 件になるまで繰り返す。
+    各ノードの要約は入力テキストの SHA-256 でキャッシュするため、一部だけ変わった文書では
+    変わった葉と根までの経路だけを要約し直す。葉が 1 枚なら従来どおり 1 回の呼び出しで済む。
+    """
+
+    def summarize(self, leaves: Sequence[str]) -> str:
+        level = self._summarize_many(leaves, "map", SUMMARY_PROMPT)
+        while len(level) > 1:
+            groups = merge_groups(level, max_tokens=self.max_tokens, fan_in=self.fan_in)
+            level = self._summarize_many(groups, "reduce", MERGE_PROMPT)
+        return level[0] if level else ""
+
+    def fold(self, previous: str, messages: Sequence[MessageRecord]) -> str:
+        """
+        逐次要約に新しい発言を畳み込む / Fold new messages into a rolling summary.
+        新しい発言が 1 枚の葉に収まらない (初回・大量の未要約分) 場合は先に map-reduce で要約する。
+        """
+        leaves = message_leaves(messages, max_tokens=self.max_tokens)
+        if not previous:
+            return self.summarize(leaves)
+        new = leaves[0] if len(leaves) == 1 else self.summarize(leaves)
+        return self.llm.summarize(fold_input(previous, new), prompt=FOLD_PROMPT)
+
+    def _summarize_many(self, texts: Sequence[str], stage: str, prompt: str) -> List[str]:
+        found, missing = self._lookup(texts, stage)
+        if len(missing) == 1:
+            self._store(stage, found, missing, [self.llm.summarize(missing[0], prompt=prompt)])
+        elif missing:
+            workers = min(self.concurrency, len(missing))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="memolla-summary") as pool:
+                fresh = list(pool.map(lambda text: self.llm.summarize(text, prompt=prompt), missing))
+            self._store(stage, found, missing, fresh)
+        return [found[t] for t in texts]
+
+
+class AsyncMapReduceSummarizer(_MapReduce):
+    # MapReduceSummarizer の非同期版 (同時実行数はセマフォで制限) / asyncio counterpart, bounded by a semaphore
+
+    async def summarize(self, leaves: Sequence[str]) -> str:
+        level = await self._summarize_many(leaves, "map", SUMMARY_PROMPT)
+        while len(level) > 1:
+            groups = merge_groups(level, max_tokens=self.max_tokens, fan_in=self.fan_in)
+            level = await self._summarize_many(groups, "reduce", MERGE_PROMPT)
+        return level[0] if level else ""
+
+    async def _summarize_many(self, texts: Sequence[str], stage: str, prompt: str) -> List[str]:
+        found, missing = await asyncio.to_thread(self._lookup, texts, stage)
+        if missing:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def one(text: str) -> str:
+                async with semaphore:
+                    return await self.llm.summarize(text, prompt=prompt)
+
+            fresh = await asyncio.gather(*(one(text) for text in missing))
+            await asyncio.to_thread(self._store, stage, found, missing, fresh)
+        return [found[t] for t in texts]
@@ -1,22 +1,135 @@
 from __future__ import annotations
 
-from typing import List
+import codecs
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Generic, Hashable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+def normalize_text(text: str) -> str:
+    # 全角/半角と空白の揺れのみ吸収する / Fold width variants and whitespace only
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def epoch_seconds(dt: datetime) -> float:
+    # UTC エポック秒。タイムゾーンなしの日時は UTC とみなす (utcnow と同じ扱い) / Naive datetimes are treated as UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
 
 
 def chunk_text(text: str, *, chunk_size: int = 512, overlap: int = 32) -> List[str]:
     # シンプルな文字ベース分割 / Simple char-based chunking
-    chunks: List[str] = []
+    return [text[start:end] for start, end in chunk_spans(len(text), chunk_size=chunk_size, overlap=overlap)]
+
+
+def chunk_spans(length: int, *, chunk_size: int = 512, overlap: int = 32) -> List[Tuple[int, int]]:
+    # chunk_text と同じ境界を本文オフセット [start, end) で返す / chunk_text boundaries as offsets
+    spans: List[Tuple[int, int]] = []
     start = 0
-    while start < len(text):
-        end = min(len(text), start + chunk_size)
-        chunks.append(text[start:end])
+    while start < length:
+        end = min(length, start + chunk_size)
+        spans.append((start, end))
         start = end - overlap
         if start < 0:
             start = 0
-        if start >= len(text):
+        if start >= length:
             break
-        if end == len(text):
+        if end == length:
             break
-    if not chunks:
-        chunks.append(text)
-    return chunks
+    if not spans:
+        spans.append((0, length))
+    return spans
+
+
+def iter_text(source: Any, *, encoding: str = "utf-8", block_size: int = 1 << 20) -> Iterator[str]:
+    # パス・ファイル・str/bytes の iterable を文字列断片の列にそろえる / Normalize a source into text pieces
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from iter_text(f, encoding=encoding, block_size=block_size)
+        return
+    if hasattr(source, "read"):
+        pieces: Iterable[Any] = iter(lambda: source.read(block_size), source.read(0))
+    else:
+        pieces = source
+    decoder = None
+    for piece in pieces:
+        if isinstance(piece, (bytes, bytearray)):
+            # マルチバイト文字がブロック境界で分割されても復号できるよう逐次デコード / Incremental decode
+            decoder = decoder or codecs.getincrementaldecoder(encoding)()
+            piece = decoder.decode(piece)
+        yield piece
+    if decoder is not None:
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+
+def iter_chunks(pieces: Iterable[str], *, chunk_size: int = 512, overlap: int = 32) -> Iterator[str]:
+    # chunk_text の逐次版: 入力を少しずつ受け取り、同じ境界でチャンクを返す / Streaming chunk_text, same boundaries
+    buffer = ""
+    pos = 0
+    emitted = False
+    for piece in pieces:
+        if not piece:
+            continue
+        buffer = buffer[pos:] + piece
+        pos = 0
+        # 末尾が確定するまで (後続データがあると分かるまで) 最後の窓は出さない / Hold the last window until EOF
+        while len(buffer) - pos > chunk_size:
+            yield buffer[pos : pos + chunk_size]
+            emitted = True
+            pos += chunk_size - overlap
+    if len(buffer) > pos or not emitted:
+        yield buffer[pos:]
+
+
+class LRUCache(Generic[K, V]):
+    # スレッドセーフな件数上限付き LRU / Thread-safe LRU bounded by entry count
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def get_many(self, keys: Iterable[K]) -> Dict[K, V]:
+        found: Dict[K, V] = {}
+        with self._lock:
+            for key in keys:
+                value = self._data.get(key)
+                if value is not None:
+                    self._data.move_to_end(key)
+                    found[key] = value
+        return found
+
+    def put(self, key: K, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key: K) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,956 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import AbstractSet, Any, Dict, FrozenSet, Iterable, List, Optional, Protocol, Sequence, Set, Tuple
+
+import numpy as np
+
+from .filters import where_key
+from .models import ChunkRecord
+from .providers import EmbeddingProvider
+from .utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+VECTOR_BACKENDS = ("chroma", "numpy", "ivf")
+VECTOR_DTYPES = ("float32", "float16", "int8")
+# 行列積をこの行数ずつ計算して一時配列を抑える / Rows scored per block to bound temporaries
+_BLOCK_ROWS = 16384
+# IVF: 学習を始める有効行数・1 リストあたりの最小/標本行数・k-means の反復回数
+# IVF: rows before training, min/sample rows per list, k-means iterations
+_IVF_MIN_TRAIN = 10000
+_IVF_MIN_PER_LIST = 39
+_IVF_TRAIN_PER_LIST = 64
+_IVF_TRAIN_ITERS = 10
+# where 句ごとに保持する許可行マスクの数 / Permitted-row masks kept per where clause
+_MASK_CACHE_SIZE = 32
+
+
+class VectorIndex(Protocol):
+    # ベクトル検索バックエンドの共通 I/F / Common interface of vector backends
+    def add_chunks(self, chunks: List[ChunkRecord], metadatas: Optional[List[Dict[str, Any]]] = None) -> None: ...
+
+    def add_embeddings(
+        self,
+        chunks: List[ChunkRecord],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> None: ...
+
+    def update_metadata(self, chunk_ids: List[str], metadatas: List[Dict[str, Any]]) -> None: ...
+
+    def delete(self, chunk_ids: Iterable[str]) -> None: ...
+
+    def compact(self) -> Set[str]: ...
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[Tuple[str, float]]: ...
+
+    def search_by_vector(
+        self,
+        query_emb: List[float],
+        top_k: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[Tuple[str, float]]: ...
+
+
+def build_vector_index(
+    backend: str,
+    *,
+    embedding: EmbeddingProvider,
+    collection: str,
+    persist_dir: Optional[str],
+    base_dir: Path,
+    dtype: Optional[str] = None,
+    rescore: int = 4,
+    nlist: Optional[int] = None,
+    nprobe: Optional[int] = None,
+) -> VectorIndex:
+    # backend 名からベクトルインデックスを生成 / Construct the vector index for a backend name
+    if backend == "ivf":
+        return IVFVectorIndex(
+            base_dir=base_dir / collection, embedding=embedding, dtype=dtype, rescore=rescore, nlist=nlist, nprobe=nprobe
+        )
+    if backend == "numpy":
+        return NumpyVectorIndex(base_dir=base_dir / collection, embedding=embedding, dtype=dtype, rescore=rescore)
+    if backend == "chroma":
+        from .indexes import DenseIndex
+
+        return DenseIndex(persist_dir=persist_dir, embedding=embedding, collection=collection)
+    raise ValueError(f"[mem][E004] unsupported vector backend: {backend}")
+
+
+class _Snapshot:
+    """
+    検索が参照する不変の状態 / Immutable view used by searches.
+    追加・削除のたびに丸ごと差し替えるため、検索はロックなしで一貫した状態を読める。
+    """
+
+    __slots__ = ("rows", "vectors", "originals", "norms", "scales", "keys", "order", "sorted_keys", "dead", "ids")
+
+    def __init__(
+        self,
+        rows: int,
+        vectors: np.ndarray,
+        originals: Optional[np.ndarray],
+        norms: np.ndarray,
+        scales: Optional[np.ndarray],
+        keys: np.ndarray,
+        order: np.ndarray,
+        dead: np.ndarray,
+        ids: "_IdTable",
+    ) -> None:
+        # order: キーの昇順に並べた行番号 / Rows sorted by key, for id lookups
+        self.rows = rows
+        self.vectors = vectors
+        self.originals = originals
+        self.norms = norms
+        self.scales = scales
+        self.keys = keys
+        self.order = order
+        self.sorted_keys = keys[order]
+        self.dead = dead
+        self.ids = ids
+
+
+class _IdTable:
+    # UTF-8 連結バイト列 + 終端オフセット (mmap のまま参照) / Concatenated UTF-8 ids with end offsets
+    __slots__ = ("ends", "blob")
+
+    def __init__(self, ends: np.ndarray, blob: np.ndarray) -> None:
+        self.ends = ends
+        self.blob = blob
+
+    def __getitem__(self, row: int) -> str:
+        start = int(self.ends[row - 1]) if row else 0
+        return self.blob[start : int(self.ends[row])].tobytes().decode("utf-8")
+
+    def matches(self, rows: np.ndarray, encoded: Sequence[bytes]) -> np.ndarray:
+        # rows[i] の ID が encoded[i] と一致するか (バイト列をまとめて比較) / Vectorized byte-wise id comparison
+        if not len(rows):
+            return np.zeros(0, dtype=bool)
+        starts = np.where(rows > 0, self.ends[rows - 1], np.uint64(0)).astype(np.int64)
+        lengths = self.ends[rows].astype(np.int64) - starts
+        wanted = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        same = lengths == wanted
+        idx = np.flatnonzero(same)
+        if len(idx):
+            sizes = wanted[idx]
+            within = np.arange(int(sizes.sum())) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            got = self.blob[np.repeat(starts[idx], sizes) + within]
+            expected = np.frombuffer(b"".join(encoded[i] for i in idx), dtype=np.uint8)
+            owner = np.repeat(np.arange(len(idx)), sizes)
+            same[idx] = np.bincount(owner, weights=got != expected, minlength=len(idx)) == 0
+        return same
+
+
+class NumpyVectorIndex:
+    """
+    NumPy によるベクトルインデックス / Flat, memory-mapped vector index.
+    埋め込みは追記専用のファイルに行として保存して mmap で参照し、検索はブロック単位の行列積と
+    argpartition による top-k で行う。dtype="float16" / "int8" では量子化した行列で候補を絞り、
+    rescore 倍の候補を float32 の原本で再計算する。距離・スコアは Chroma (l2) と同じ 1 / (1 + 距離^2)。
+    where 句は使わず、SQLite 側で求めた許可 ID 集合 (allowed) で絞り込む。
+    """
+
+    def __init__(
+        self,
+        *,
+        base_dir: Path,
+        embedding: EmbeddingProvider,
+        dtype: Optional[str] = None,
+        rescore: int = 4,
+    ) -> None:
+        # dtype=None なら既存ファイルの形式 (新規は float32) / None keeps the on-disk format (float32 when new)
+        if dtype is not None and dtype not in VECTOR_DTYPES:
+            raise ValueError(f"[mem][E004] unsupported vector dtype: {dtype}")
+        self.embedding = embedding
+        self.base_dir = Path(base_dir)
+        self.dtype = dtype or "float32"
+        self.rescore = rescore
+        self.dim: Optional[int] = None
+        self._keep_originals = self.dtype != "float32" and rescore > 1
+        self._lock = threading.RLock()
+        self._deleted: FrozenSet[str] = frozenset()
+        # where_key -> (keys 配列, allowed, 許可行マスク) / Masks valid while the rows and `allowed` are unchanged
+        self._masks: LRUCache[str, Tuple[np.ndarray, AbstractSet[str], np.ndarray]] = LRUCache(_MASK_CACHE_SIZE)
+        self._recover_compaction()
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self._load_meta(dtype)
+        self._snapshot = self._open()
+
+    def count(self) -> int:
+        # 有効な行数 (__len__ だと空のインデックスが偽になるため使わない) / Live rows; not __len__ so empty stays truthy
+        snap = self._snapshot
+        return int(snap.rows - np.count_nonzero(snap.dead))
+
+    def add_chunks(self, chunks: List[ChunkRecord], metadatas: Optional[List[Dict[str, Any]]] = None) -> None:
+        if not chunks:
+            return
+        embeddings = self.embedding.embed_texts([c.text for c in chunks])
+        self.add_embeddings(chunks, embeddings, metadatas)
+
+    def add_embeddings(
+        self,
+        chunks: List[ChunkRecord],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        # 絞り込みは SQLite 側の許可 ID 集合で行うためメタデータは保持しない / Filters use `allowed`, not metadata
+        if not chunks:
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2 or len(matrix) != len(chunks):
+            raise ValueError("[mem][E004] embeddings must match chunks")
+        encoded = [c.chunk_id.encode("utf-8") for c in chunks]
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(matrix.shape[1])
+                self._save_meta()
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"[mem][E004] embedding dimension mismatch: {matrix.shape[1]} != {self.dim}")
+            snap = self._snapshot
+            ends = np.cumsum([len(e) for e in encoded], dtype=np.uint64)
+            if snap.rows:
+                ends += snap.ids.ends[snap.rows - 1]
+            # 同一ファイル群に追記 (途中で落ちた場合は読み込み時に短い方へ揃える) / Append; torn tails are trimmed on load
+            self._append("vectors.bin", self._quantize(matrix))
+            if self._keep_originals:
+                self._append("originals.f32", matrix)
+            self._append("norms.f32", np.einsum("ij,ij->i", matrix, matrix).astype(np.float32))
+            if self.dtype == "int8":
+                self._append("scales.f32", _int8_scales(matrix))
+            self._append("keys.u64", _keys(c.chunk_id for c in chunks))
+            self._append_bytes("ids.blob", b"".join(encoded))
+            self._append("ids.end", ends)
+            # 既存 ID への再登録は古い行を無効化して上書き扱い / Re-adding an id supersedes its old row
+            dead = np.concatenate([snap.dead, np.zeros(len(chunks), dtype=bool)])
+            self._snapshot = self._open(dead)
+
+    def update_metadata(self, chunk_ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        # メタデータを持たないため何もしない / No metadata is stored
+        return
+
+    def delete(self, chunk_ids: Iterable[str]) -> None:
+        # 即座に検索対象から外し、物理削除は compact で行う / Hide immediately, purge on compact()
+        ids = list(chunk_ids)
+        with self._lock:
+            snap = self._snapshot
+            rows = self._rows_for(snap, ids)
+            if len(rows):
+                dead = snap.dead.copy()
+                dead[rows] = True
+                self._snapshot = self._replace(snap, dead=dead)
+            self._deleted = self._deleted | frozenset(ids)
+
+    def compact(self) -> Set[str]:
+        """
+        無効化された行を取り除いてファイルを書き直す / Rewrite the files without dead rows.
+        新しいファイル群を別ディレクトリに作ってから差し替えるため、実行中の検索は旧 mmap を読み続ける。
+        """
+        with self._lock:
+            snap = self._snapshot
+            deleted = self._deleted
+            self._deleted = frozenset()
+            if not snap.dead.any():
+                return set(deleted)
+            alive = np.flatnonzero(~snap.dead)
+            staging = self.base_dir.with_name(self.base_dir.name + ".compact")
+            shutil.rmtree(staging, ignore_errors=True)
+            staging.mkdir(parents=True)
+            for name, array in self._row_arrays(snap):
+                if array is None:
+                    continue
+                with open(staging / name, "wb") as f:
+                    for start in range(0, len(alive), _BLOCK_ROWS):
+                        f.write(np.ascontiguousarray(array[alive[start : start + _BLOCK_ROWS]]).tobytes())
+            starts = np.concatenate([np.zeros(1, dtype=np.uint64), snap.ids.ends[: snap.rows - 1]])
+            with open(staging / "ids.blob", "wb") as f:
+                f.write(b"".join(snap.ids.blob[int(starts[r]) : int(snap.ids.ends[r])].tobytes() for r in alive))
+            lengths = snap.ids.ends[alive] - starts[alive]
+            np.cumsum(lengths, dtype=np.uint64).tofile(staging / "ids.end")
+            # 行単位でないファイル (meta.json 等) はそのまま引き継ぐ / Carry over files that are not per-row
+            for path in self.base_dir.iterdir():
+                if not (staging / path.name).exists():
+                    shutil.copyfile(path, staging / path.name)
+            # 旧ディレクトリを退避してから入れ替える (中断時は起動時に復旧) / Swap dirs; recovered on restart
+            retired = self.base_dir.with_name(self.base_dir.name + ".old")
+            os.replace(self.base_dir, retired)
+            os.replace(staging, self.base_dir)
+            shutil.rmtree(retired, ignore_errors=True)
+            self._snapshot = self._open()
+            logger.info("Compacted vector index %s (%d -> %d rows)", self.base_dir.name, snap.rows, len(alive))
+            return set(deleted)
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[Tuple[str, float]]:
+        if not self.count():
+            return []
+        query_emb = self.embedding.embed_query(query)
+        return self.search_by_vector(query_emb, top_k, where=where, allowed=allowed)
+
+    def search_by_vector(
+        self,
+        query_emb: List[float],
+        top_k: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[Tuple[str, float]]:
+        return self.search_by_vectors([query_emb], top_k, where=where, allowed=allowed)[0]
+
+    def search_by_vectors(
+        self,
+        query_embs: Sequence[List[float]],
+        top_k: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+    ) -> List[List[Tuple[str, float]]]:
+        # 複数クエリをまとめて 1 回の走査で検索 / Score many queries in a single pass over the matrix
+        snap = self._snapshot
+        if not query_embs:
+            return []
+        if not snap.rows or top_k <= 0:
+            return [[] for _ in query_embs]
+        queries = self._as_queries(query_embs)
+        excluded = self._excluded(snap, allowed, where)
+        k = self._candidate_k(snap, top_k)
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        best_rows: List[List[np.ndarray]] = [[] for _ in query_embs]
+        best_dist: List[List[np.ndarray]] = [[] for _ in query_embs]
+        # 量子化行列はブロックごとに同じ float32 バッファへ展開 / Widen quantized blocks into one reused buffer
+        buffer = np.empty((min(snap.rows, _BLOCK_ROWS), self.dim), dtype=np.float32) if self.dtype != "float32" else None
+        for start in range(0, snap.rows, _BLOCK_ROWS):
+            end = min(snap.rows, start + _BLOCK_ROWS)
+            valid = ~excluded[start:end]
+            if not valid.any():
+                continue
+            block = snap.vectors[start:end]
+            if buffer is not None:
+                np.copyto(buffer[: end - start], block)
+                block = buffer[: end - start]
+            dots = block @ queries.T
+            if snap.scales is not None:
+                dots *= snap.scales[start:end, None]
+            dist = snap.norms[start:end, None] - 2.0 * dots + q_norms[None, :]
+            dist[~valid] = np.inf
+            for qi in range(len(queries)):
+                rows, values = _smallest(dist[:, qi], k)
+                best_rows[qi].append(rows + start)
+                best_dist[qi].append(values)
+        results: List[List[Tuple[str, float]]] = []
+        for qi in range(len(queries)):
+            if not best_rows[qi]:
+                results.append([])
+                continue
+            rows = np.concatenate(best_rows[qi])
+            dist = np.concatenate(best_dist[qi])
+            results.append(self._rank(snap, queries[qi], q_norms[qi], rows, dist, top_k))
+        return results
+
+    def _as_queries(self, query_embs: Sequence[List[float]]) -> np.ndarray:
+        queries = np.asarray(query_embs, dtype=np.float32)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"[mem][E004] embedding dimension mismatch: {queries.shape[1]} != {self.dim}")
+        return queries
+
+    def _excluded(
+        self, snap: _Snapshot, allowed: Optional[AbstractSet[str]], where: Optional[Dict[str, Any]] = None
+    ) -> np.ndarray:
+        # 削除済み行と許可集合外の行 / Dead rows plus rows outside `allowed`
+        if allowed is None:
+            return snap.dead
+        return snap.dead | ~self._permitted(snap, allowed, where)
+
+    def _permitted(
+        self, snap: _Snapshot, allowed: AbstractSet[str], where: Optional[Dict[str, Any]] = None
+    ) -> np.ndarray:
+        """
+        allowed に含まれる行のマスク / Mask of rows whose id is in `allowed`.
+        where があれば where_key ごとにキャッシュし、行が増えるか allowed が別のオブジェクトに
+        なるまで (呼び出し側は世代ごとに同じ集合を使い回す) ID のハッシュ計算を省く。
+        """
+        key = where_key(where) if where is not None else None
+        if key is not None:
+            cached = self._masks.get(key)
+            if cached is not None and cached[0] is snap.keys and cached[1] is allowed:
+                return cached[2]
+        permitted = np.zeros(snap.rows, dtype=bool)
+        permitted[self._rows_for(snap, allowed)] = True
+        if key is not None:
+            self._masks.put(key, (snap.keys, allowed, permitted))
+        return permitted
+
+    def _candidate_k(self, snap: _Snapshot, top_k: int) -> int:
+        # 原本で再計算する場合は rescore 倍の候補を残す / Keep rescore x candidates when re-ranking
+        return top_k * max(1, self.rescore) if snap.originals is not None else top_k
+
+    def _rank(
+        self,
+        snap: _Snapshot,
+        query: np.ndarray,
+        q_norm: float,
+        rows: np.ndarray,
+        dist: np.ndarray,
+        top_k: int,
+    ) -> List[Tuple[str, float]]:
+        # 候補から上位を選び (必要なら再計算して) スコアへ変換 / Pick, optionally rescore, and convert to scores
+        keep = np.isfinite(dist)
+        rows, dist = rows[keep], dist[keep]
+        idx, _ = _smallest(dist, self._candidate_k(snap, top_k))
+        rows, dist = rows[idx], dist[idx]
+        if snap.originals is not None and len(rows):
+            # 量子化誤差を原本ベクトルで補正 (昇順に読むと mmap のアクセスが連続する) / Re-rank with float32 originals
+            rows = np.sort(rows)
+            dist = snap.norms[rows] - 2.0 * (snap.originals[rows] @ query) + q_norm
+        idx, _ = _smallest(dist, top_k)
+        return [(snap.ids[int(rows[i])], float(1.0 / (1.0 + max(float(dist[i]), 0.0)))) for i in idx]
+
+    def _row_arrays(self, snap: _Snapshot) -> List[Tuple[str, Optional[np.ndarray]]]:
+        # compact で行単位に書き直すファイル / Per-row files rewritten by compact()
+        return [
+            ("vectors.bin", snap.vectors),
+            ("originals.f32", snap.originals),
+            ("norms.f32", snap.norms),
+            ("scales.f32", snap.scales),
+            ("keys.u64", snap.keys),
+        ]
+
+    def _quantize(self, matrix: np.ndarray) -> np.ndarray:
+        if self.dtype == "float16":
+            return matrix.astype(np.float16)
+        if self.dtype == "int8":
+            scales = _int8_scales(matrix)
+            return np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return matrix
+
+    def _rows_for(self, snap: _Snapshot, chunk_ids: Iterable[str]) -> np.ndarray:
+        # ID → 行番号 (ハッシュの二分探索、衝突は ID をまとめて照合して除外) / Rows for ids via sorted 64-bit keys
+        if not snap.rows:
+            return np.zeros(0, dtype=np.int64)
+        encoded = [cid.encode("utf-8") for cid in chunk_ids]
+        wanted = _encoded_keys(encoded)
+        lo = np.searchsorted(snap.sorted_keys, wanted, side="left")
+        counts = np.searchsorted(snap.sorted_keys, wanted, side="right") - lo
+        # 同じキーの行 (再登録・衝突) を全て候補にする / Every row sharing a key is a candidate
+        owner = np.repeat(np.arange(len(encoded)), counts)
+        pos = np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()))
+        rows = snap.order[pos].astype(np.int64)
+        return rows[snap.ids.matches(rows, [encoded[i] for i in owner])]
+
+    def _open(self, dead: Optional[np.ndarray] = None) -> _Snapshot:
+        # 各ファイルの完全な行数の最小値までを有効とする / Trust only rows complete in every file
+        if self.dim is None:
+            return _Snapshot(
+                0,
+                np.zeros((0, 0), dtype=np.float32),
+                None,
+                np.zeros(0, dtype=np.float32),
+                None,
+                np.zeros(0, dtype=np.uint64),
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=bool),
+                _IdTable(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint8)),
+            )
+        item = np.dtype(self.dtype).itemsize
+        counts = [
+            self._size("vectors.bin") // (item * self.dim),
+            self._size("norms.f32") // 4,
+            self._size("keys.u64") // 8,
+            self._size("ids.end") // 8,
+        ]
+        if self._keep_originals:
+            counts.append(self._size("originals.f32") // (4 * self.dim))
+        if self.dtype == "int8":
+            counts.append(self._size("scales.f32") // 4)
+        rows = min(counts)
+        ends = self._map("ids.end", np.uint64, (rows,))
+        blob_len = int(ends[rows - 1]) if rows else 0
+        while rows and blob_len > self._size("ids.blob"):
+            rows -= 1
+            blob_len = int(ends[rows - 1]) if rows else 0
+        if self._truncate(rows, blob_len):
+            ends = self._map("ids.end", np.uint64, (rows,))
+        keys = self._map("keys.u64", np.uint64, (rows,))
+        order = np.argsort(keys, kind="stable")
+        if dead is None or len(dead) != rows:
+            dead = np.zeros(rows, dtype=bool)
+        # 同じ ID が複数行あれば最後の行だけを残す (安定ソートなので後ろが新しい) / Only the newest duplicate is live
+        sorted_keys = keys[order]
+        dup = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1])
+        if len(dup):
+            dead = dead.copy()
+            dead[order[dup]] = True
+        return _Snapshot(
+            rows,
+            self._map("vectors.bin", np.dtype(self.dtype), (rows, self.dim)),
+            self._map("originals.f32", np.float32, (rows, self.dim)) if self._keep_originals else None,
+            self._map("norms.f32", np.float32, (rows,)),
+            self._map("scales.f32", np.float32, (rows,)) if self.dtype == "int8" else None,
+            keys,
+            order,
+            dead,
+            _IdTable(ends, self._map("ids.blob", np.uint8, (blob_len,))),
+        )
+
+    @staticmethod
+    def _replace(snap: _Snapshot, *, dead: np.ndarray) -> _Snapshot:
+        return _Snapshot(
+            snap.rows, snap.vectors, snap.originals, snap.norms, snap.scales, snap.keys, snap.order, dead, snap.ids
+        )
+
+    def _truncate(self, rows: int, blob_len: int) -> bool:
+        assert self.dim is not None
+        item = np.dtype(self.dtype).itemsize
+        sizes = {
+            "vectors.bin": rows * item * self.dim,
+            "norms.f32": rows * 4,
+            "keys.u64": rows * 8,
+            "ids.end": rows * 8,
+            "ids.blob": blob_len,
+        }
+        if self._keep_originals:
+            sizes["originals.f32"] = rows * 4 * self.dim
+        if self.dtype == "int8":
+            sizes["scales.f32"] = rows * 4
+        torn = False
+        for name, size in sizes.items():
+            if self._size(name) > size:
+                os.truncate(self.base_dir / name, size)
+                torn = True
+        if torn:
+            logger.warning("Dropped torn rows from vector index %s (%d rows kept)", self.base_dir.name, rows)
+        return torn
+
+    def _map(self, name: str, dtype: Any, shape: Tuple[int, ...]) -> np.ndarray:
+        # 空ファイルは mmap できないため空配列を返す / Empty files cannot be memory-mapped
+        if not all(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.base_dir / name, dtype=dtype, mode="r", shape=shape)
+
+    def _size(self, name: str) -> int:
+        path = self.base_dir / name
+        return path.stat().st_size if path.exists() else 0
+
+    def _append(self, name: str, array: np.ndarray) -> None:
+        self._append_bytes(name, np.ascontiguousarray(array).tobytes())
+
+    def _append_bytes(self, name: str, data: bytes) -> None:
+        with open(self.base_dir / name, "ab") as f:
+            f.write(data)
+
+    def _load_meta(self, requested: Optional[str]) -> None:
+        path = self.base_dir / "meta.json"
+        if not path.exists():
+            return
+        meta = json.loads(path.read_text())
+        self.dim = meta.get("dim")
+        stored = meta.get("dtype", self.dtype)
+        if requested is not None and stored != requested:
+            # 既存ファイルの形式を優先 / The on-disk format wins over the requested dtype
+            logger.warning("Vector index %s is stored as %s; ignoring dtype=%s", self.base_dir.name, stored, requested)
+        self.dtype = stored
+        self._keep_originals = bool(meta.get("originals", False))
+
+    def _save_meta(self) -> None:
+        meta = {"dim": self.dim, "dtype": self.dtype, "originals": self._keep_originals}
+        (self.base_dir / "meta.json").write_text(json.dumps(meta))
+
+    def _recover_compaction(self) -> None:
+        # 入れ替え途中で終了した場合の復旧 / Finish or roll back an interrupted directory swap
+        staging = self.base_dir.with_name(self.base_dir.name + ".compact")
+        retired = self.base_dir.with_name(self.base_dir.name + ".old")
+        if not self.base_dir.exists() and retired.exists():
+            os.replace(retired, self.base_dir)
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(retired, ignore_errors=True)
+
+
+class _IVFState:
+    """
+    検索が参照する IVF の状態 / IVF view used by searches.
+    list_rows は indexed_rows 行目までを重心ごとに並べた CSR。それ以降の行は assign (各行の所属リスト) で絞り込む。
+    """
+
+    __slots__ = ("generation", "centroids", "c_norms", "offsets", "list_rows", "indexed_rows", "trained_rows", "assign")
+
+    def __init__(
+        self,
+        generation: int,
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        list_rows: np.ndarray,
+        indexed_rows: int,
+        trained_rows: int,
+        assign: np.ndarray,
+        c_norms: Optional[np.ndarray] = None,
+    ) -> None:
+        self.generation = generation
+        self.centroids = centroids
+        self.c_norms = np.einsum("ij,ij->i", centroids, centroids) if c_norms is None else c_norms
+        self.offsets = offsets
+        self.list_rows = list_rows
+        self.indexed_rows = indexed_rows
+        self.trained_rows = trained_rows
+        self.assign = assign
+
+
+class IVFVectorIndex(NumpyVectorIndex):
+    """
+    IVF (転置ファイル) による近似最近傍インデックス / Approximate index with k-means coarse quantization.
+    NumpyVectorIndex のファイル群に加えて重心 (centroids-<世代>.f32) と各行の所属リスト (lists-<世代>.u32) を保存し、
+    検索はクエリに近い nprobe 個のリストと未索引の末尾行だけを採点する。min_train 行に満たない間と、
+    allowed が小さい場合は全件 (厳密) 検索になる。有効行数が学習時の 4 倍に達したら、その時点のスナップショットで
+    バックグラウンドに再学習し、完了までは現行世代のリストで検索を続けてから新しい世代に差し替える。
+    """
+
+    def __init__(
+        self,
+        *,
+        base_dir: Path,
+        embedding: EmbeddingProvider,
+        dtype: Optional[str] = None,
+        rescore: int = 4,
+        nlist: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        min_train: int = _IVF_MIN_TRAIN,
+    ) -> None:
+        # nlist=None: 約 4√N / nprobe=None: max(8, nlist/16) / Defaults scale with the collection
+        if (nlist is not None and nlist <= 0) or (nprobe is not None and nprobe <= 0):
+            raise ValueError("[mem][E004] nlist and nprobe must be positive")
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = max(1, min_train)
+        self._ivf: Optional[_IVFState] = None
+        self._assign = np.zeros(0, dtype=np.uint32)
+        self._trainer: Optional[threading.Thread] = None
+        # compact で行番号が変わるたびに増やす (学習中のスナップショットの失効判定) / Bumped when rows are renumbered
+        self._epoch = 0
+        super().__init__(base_dir=base_dir, embedding=embedding, dtype=dtype, rescore=rescore)
+        with self._lock:
+            self._ivf = self._load_ivf()
+            self._sync_ivf()
+
+    def add_embeddings(
+        self,
+        chunks: List[ChunkRecord],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        with self._lock:
+            super().add_embeddings(chunks, embeddings, metadatas)
+            self._sync_ivf()
+
+    def compact(self) -> Set[str]:
+        # 行番号が変わるため、入れ替え中の検索は全件検索に落とす / Searches go exact while rows are renumbered
+        with self._lock:
+            self._ivf = None
+            self._epoch += 1
+            try:
+                return super().compact()
+            finally:
+                self._ivf = self._load_ivf()
+                self._sync_ivf()
+
+    def train(self) -> None:
+        """
+        重心を今すぐ学習し直す (完了まで待つ) / Retrain the coarse quantizer now and wait for it.
+        学習中の検索・追加は現行世代のまま続く。
+        """
+        with self._lock:
+            trainer = self._trainer
+        if trainer is not None:
+            trainer.join()
+        while self.count():
+            with self._lock:
+                snap, epoch = self._snapshot, self._epoch
+            if self._train(snap, epoch):
+                return
+
+    def search_by_vectors(
+        self,
+        query_embs: Sequence[List[float]],
+        top_k: int,
+        *,
+        where: Optional[Dict[str, Any]] = None,
+        allowed: Optional[AbstractSet[str]] = None,
+        nprobe: Optional[int] = None,
+    ) -> List[List[Tuple[str, float]]]:
+        # _ivf を前後で 2 回読み、compact と競合したら全件検索 / Re-read _ivf to detect a concurrent compact()
+        ivf = self._ivf
+        snap = self._snapshot
+        if ivf is None or ivf is not self._ivf or ivf.indexed_rows > snap.rows:
+            return super().search_by_vectors(query_embs, top_k, where=where, allowed=allowed)
+        if not query_embs:
+            return []
+        if not snap.rows or top_k <= 0:
+            return [[] for _ in query_embs]
+        queries = self._as_queries(query_embs)
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        excluded = snap.dead
+        if allowed is not None:
+            excluded = snap.dead | ~self._permitted(snap, allowed, where)
+            rows = np.flatnonzero(~excluded)
+            # 許可行が少なければリストを使わず厳密に採点 / Few permitted rows: score them exactly
+            if len(rows) <= max(top_k * 64, 4096):
+                return [
+                    self._rank(snap, q, qn, rows, self._score_rows(snap, q, qn, rows), top_k)
+                    for q, qn in zip(queries, q_norms)
+                ]
+        probes = min(nprobe or self.nprobe or max(8, len(ivf.centroids) // 16), len(ivf.centroids))
+        c_dist = ivf.c_norms[None, :] - 2.0 * (queries @ ivf.centroids.T)
+        # CSR 化されていない末尾は割り当てで絞り、割り当て前の行は全件採点 / Filter the tail by assignment
+        tail = np.asarray(ivf.assign[ivf.indexed_rows :])
+        unassigned = np.arange(ivf.indexed_rows + len(tail), snap.rows, dtype=np.int64)
+        results: List[List[Tuple[str, float]]] = []
+        for qi in range(len(queries)):
+            lists, _ = _smallest(c_dist[qi], probes)
+            rows = np.concatenate(
+                [ivf.list_rows[ivf.offsets[c] : ivf.offsets[c + 1]] for c in lists]
+                + [ivf.indexed_rows + np.flatnonzero(np.isin(tail, lists)), unassigned]
+            )
+            rows = np.sort(rows[~excluded[rows]])
+            dist = self._score_rows(snap, queries[qi], q_norms[qi], rows)
+            results.append(self._rank(snap, queries[qi], q_norms[qi], rows, dist, top_k))
+        return results
+
+    def _score_rows(self, snap: _Snapshot, query: np.ndarray, q_norm: float, rows: np.ndarray) -> np.ndarray:
+        # 指定行 (昇順) を量子化行列で採点 / Score sorted rows against the stored (quantized) matrix
+        dist = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _BLOCK_ROWS):
+            part = rows[start : start + _BLOCK_ROWS]
+            dots = np.asarray(snap.vectors[part], dtype=np.float32) @ query
+            if snap.scales is not None:
+                dots *= snap.scales[part]
+            dist[start : start + len(part)] = snap.norms[part] - 2.0 * dots + q_norm
+        return dist
+
+    def _row_arrays(self, snap: _Snapshot) -> List[Tuple[str, Optional[np.ndarray]]]:
+        arrays = super()._row_arrays(snap)
+        if self._generation and len(self._assign) == snap.rows:
+            arrays.append((self._lists_name(self._generation), self._assign))
+        return arrays
+
+    @property
+    def _generation(self) -> int:
+        return int(self._ivf_meta().get("generation", 0))
+
+    def _sync_ivf(self) -> None:
+        # 学習の開始・未割り当て行の割り当て・リストの再構築 / Start training, assign new rows, rebuild the lists
+        snap = self._snapshot
+        live = self.count()
+        ivf = self._ivf
+        if ivf is None and live < self.min_train:
+            return
+        if ivf is None or live >= 4 * ivf.trained_rows:
+            self._start_training()
+            if ivf is None:
+                return
+        assigned = len(self._assign)
+        if assigned < snap.rows:
+            fresh = self._nearest(ivf, snap, assigned, snap.rows)
+            self._append(self._lists_name(ivf.generation), fresh)
+            self._assign = self._map(self._lists_name(ivf.generation), np.uint32, (snap.rows,))
+            ivf = _IVFState(
+                ivf.generation,
+                ivf.centroids,
+                ivf.offsets,
+                ivf.list_rows,
+                ivf.indexed_rows,
+                ivf.trained_rows,
+                self._assign,
+                ivf.c_norms,
+            )
+            self._ivf = ivf
+        if snap.rows - ivf.indexed_rows > max(4096, snap.rows // 8):
+            self._ivf = self._build_lists(ivf.generation, ivf.centroids, snap.rows, ivf.trained_rows)
+
+    def _start_training(self) -> None:
+        # ロック保持中に呼ぶ。学習中なら何もしない / Called with the lock held; no-op while a trainer runs
+        if self._trainer is not None:
+            return
+        self._trainer = threading.Thread(
+            target=self._train_background, args=(self._snapshot, self._epoch), name="memolla-ivf-train", daemon=True
+        )
+        self._trainer.start()
+
+    def _train_background(self, snap: _Snapshot, epoch: int) -> None:
+        installed = False
+        try:
+            installed = self._train(snap, epoch)
+        except Exception:
+            logger.exception("IVF training failed for %s", self.base_dir.name)
+        finally:
+            with self._lock:
+                self._trainer = None
+                if not installed and epoch != self._epoch:
+                    # 学習中に compact された: 新しい行番号で学習し直す / Rows were renumbered; start over
+                    self._sync_ivf()
+
+    def _train(self, snap: _Snapshot, epoch: int) -> bool:
+        """
+        snap の有効行の標本で k-means (Lloyd 法) を行い、新しい世代として差し替える / Train on a snapshot, then swap.
+        重い計算 (学習と全行の割り当て) はロックの外で行い、学習中に追加された行の割り当てと
+        ファイルの保存・差し替えだけをロック内で行う。学習中に compact された場合は破棄して False を返す。
+        """
+        assert self.dim is not None
+        alive = np.flatnonzero(~snap.dead)
+        nlist = self.nlist or max(1, min(int(4 * np.sqrt(len(alive))), len(alive) // _IVF_MIN_PER_LIST))
+        nlist = min(nlist, len(alive))
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(alive, min(len(alive), nlist * _IVF_TRAIN_PER_LIST), replace=False))
+        data = self._dense_rows(snap, sample)
+        centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+        for _ in range(_IVF_TRAIN_ITERS):
+            labels = _nearest_centroids(centroids, data)
+            counts = np.bincount(labels, minlength=nlist)
+            filled = counts > 0
+            # ラベル順に並べて区間和をとる / Segment sums over rows grouped by label
+            starts = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(counts)[:-1]])
+            grouped = data[np.argsort(labels, kind="stable")]
+            centroids[filled] = np.add.reduceat(grouped, starts[filled], axis=0) / counts[filled, None]
+            # 空のリストは標本点で置き直す / Reseed empty lists from random sample points
+            empty = int((~filled).sum())
+            if empty:
+                centroids[~filled] = data[rng.choice(len(data), empty, replace=False)]
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+        blocks = [
+            _nearest_centroids(centroids, self._dense_rows(snap, np.arange(start, end)), c_norms)
+            for start, end in ((s, min(snap.rows, s + _BLOCK_ROWS)) for s in range(0, snap.rows, _BLOCK_ROWS))
+        ]
+        with self._lock:
+            if epoch != self._epoch:
+                return False
+            # 学習中に追加された行もここで割り当てる / Assign rows appended while training
+            current = self._snapshot
+            if current.rows > snap.rows:
+                rows = np.arange(snap.rows, current.rows)
+                blocks.append(_nearest_centroids(centroids, self._dense_rows(current, rows), c_norms))
+            generation = self._generation + 1
+            with open(self.base_dir / self._lists_name(generation), "wb") as f:
+                for block in blocks:
+                    f.write(block.tobytes())
+            centroids.tofile(self.base_dir / f"centroids-{generation}.f32")
+            # ivf.json の置き換えが確定点 (途中で落ちても旧世代のまま) / Renaming ivf.json commits the new generation
+            tmp = self.base_dir / "ivf.json.tmp"
+            tmp.write_text(json.dumps({"generation": generation, "nlist": nlist, "trained_rows": len(alive)}))
+            os.replace(tmp, self.base_dir / "ivf.json")
+            self._drop_stale(generation)
+            self._assign = self._map(self._lists_name(generation), np.uint32, (current.rows,))
+            self._ivf = self._build_lists(generation, centroids, current.rows, len(alive))
+        logger.info("Trained IVF index %s (%d lists over %d rows)", self.base_dir.name, nlist, len(alive))
+        return True
+
+    def _nearest(self, ivf: _IVFState, snap: _Snapshot, start: int, end: int) -> np.ndarray:
+        return _nearest_centroids(ivf.centroids, self._dense_rows(snap, np.arange(start, end)), ivf.c_norms)
+
+    def _dense_rows(self, snap: _Snapshot, rows: np.ndarray) -> np.ndarray:
+        # 原本があれば原本、なければ量子化値を戻した float32 / float32 originals, or dequantized rows
+        if snap.originals is not None:
+            return np.asarray(snap.originals[rows], dtype=np.float32)
+        matrix = snap.vectors[rows].astype(np.float32)
+        if snap.scales is not None:
+            matrix *= snap.scales[rows, None]
+        return matrix
+
+    def _build_lists(self, generation: int, centroids: np.ndarray, rows: int, trained_rows: int) -> _IVFState:
+        # 割り当てを安定ソートして CSR を作る (各リスト内は行番号順) / CSR via a stable sort of assignments
+        assign = np.asarray(self._assign[:rows])
+        list_rows = np.argsort(assign, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+        return _IVFState(generation, centroids, offsets, list_rows, rows, trained_rows, self._assign)
+
+    def _load_ivf(self) -> Optional[_IVFState]:
+        meta = self._ivf_meta()
+        generation = int(meta.get("generation", 0))
+        self._drop_stale(generation)
+        self._assign = np.zeros(0, dtype=np.uint32)
+        if not generation or self.dim is None:
+            return None
+        centroids = np.fromfile(self.base_dir / f"centroids-{generation}.f32", dtype=np.float32)
+        centroids = centroids.reshape(int(meta["nlist"]), self.dim)
+        rows = self._snapshot.rows
+        name = self._lists_name(generation)
+        assigned = min(self._size(name) // 4, rows)
+        if self._size(name) > assigned * 4:
+            # ベクトル側で切り詰めた行の割り当てを捨てる / Drop assignments of rows trimmed from the vectors
+            os.truncate(self.base_dir / name, assigned * 4)
+        self._assign = self._map(name, np.uint32, (assigned,))
+        return self._build_lists(generation, centroids, assigned, int(meta["trained_rows"]))
+
+    def _ivf_meta(self) -> Dict[str, Any]:
+        path = self.base_dir / "ivf.json"
+        return json.loads(path.read_text()) if path.exists() else {}
+
+    def _drop_stale(self, generation: int) -> None:
+        # 現行世代以外の重心・割り当てファイルを削除 / Remove files of other generations
+        keep = {f"centroids-{generation}.f32", self._lists_name(generation)}
+        for path in self.base_dir.glob("*-*.*"):
+            if path.name.startswith(("centroids-", "lists-")) and path.name not in keep:
+                path.unlink()
+
+    @staticmethod
+    def _lists_name(generation: int) -> str:
+        return f"lists-{generation}.u32"
+
+
+def _keys(chunk_ids: Iterable[str]) -> np.ndarray:
+    # プロセスをまたいで安定な 64bit ハッシュ / 64-bit hash that is stable across processes
+    return _encoded_keys([cid.encode("utf-8") for cid in chunk_ids])
+
+
+def _encoded_keys(encoded: Sequence[bytes]) -> np.ndarray:
+    # ダイジェストを連結して一括で整数化 (リトルエンディアン) / Join digests and reinterpret them at once
+    digests = b"".join(hashlib.blake2b(e, digest_size=8).digest() for e in encoded)
+    return np.frombuffer(digests, dtype="<u8").astype(np.uint64)
+
+
+def _int8_scales(matrix: np.ndarray) -> np.ndarray:
+    # 行ごとの対称量子化スケール / Per-row symmetric quantization scale
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return scales.astype(np.float32)
+
+
+def _nearest_centroids(centroids: np.ndarray, data: np.ndarray, c_norms: Optional[np.ndarray] = None) -> np.ndarray:
+    # 各行に最も近い重心 (距離行列が大きくならないよう分割) / Nearest centroid per row, in bounded blocks
+    if c_norms is None:
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(data), dtype=np.uint32)
+    step = max(1, (1 << 22) // max(1, len(centroids)))
+    for start in range(0, len(data), step):
+        block = data[start : start + step]
+        labels[start : start + len(block)] = np.argmin(c_norms[None, :] - 2.0 * (block @ centroids.T), axis=1)
+    return labels
+
+
+def _smallest(values: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # argpartition で部分選択してから整列 / Partial selection, then sort the winners
+    if len(values) > k:
+        idx = np.argpartition(values, k - 1)[:k]
+    else:
+        idx = np.arange(len(values))
+    idx = idx[np.argsort(values[idx], kind="stable")]
+    return idx, values[idx]
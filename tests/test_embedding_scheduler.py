@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace as NS
+
+import pytest
+
+from memolla import providers
+from memolla.providers import EmbeddingScheduler
+
+
+class FakeClock:
+    # time.monotonic / sleep の代役。sleep は時計を進めるだけ / sleep only advances the clock
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def asleep(self, seconds: float) -> None:
+        self.sleep(seconds)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int, headers: dict | None = None) -> None:
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = NS(headers=headers or {})
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(providers.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(providers.time, "sleep", clock.sleep)
+    monkeypatch.setattr(providers.asyncio, "sleep", clock.asleep)
+    # ジッタを無くしてバックオフを決定的にする / Remove jitter so backoff is deterministic
+    monkeypatch.setattr(providers.random, "random", lambda: 0.0)
+    return clock
+
+
+def _failing(errors: list[Exception]):
+    calls: list[list[str]] = []
+
+    def request(batch: list[str], timeout: float) -> list[list[float]]:
+        calls.append(batch)
+        if errors:
+            raise errors.pop(0)
+        return [[float(len(text))] for text in batch]
+
+    return request, calls
+
+
+def test_retry_acquires_the_rate_limiter_and_honours_retry_after(clock: FakeClock) -> None:
+    scheduler = EmbeddingScheduler(requests_per_minute=1, max_retries=2, backoff=1.0)
+    request, calls = _failing([StatusError(429, {"retry-after": "5"})])
+    assert scheduler.run(["abc"], request) == [[3.0]]
+    assert len(calls) == 2
+    # Retry-After の 5 秒待ってから、rpm=1 のバケットが満ちるまで残り 55 秒待つ
+    # / Wait the 5s Retry-After, then the 55s left until the rpm=1 bucket refills
+    assert clock.sleeps == [5.0, 55.0]
+
+
+def test_async_retry_acquires_the_rate_limiter_and_honours_retry_after_ms(clock: FakeClock) -> None:
+    scheduler = EmbeddingScheduler(requests_per_minute=1, max_retries=2, backoff=1.0)
+    errors: list[Exception] = [StatusError(503, {"retry-after-ms": "2500"})]
+
+    async def request(batch: list[str], timeout: float) -> list[list[float]]:
+        if errors:
+            raise errors.pop(0)
+        return [[1.0] for _ in batch]
+
+    assert asyncio.run(scheduler.arun(["abc"], request)) == [[1.0]]
+    assert clock.sleeps == [2.5, 57.5]
+
+
+def test_short_retry_after_does_not_shorten_backoff(clock: FakeClock) -> None:
+    scheduler = EmbeddingScheduler(max_retries=1, backoff=2.0)
+    request, _ = _failing([StatusError(429, {"retry-after": "0.5"})])
+    scheduler.run(["abc"], request)
+    assert clock.sleeps == [2.0]
+
+
+def test_results_keep_input_order_across_packed_batches() -> None:
+    texts = [f"text {i} " + "x" * (i % 7) * 40 for i in range(40)]
+    seen: list[list[str]] = []
+
+    def request(batch: list[str], timeout: float) -> list[list[float]]:
+        seen.append(batch)
+        return [[float(texts.index(text))] for text in batch]
+
+    scheduler = EmbeddingScheduler(max_batch_tokens=200, max_batch_size=5, concurrency=4)
+    assert scheduler.run(texts, request) == [[float(i)] for i in range(40)]
+    assert len(seen) > 8
+    assert all(len(batch) <= 5 for batch in seen)
+    assert sorted(text for batch in seen for text in batch) == sorted(texts)
+
+
+def test_async_results_keep_input_order_when_batches_finish_out_of_order() -> None:
+    texts = [f"text {i}" for i in range(12)]
+
+    async def request(batch: list[str], timeout: float) -> list[list[float]]:
+        # 後のバッチほど先に終わる / Later batches finish first
+        await asyncio.sleep(0.01 * (12 - texts.index(batch[0])) / 12)
+        return [[float(texts.index(text))] for text in batch]
+
+    scheduler = EmbeddingScheduler(max_batch_size=3, concurrency=4)
+    assert asyncio.run(scheduler.arun(texts, request)) == [[float(i)] for i in range(12)]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503, 408])
+def test_transient_errors_retry_with_exponential_backoff(clock: FakeClock, status: int) -> None:
+    scheduler = EmbeddingScheduler(max_retries=3, backoff=1.0)
+    request, calls = _failing([StatusError(status), StatusError(status)])
+    assert scheduler.run(["abc"], request) == [[3.0]]
+    assert len(calls) == 3
+    assert clock.sleeps == [1.0, 2.0]
+
+
+def test_retries_give_up_after_max_retries(clock: FakeClock) -> None:
+    scheduler = EmbeddingScheduler(max_retries=2, backoff=1.0)
+    request, calls = _failing([StatusError(500) for _ in range(3)])
+    with pytest.raises(StatusError):
+        scheduler.run(["abc"], request)
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 422])
+def test_client_errors_are_not_retried(clock: FakeClock, status: int) -> None:
+    scheduler = EmbeddingScheduler(max_retries=3)
+    request, calls = _failing([StatusError(status)])
+    with pytest.raises(StatusError):
+        scheduler.run(["abc"], request)
+    assert len(calls) == 1
+    assert clock.sleeps == []
+
+
+def test_token_buckets_throttle_requests_and_tokens(clock: FakeClock) -> None:
+    limiter = providers.RateLimiter(requests_per_minute=2)
+    assert [limiter.reserve(1) for _ in range(3)] == [0.0, 0.0, 30.0]
+
+    # 約 34 トークンのテキストを tpm=60 で送ると 2 件目から待たされる / The second ~34-token batch must wait
+    limiter = providers.RateLimiter(tokens_per_minute=60)
+    tokens = providers.estimate_tokens("x" * 100)
+    assert limiter.reserve(tokens) == 0.0
+    assert limiter.reserve(tokens) == pytest.approx(2 * tokens - 60)
+
+
+def test_scheduler_spaces_batches_by_rpm(clock: FakeClock) -> None:
+    scheduler = EmbeddingScheduler(max_batch_size=1, concurrency=1, requests_per_minute=2)
+    request, calls = _failing([])
+    assert scheduler.run(["a", "b", "c", "d"], request) == [[1.0]] * 4
+    assert len(calls) == 4
+    assert clock.sleeps == [30.0, 30.0]
+
+
+def test_provider_without_client_uses_local_embedder(caplog: pytest.LogCaptureFixture) -> None:
+    from memolla.local_embedding import LocalEmbedder
+    from memolla.providers import EmbeddingProvider
+
+    def unexpected(*args: object) -> None:
+        raise AssertionError("scheduler used without a client")
+
+    scheduler = EmbeddingScheduler()
+    scheduler.run = unexpected
+    provider = EmbeddingProvider(client=None, model="text-embedding-3-small", scheduler=scheduler)
+    vectors = provider.embed_texts(["alpha", "beta"])
+    assert isinstance(provider.local, LocalEmbedder)
+    assert len(vectors) == 2 and len(vectors[0]) == provider.local.dim
+    assert provider.embed_query("alpha") == vectors[0]
+    assert "local hashing embedder" in caplog.text
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import pytest
+
+from memolla import Memory
+from memolla.filters import normalize_where
+
+
+@pytest.fixture()
+def mem(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    mem = Memory(db_path=str(tmp_path / "db.sqlite"), search_modes="bm25")
+    yield mem
+    mem.close()
+
+
+@pytest.mark.parametrize("key", ["genre", "ジャンル", 'a"b', "a\\b", "a.b", "tab\t"])
+def test_metadata_filter_matches_any_key(mem: Memory, key: str) -> None:
+    mem.add_knowledge("hit", "apple pie recipe", {key: "x", "n": 1})
+    mem.add_knowledge("miss", "apple cake recipe", {key: "y", "n": 2})
+    assert [r.doc_id for r in mem.search("apple", 5, where={key: "x"})] == ["hit"]
+    assert [r.doc_id for r in mem.search("apple", 5, where={key: {"$in": ["y"]}})] == ["miss"]
+    assert [r.doc_id for r in mem.search("apple", 5, where={"$and": [{key: {"$ne": "y"}}, {"n": {"$lt": 2}}]})] == ["hit"]
+
+
+def test_bool_and_missing_keys(mem: Memory) -> None:
+    mem.add_knowledge("t", "pear tart", {"published": True, "見出し": True})
+    mem.add_knowledge("f", "pear jam", {"published": False})
+    assert [r.doc_id for r in mem.search("pear", 5, where={"published": True})] == ["t"]
+    assert [r.doc_id for r in mem.search("pear", 5, where={"見出し": True})] == ["t"]
+    assert mem.search("pear", 5, where={"absent": "x"}) == []
+
+
+def test_normalize_where_rejects_bad_filters() -> None:
+    with pytest.raises(ValueError, match=r"\[mem\]\[E004\]"):
+        normalize_where({"a": {"$regex": "x"}})
+    with pytest.raises(ValueError, match=r"\[mem\]\[E004\]"):
+        normalize_where({"a": {"$in": []}})
+    assert normalize_where({"a": 1, "b": {"$gt": 2}}) == {"$and": [{"a": {"$eq": 1}}, {"b": {"$gt": 2}}]}
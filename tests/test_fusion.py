@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from memolla.fusion import RRFFusion, ThresholdFusion, WeightedFusion, build_strategy, fuse
+
+
+def _ranked(scores: np.ndarray) -> list[tuple[str, float]]:
+    order = np.argsort(-scores, kind="stable")
+    return [(f"d{i}", float(scores[i])) for i in order]
+
+
+def _correlated_lists(count: int, seed: int) -> tuple[list, list]:
+    # 共通の関連度にノイズを足した BM25 / ベクトルのスコア / Two noisy views of one relevance signal
+    rng = np.random.default_rng(seed)
+    relevance = rng.exponential(size=count)
+    bm25 = relevance * 10 + rng.normal(scale=0.5, size=count)
+    dense = 1 / (1 + np.exp(-relevance - rng.normal(scale=0.3, size=count)))
+    return _ranked(np.maximum(bm25, 0.01)), _ranked(dense)
+
+
+def _run(fusion: ThresholdFusion, full: tuple[list, list]) -> tuple[list, list[int]]:
+    depths = []
+
+    def retrieve() -> tuple[list, list]:
+        depths.append(fusion.depth)
+        return tuple(hits[: fusion.depth] if wanted else [] for hits, wanted in zip(full, fusion.wants))
+
+    lists = retrieve()
+    while fusion.update(lists):
+        lists = retrieve()
+    return fusion.result(), depths
+
+
+def test_rrf_sums_reciprocal_ranks() -> None:
+    strategy = RRFFusion(alpha=0.25, k=10)
+    lists = ([("a", 9.0), ("b", 5.0)], [("b", 0.9), ("c", 0.8), ("a", 0.1)])
+    fused = {hit_id: score for hit_id, score, *_ in fuse(strategy, lists)}
+    assert fused["a"] == pytest.approx(0.75 / 11 + 0.25 / 13)
+    assert fused["b"] == pytest.approx(0.75 / 12 + 0.25 / 11)
+    assert fused["c"] == pytest.approx(0.25 / 12)
+    assert [hit_id for hit_id, *_ in fuse(strategy, lists)] == ["a", "b", "c"]
+
+
+def test_weighted_fusion_normalizes_by_the_best_score() -> None:
+    lists = ([("a", 8.0), ("b", 4.0)], [("b", 0.5), ("c", 0.25)])
+    fused = fuse(WeightedFusion(alpha=0.5), lists)
+    assert fused == [("b", pytest.approx(0.75), 0.5, 1.0), ("a", 0.5, 1.0, None), ("c", 0.25, None, 0.5)]
+
+
+def test_fuse_limit_matches_the_full_sort() -> None:
+    lists = _correlated_lists(300, seed=3)
+    for strategy in (WeightedFusion(0.3), RRFFusion(0.5)):
+        assert fuse(strategy, lists, limit=10) == fuse(strategy, lists)[:10]
+
+
+def test_invalid_strategies_are_rejected() -> None:
+    with pytest.raises(ValueError, match=r"\[mem\]\[E004\]"):
+        build_strategy("borda")
+    with pytest.raises(ValueError, match=r"\[mem\]\[E004\]"):
+        RRFFusion(k=0)
+
+
+@pytest.mark.parametrize("mode", ["weighted", "rrf"])
+@pytest.mark.parametrize("seed", range(5))
+def test_threshold_fusion_stops_early_with_the_exact_top_k(mode: str, seed: int) -> None:
+    full = _correlated_lists(2000, seed)
+    strategy = build_strategy(mode, alpha=0.5)
+    fusion = ThresholdFusion(strategy, 10, start=20, max_depth=2000)
+    merged, depths = _run(fusion, full)
+
+    exact = {hit_id for hit_id, *_ in fuse(strategy, full, limit=10)}
+    assert {hit_id for hit_id, *_ in merged[:10]} == exact
+    assert depths[0] == 20 and depths == sorted(depths)
+    assert fusion.depth < 2000
+    assert fusion.report.rounds == len(depths)
+
+
+def test_threshold_fusion_stops_deepening_an_exhausted_retriever() -> None:
+    bm25 = [(f"d{i}", 10.0 - i / 10) for i in range(5)]
+    dense = [(f"e{i}", 1.0 - i / 1000) for i in range(500)]
+    fusion = ThresholdFusion(WeightedFusion(0.5), 10, start=8, max_depth=400)
+    _, depths = _run(fusion, (bm25, dense))
+    # BM25 は 1 回目で取り尽くし、以降はベクトル側だけを深く取る / Only the dense side is deepened later
+    assert fusion.done[0] and not fusion.wants[0]
+    assert depths == [8, 16, 32, 64, 128, 256, 400]
+    assert fusion.report.candidates_bm25 == 5
+    assert fusion.report.candidates_dense == 400
+
+
+def test_threshold_fusion_keeps_the_deeper_list_when_a_retriever_degrades() -> None:
+    full = _correlated_lists(200, seed=1)
+    fusion = ThresholdFusion(RRFFusion(0.5), 50, start=20, max_depth=200)
+    assert fusion.update((full[0][:20], full[1][:20]))
+    # 2 回目はタイムアウトでベクトル側が空 / The dense side times out on the second round
+    fusion.update((full[0][:40], []))
+    assert fusion.done[1] and not fusion.wants[1]
+    assert fusion.lists[1] == full[1][:20]
+    assert {hit_id for hit_id, *_ in fusion.result()} >= {hit_id for hit_id, _ in full[1][:20]}
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import pytest
+
+from memolla import Memory
+
+_TEXT = "".join(f"paragraph {i} about topic{i}. " for i in range(120))
+
+
+@pytest.fixture(params=[("bm25",), ("bm25", "numpy")], ids=["bm25", "bm25+numpy"])
+def mem(request, tmp_path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    mem = Memory(db_path=str(tmp_path / "db.sqlite"), search_modes=request.param, compaction_threshold=10**9)
+    yield mem
+    mem.close()
+
+
+def _chunk_ids(mem: Memory, doc_id: str) -> list[str]:
+    return [c.chunk_id for c in mem.repo.list_chunks(doc_id)]
+
+
+def _hits(mem: Memory, query: str, top_k: int = 5) -> set[str]:
+    # ベクトル検索は常に近傍を返すため、語が一致した結果だけを見る / Dense search always returns neighbours
+    return {r.chunk_id for r in mem.search(query, top_k) if r.score_bm25}
+
+
+def _docs(mem: Memory, query: str, top_k: int = 5) -> set[str]:
+    return {r.doc_id for r in mem.search(query, top_k) if r.score_bm25}
+
+
+def test_versioned_chunk_ids_never_collide(mem: Memory) -> None:
+    mem.add_knowledge("a", "alpha " * 200)
+    mem.update_knowledge("a", "beta " * 200)
+    # 旧方式では "a" の 2 版目と "a:v2" の初版が同じチャンク ID になった / Used to collide with "a" version 2
+    mem.add_knowledge("a:v2", "gamma " * 200)
+    mem.update_knowledge("a:v2", "delta " * 200)
+    mem.add_knowledge("a:0", "epsilon " * 200)
+    ids = [cid for doc_id in ("a", "a:v2", "a:0") for cid in _chunk_ids(mem, doc_id)]
+    assert len(ids) == len(set(ids))
+    assert all(cid.endswith(":v2") for cid in _chunk_ids(mem, "a"))
+    assert _docs(mem, "gamma") == set()
+    assert _docs(mem, "delta") == {"a:v2"}
+    assert _docs(mem, "epsilon") == {"a:0"}
+
+
+def test_update_keeps_unchanged_chunks_and_hides_replaced_ones(mem: Memory) -> None:
+    mem.add_knowledge("doc", _TEXT)
+    before = _chunk_ids(mem, "doc")
+    edited = _TEXT.replace("topic119.", "replacement119.")
+    doc = mem.update_knowledge("doc", edited)
+    after = _chunk_ids(mem, "doc")
+    assert doc.version == 2
+    assert after[:-1] == before[:-1]
+    assert after[-1] != before[-1] and after[-1].endswith(":v2")
+    assert mem.get_knowledge("doc").corpus == edited
+    assert _hits(mem, "topic119", 3) == set()
+    assert _hits(mem, "replacement119", 1) == {after[-1]}
+    assert set(before[-1:]).isdisjoint(r.chunk_id for r in mem.search("paragraph", 50))
+
+
+def test_delete_hides_immediately_and_compact_purges(mem: Memory) -> None:
+    mem.add_knowledge("gone", "zebra crossing " * 50)
+    mem.add_knowledge("kept", "zebra stripes " * 50)
+    removed = _chunk_ids(mem, "gone")
+    mem.delete_knowledge("gone")
+    assert {r.doc_id for r in mem.search("zebra", 5)} == {"kept"}
+    assert set(removed).isdisjoint(r.chunk_id for r in mem.search("crossing", 5))
+    with pytest.raises(ValueError, match=r"\[mem\]\[E006\]"):
+        mem.get_knowledge("gone")
+
+    assert mem.compact() == len(removed)
+    assert mem.repo.tombstoned_chunk_ids() == set()
+    assert {r.doc_id for r in mem.search("zebra", 5)} == {"kept"}
+    assert mem.compact() == 0
+
+
+def test_readding_a_deleted_doc_does_not_reuse_chunk_ids(mem: Memory) -> None:
+    mem.add_knowledge("doc", "first life " * 50)
+    old = set(_chunk_ids(mem, "doc"))
+    mem.delete_knowledge("doc")
+    mem.add_knowledge("doc", "second life " * 50)
+    assert old.isdisjoint(_chunk_ids(mem, "doc"))
+    assert mem.get_knowledge("doc").version == 2
+    assert _docs(mem, "second") == {"doc"}
+    assert _hits(mem, "first") == set()
+    assert old.isdisjoint(r.chunk_id for r in mem.search("first", 5))
+
+
+def test_stream_failure_rolls_back_everything(mem: Memory) -> None:
+    def pieces():
+        yield "streamed text " * 200
+        raise RuntimeError("source broke")
+
+    with pytest.raises(RuntimeError):
+        mem.add_knowledge_stream("s", pieces(), batch_chunks=1)
+    assert not mem.repo.document_exists("s")
+    assert mem.search("streamed", 5) == []
+    assert mem.repo.list_chunks("s") == []
+    report = mem.add_knowledge_stream("s", ["streamed text " * 200], batch_chunks=2)
+    assert report.chunks == len(_chunk_ids(mem, "s"))
+    assert mem.get_knowledge("s").corpus == "streamed text " * 200
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import logging
+import re
+import threading
+import time
+from types import SimpleNamespace as NS
+
+import pytest
+
+from memolla import Memory
+from memolla.cache import RerankCache
+from memolla.providers import LLMProvider
+from memolla.rerank import LLMReranker
+
+
+class FakeScorer:
+    # 各文章の "score=N" を関連度として返す / Scores each passage by the "score=N" it contains
+    def __init__(self, *, hold: str | None = None, fail: str | None = None) -> None:
+        self.calls: list[list[str]] = []
+        self.hold = hold
+        self.fail = fail
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+        self.chat = NS(completions=NS(create=self.create))
+
+    def create(self, *, model: str, messages: list[dict], **kwargs: object) -> NS:
+        passages = re.findall(r"^\[\d+\] (.*)$", messages[-1]["content"], re.M)
+        with self._lock:
+            self.calls.append(passages)
+        if self.hold is not None and any(self.hold in p for p in passages):
+            self.release.wait(5)
+        if self.fail is not None and any(self.fail in p for p in passages):
+            raise RuntimeError("rate limited")
+        scores = {str(i): int(re.search(r"score=(\d+)", p).group(1)) for i, p in enumerate(passages, 1)}
+        return NS(choices=[NS(message=NS(content=json.dumps(scores)))])
+
+
+def _reranker(client: FakeScorer, **options: object) -> LLMReranker:
+    options.setdefault("cache", RerankCache())
+    return LLMReranker(LLMProvider(client=client, model="judge"), **options)
+
+
+def _candidates(scores: list[int]) -> tuple[list[tuple], dict[str, str]]:
+    # 融合スコアは候補順に下がる / Fused scores decrease in list order
+    candidates = [(f"c{i}", 1.0 - i / 100, None, None) for i in range(len(scores))]
+    texts = {f"c{i}": f"passage {i} score={s}" for i, s in enumerate(scores)}
+    return candidates, texts
+
+
+def test_candidates_are_scored_in_batches_and_sorted_by_llm_score() -> None:
+    client = FakeScorer()
+    reranker = _reranker(client, batch_size=3)
+    candidates, texts = _candidates([2, 9, 4, 7, 0, 5, 8])
+    ranked, report = reranker.rerank("query", candidates, texts)
+
+    assert [len(batch) for batch in sorted(client.calls, key=len, reverse=True)] == [3, 3, 1]
+    assert (report.batches, report.scored, report.unscored, report.partial) == (3, 7, 0, False)
+    assert [hit_id for hit_id, *_ in ranked] == ["c1", "c6", "c3", "c5", "c2", "c0", "c4"]
+    assert ranked[0][1] == pytest.approx(0.9)
+    reranker.close()
+
+
+def test_budget_cut_keeps_unscored_candidates_after_scored_ones() -> None:
+    client = FakeScorer(hold="passage 2 ")
+    reranker = _reranker(client, batch_size=2, budget=0.2)
+    candidates, texts = _candidates([1, 3, 9, 9, 2, 8])
+    ranked, report = reranker.rerank("query", candidates, texts)
+
+    # c2・c3 のバッチは予算内に返らない / The c2/c3 batch misses the budget
+    assert report.partial
+    assert (report.scored, report.unscored) == (4, 2)
+    assert [hit_id for hit_id, *_ in ranked] == ["c5", "c1", "c4", "c0", "c2", "c3"]
+    assert ranked[-2:] == candidates[2:4]
+
+    # 遅れて返った採点は次回キャッシュから使われる / Late scores land in the cache for the next query
+    client.release.set()
+    for _ in range(250):
+        if reranker.cache.stats()["entries"] == 6:
+            break
+        time.sleep(0.02)
+    calls = len(client.calls)
+    ranked, report = reranker.rerank("query", candidates, texts)
+    assert (report.cached, report.scored, report.partial) == (6, 0, False)
+    assert len(client.calls) == calls
+    assert [hit_id for hit_id, *_ in ranked][:2] == ["c2", "c3"]
+    reranker.close()
+
+
+def test_cache_hits_skip_the_llm_and_changed_text_is_rescored() -> None:
+    client = FakeScorer()
+    reranker = _reranker(client, batch_size=8)
+    candidates, texts = _candidates([3, 6, 1])
+    reranker.rerank("query", candidates, texts)
+    assert len(client.calls) == 1
+
+    # 正規化後に同じクエリはキャッシュだけで済む / The normalised query is served from cache
+    ranked, report = reranker.rerank(" query  ", candidates, texts)
+    assert (report.cached, report.scored, report.batches) == (3, 0, 0)
+    assert len(client.calls) == 1
+    assert [hit_id for hit_id, *_ in ranked] == ["c1", "c0", "c2"]
+
+    # 同じ ID で本文が変わった候補だけを採点し直す / Only the id whose text changed is rescored
+    texts["c2"] = "passage 2 rewritten score=10"
+    ranked, report = reranker.rerank("query", candidates, texts)
+    assert (report.cached, report.scored) == (2, 1)
+    assert client.calls[-1] == ["passage 2 rewritten score=10"]
+    assert [hit_id for hit_id, *_ in ranked] == ["c2", "c1", "c0"]
+    reranker.close()
+
+
+def test_failed_batch_keeps_fused_order_and_warns(caplog: pytest.LogCaptureFixture) -> None:
+    client = FakeScorer(fail="passage 0 ")
+    reranker = _reranker(client, batch_size=2)
+    candidates, texts = _candidates([1, 2, 9, 3])
+    with caplog.at_level(logging.WARNING):
+        ranked, report = reranker.rerank("query", candidates, texts)
+    assert report.partial and report.unscored == 2
+    assert [hit_id for hit_id, *_ in ranked] == ["c2", "c3", "c0", "c1"]
+    assert "[mem][W03]" in caplog.text
+    reranker.close()
+
+
+def test_memory_without_llm_client_falls_back_to_fused_order(
+    tmp_path, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    options = {"search_modes": ("bm25", "numpy"), "fusion_adaptive": False}
+    fused = Memory(db_path=str(tmp_path / "fused.sqlite"), **options)
+    mem = Memory(db_path=str(tmp_path / "llm.sqlite"), rerank_mode="llm", **options)
+    for m in (fused, mem):
+        m.add_knowledge("a", "apple banana")
+        m.add_knowledge("b", "apple cherry apple")
+        m.add_knowledge("c", "durian")
+    with caplog.at_level(logging.WARNING):
+        results = mem.search("apple", 3)
+        mem.search("apple", 3)
+    assert [r.chunk_id for r in results] == [r.chunk_id for r in fused.search("apple", 3)]
+    assert caplog.text.count("[mem][W03]") == 1
+    fused.close()
+    mem.close()
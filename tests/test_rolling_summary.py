@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import threading
+import time
+from types import SimpleNamespace as NS
+
+import pytest
+
+from memolla import Memory
+from memolla.providers import FOLD_PROMPT
+
+
+class FakeLLMClient:
+    # chat.completions.create だけを持つ OpenAI クライアントの代役 / Stand-in exposing chat.completions.create
+    def __init__(self) -> None:
+        self.calls: list[dict] = []
+        self._lock = threading.Lock()
+        self.chat = NS(completions=NS(create=self.create))
+
+    def create(self, *, model: str, messages: list[dict], **kwargs: object) -> NS:
+        with self._lock:
+            self.calls.append(
+                {
+                    "prompt": messages[0]["content"],
+                    "text": messages[-1]["content"],
+                    "thread": threading.current_thread().name,
+                }
+            )
+            content = f"summary-{len(self.calls)}"
+        return NS(choices=[NS(message=NS(content=content))])
+
+    def folds(self) -> list[dict]:
+        return [c for c in self.calls if c["prompt"] == FOLD_PROMPT]
+
+
+@pytest.fixture(autouse=True)
+def _offline(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+
+def _memory(db_path, client: FakeLLMClient, **options: object) -> Memory:
+    mem = Memory(db_path=str(db_path), search_modes="bm25", **options)
+    mem.llm.client = client
+    return mem
+
+
+def _wait_for_summary(mem: Memory, session_id: str, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        record = mem.repo.get_session_summary(session_id)
+        if record is not None:
+            return record
+        time.sleep(0.01)
+    raise AssertionError("rolling summary was not written")
+
+
+def test_watermark_and_message_count_after_two_folds(tmp_path) -> None:
+    client = FakeLLMClient()
+    mem = _memory(tmp_path / "db.sqlite", client, summary_fold_messages=1000)
+    for i in range(3):
+        mem.add_conversation("s1", "user", f"first batch {i}")
+    first = mem.refresh_summary("s1")
+    assert first is not None
+    assert (first.last_message_id, first.message_count) == (3, 3)
+
+    mem.add_conversation("s1", "assistant", "second batch 0")
+    mem.add_conversation("s1", "user", "second batch 1")
+    second = mem.refresh_summary("s1")
+    assert second is not None
+    assert (second.last_message_id, second.message_count) == (5, 5)
+    assert second.summary == mem.repo.get_session_summary("s1").summary
+
+    # 2 回目は前回の要約と新しい発言だけを畳み込む / The second fold sees the old summary plus new messages only
+    fold = client.folds()[-1]
+    assert first.summary in fold["text"]
+    assert "second batch 1" in fold["text"]
+    assert "first batch" not in fold["text"]
+    mem.close()
+
+
+def test_create_summary_returns_stored_summary_without_rereading(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    client = FakeLLMClient()
+    mem = _memory(tmp_path / "db.sqlite", client, summary_fold_messages=1000)
+    for i in range(4):
+        mem.add_conversation("s1", "user", f"message {i}")
+    stored = mem.refresh_summary("s1")
+    calls = len(client.calls)
+
+    def unexpected(*args: object, **kwargs: object) -> None:
+        raise AssertionError("create_summary re-read the whole session")
+
+    monkeypatch.setattr(mem.repo, "get_session_messages", unexpected)
+    assert mem.create_summary(session_id="s1") == stored.summary
+    assert len(client.calls) == calls
+    mem.close()
+
+
+def test_create_summary_folds_only_pending_messages(tmp_path) -> None:
+    client = FakeLLMClient()
+    mem = _memory(tmp_path / "db.sqlite", client, summary_fold_messages=1000)
+    mem.add_conversation("s1", "user", "old message")
+    mem.refresh_summary("s1")
+    mem.add_conversation("s1", "user", "new message")
+    summary = mem.create_summary(session_id="s1")
+    assert summary == mem.repo.get_session_summary("s1").summary
+    assert "old message" not in client.folds()[-1]["text"]
+    assert mem.repo.get_session_summary("s1").message_count == 2
+    mem.close()
+
+
+def test_message_threshold_folds_in_background(tmp_path) -> None:
+    client = FakeLLMClient()
+    mem = _memory(tmp_path / "db.sqlite", client, summary_fold_messages=3, summary_fold_tokens=100000)
+    mem.add_conversation("s1", "user", "one")
+    mem.add_conversation("s1", "user", "two")
+    assert mem.repo.get_session_summary("s1") is None
+    assert client.calls == []
+
+    mem.add_conversation("s1", "user", "three")
+    record = _wait_for_summary(mem, "s1")
+    assert (record.last_message_id, record.message_count) == (3, 3)
+    assert {c["thread"] for c in client.calls} == {"memolla-summary"}
+    mem.close()
+
+
+def test_token_threshold_folds_in_background(tmp_path) -> None:
+    client = FakeLLMClient()
+    mem = _memory(tmp_path / "db.sqlite", client, summary_fold_messages=1000, summary_fold_tokens=50)
+    mem.add_conversation("s1", "user", "short")
+    assert mem.repo.get_session_summary("s1") is None
+    # 約 300 バイト = 約 100 トークンで閾値を超える / ~300 bytes is ~100 estimated tokens
+    mem.add_conversation("s1", "user", "long " * 60)
+    record = _wait_for_summary(mem, "s1")
+    assert record.message_count == 2
+    mem.close()
+
+
+def test_fold_resumes_from_watermark_after_restart(tmp_path) -> None:
+    db_path = tmp_path / "db.sqlite"
+    mem = _memory(db_path, FakeLLMClient(), summary_fold_messages=1000)
+    mem.add_conversation("s1", "user", "before restart")
+    before = mem.refresh_summary("s1")
+    mem.close()
+
+    client = FakeLLMClient()
+    mem = _memory(db_path, client, summary_fold_messages=1000)
+    assert mem.repo.get_session_summary("s1") == before
+    mem.add_conversation("s1", "user", "after restart")
+    after = mem.refresh_summary("s1")
+    assert (after.last_message_id, after.message_count) == (2, 2)
+    assert len(client.calls) == 1
+    assert before.summary in client.calls[0]["text"]
+    assert "before restart" not in client.calls[0]["text"]
+    mem.close()
+
+
+def test_refresh_without_client_keeps_stored_summary(tmp_path) -> None:
+    db_path = tmp_path / "db.sqlite"
+    mem = _memory(db_path, FakeLLMClient(), summary_fold_messages=1000)
+    mem.add_conversation("s1", "user", "hello")
+    stored = mem.refresh_summary("s1")
+    mem.llm.client = None
+    mem.add_conversation("s1", "user", "not folded")
+    assert mem.refresh_summary("s1") == stored
+    assert mem.refresh_summary("unknown") is None
+    mem.close()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from memolla import AsyncMemory, Memory
+
+
+@pytest.fixture(autouse=True)
+def _offline(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+
+OPTIONS = {"search_modes": ("bm25", "numpy"), "query_cache": True}
+
+
+@pytest.fixture
+def mem(tmp_path):
+    mem = Memory(db_path=str(tmp_path / "db.sqlite"), **OPTIONS)
+    mem.add_knowledge("a", "alpha beta gamma")
+    mem.add_knowledge("b", "delta epsilon")
+    yield mem
+    mem.close()
+
+
+def _cached(mem: Memory, query: str) -> bool:
+    return mem.query_cache.get(mem._query_cache_key(query, 5)) is not None
+
+
+def test_failed_dense_search_is_not_cached(mem: Memory, monkeypatch: pytest.MonkeyPatch) -> None:
+    def broken(*args: object, **kwargs: object) -> None:
+        raise RuntimeError("index offline")
+
+    monkeypatch.setattr(mem.dense_index, "search", broken)
+    assert [r.doc_id for r in mem.search("alpha", 5)] == ["a"]
+    assert not _cached(mem, "alpha")
+    assert mem.stats()["degraded_searches"] == 1
+
+
+def test_degradation_elsewhere_does_not_block_caching(mem: Memory, monkeypatch: pytest.MonkeyPatch) -> None:
+    search = mem.dense_index.search
+
+    def concurrent_degradation(*args: object, **kwargs: object):
+        # 別の検索がこの検索の最中に縮退した状況 / Another search degrades while this one runs
+        mem._mark_degraded()
+        return search(*args, **kwargs)
+
+    monkeypatch.setattr(mem.dense_index, "search", concurrent_degradation)
+    mem.search("alpha", 5)
+    assert _cached(mem, "alpha")
+    assert mem.stats()["degraded_searches"] == 1
+
+
+def test_async_failed_dense_search_is_not_cached(tmp_path) -> None:
+    async def run() -> None:
+        async with AsyncMemory(db_path=str(tmp_path / "db.sqlite"), **OPTIONS) as amem:
+            await amem.add_knowledge("a", "alpha beta gamma")
+            await amem.search("delta", 5)
+
+            async def broken(*args: object, **kwargs: object) -> None:
+                raise RuntimeError("index offline")
+
+            amem._dense_search = broken
+            assert [r.doc_id for r in await amem.search("alpha", 5)] == ["a"]
+            assert not _cached(amem.memory, "alpha")
+            assert _cached(amem.memory, "delta")
+            assert amem.memory.stats()["degraded_searches"] == 1
+
+    asyncio.run(run())
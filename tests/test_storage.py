@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import sqlite3
+
+import pytest
+
+from memolla import storage
+from memolla.storage import SQLiteRepository
+
+
+def _columns(path, table: str) -> set[str]:
+    conn = sqlite3.connect(path)
+    try:
+        return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    finally:
+        conn.close()
+
+
+def _user_version(path) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_failed_migration_step_is_rolled_back(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = tmp_path / "db.sqlite"
+    SQLiteRepository(path).close()
+    version = _user_version(path)
+
+    # ALTER の直後に失敗する段 (途中終了の再現) / A step that fails right after an ALTER, like a crash mid-step
+    broken = ("ALTER TABLE messages ADD COLUMN extra INTEGER", "SELECT * FROM no_such_table")
+    monkeypatch.setattr(storage, "_MIGRATIONS", [*storage._MIGRATIONS, broken])
+    with pytest.raises(sqlite3.OperationalError):
+        SQLiteRepository(path)
+    assert "extra" not in _columns(path, "messages")
+    assert _user_version(path) == version
+
+    # 同じ段を直せば再度開けて適用される / Reopening with a working step applies it once
+    monkeypatch.setattr(storage, "_MIGRATIONS", [*storage._MIGRATIONS[:-1], broken[:1]])
+    SQLiteRepository(path).close()
+    assert "extra" in _columns(path, "messages")
+    assert _user_version(path) == version + 1
+    SQLiteRepository(path).close()
+    assert _user_version(path) == version + 1
+
+
+def test_new_database_gets_every_migration(tmp_path) -> None:
+    path = tmp_path / "db.sqlite"
+    SQLiteRepository(path).close()
+    assert _user_version(path) == len(storage._MIGRATIONS)
+    assert {"created_epoch", "indexed"} <= _columns(path, "messages")
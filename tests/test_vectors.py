@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from memolla.local_embedding import LocalEmbedder
+from memolla.models import ChunkRecord
+from memolla.providers import EmbeddingProvider
+
+
+def _embedding() -> EmbeddingProvider:
+    return EmbeddingProvider(client=None, model="local", local=LocalEmbedder(dim=16))
+
+
+def _chunks(count: int, prefix: str = "c") -> list[ChunkRecord]:
+    return [ChunkRecord(chunk_id=f"{prefix}{i}", doc_id=f"d{i}", seq=0, text="") for i in range(count)]
+
+
+def _vectors(count: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def test_dense_index_requeries_until_top_k_live_hits(tmp_path) -> None:
+    pytest.importorskip("chromadb")
+    from memolla.indexes import DenseIndex
+
+    index = DenseIndex(persist_dir=str(tmp_path / "chroma"), embedding=_embedding(), collection="chunks")
+    vectors = _vectors(60)
+    index.add_embeddings(_chunks(60), vectors.tolist())
+    query = vectors[0].tolist()
+    nearest = [cid for cid, _ in index.search_by_vector(query, 40)]
+
+    # 近い順に 30 件を削除すると、初回の多め取得 (top_k * 2) では生存件数が足りない
+    # / Tombstoning the 30 nearest defeats the initial top_k * 2 over-fetch
+    index.delete(nearest[:30])
+    hits = [cid for cid, _ in index.search_by_vector(query, 5)]
+    assert hits == nearest[30:35]
+
+    # 生存件数が top_k 未満なら残り全部を返す / Fewer live rows than top_k returns all of them
+    index.delete(f"c{i}" for i in range(60) if f"c{i}" not in nearest[:33])
+    assert [cid for cid, _ in index.search_by_vector(query, 10)] == nearest[30:33]
+
+
+def _exact(vectors: np.ndarray, query: np.ndarray, top_k: int, skip: set[int] = frozenset()) -> list[str]:
+    dist = ((vectors - query) ** 2).sum(axis=1)
+    order = [int(i) for i in np.argsort(dist, kind="stable") if int(i) not in skip]
+    return [f"c{i}" for i in order[:top_k]]
+
+
+def _numpy_index(path, **options: object):
+    from memolla.vectors import NumpyVectorIndex
+
+    return NumpyVectorIndex(base_dir=path, embedding=_embedding(), **options)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_numpy_index_matches_exact_search(tmp_path, dtype: str) -> None:
+    vectors = _vectors(300)
+    index = _numpy_index(tmp_path / "vec", dtype=dtype)
+    index.add_embeddings(_chunks(300), vectors.tolist())
+    queries = _vectors(5, seed=1)
+    for query, hits in zip(queries, index.search_by_vectors(queries.tolist(), 10)):
+        assert [cid for cid, _ in hits] == _exact(vectors, query, 10)
+        assert all(a[1] >= b[1] for a, b in zip(hits, hits[1:]))
+
+
+def test_numpy_delete_hides_rows_and_compact_purges_them(tmp_path) -> None:
+    vectors = _vectors(50)
+    index = _numpy_index(tmp_path / "vec")
+    index.add_embeddings(_chunks(50), vectors.tolist())
+    removed = {f"c{i}" for i in range(0, 50, 3)}
+    index.delete(removed)
+    assert index.count() == 50 - len(removed)
+    skip = {int(cid[1:]) for cid in removed}
+    assert [cid for cid, _ in index.search_by_vector(vectors[0].tolist(), 10)] == _exact(vectors, vectors[0], 10, skip)
+
+    size = (tmp_path / "vec" / "vectors.bin").stat().st_size
+    assert index.compact() == removed
+    assert (tmp_path / "vec" / "vectors.bin").stat().st_size == size * (50 - len(removed)) // 50
+    assert index.compact() == set()
+    assert [cid for cid, _ in index.search_by_vector(vectors[0].tolist(), 10)] == _exact(vectors, vectors[0], 10, skip)
+
+    # 再オープン後も削除は反映されたまま / Deletions survive a reopen
+    reopened = _numpy_index(tmp_path / "vec")
+    assert reopened.count() == 50 - len(removed)
+    assert [cid for cid, _ in reopened.search_by_vector(vectors[1].tolist(), 10)] == _exact(vectors, vectors[1], 10, skip)
+
+
+def test_numpy_readding_an_id_supersedes_the_old_row(tmp_path) -> None:
+    vectors = _vectors(20)
+    index = _numpy_index(tmp_path / "vec")
+    index.add_embeddings(_chunks(20), vectors.tolist())
+    index.add_embeddings(_chunks(1), [(-vectors[0]).tolist()])
+    assert index.count() == 20
+    hits = index.search_by_vector((-vectors[0]).tolist(), 1)
+    assert hits[0][0] == "c0" and hits[0][1] == pytest.approx(1.0)
+    assert "c0" not in [cid for cid, _ in index.search_by_vector(vectors[0].tolist(), 3)]
+    assert _numpy_index(tmp_path / "vec").count() == 20
+
+
+def test_numpy_permitted_mask_is_reused_per_where_clause(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    vectors = _vectors(40)
+    index = _numpy_index(tmp_path / "vec")
+    index.add_embeddings(_chunks(40), vectors.tolist())
+    lookups: list[int] = []
+    rows_for = index._rows_for
+    monkeypatch.setattr(index, "_rows_for", lambda snap, ids: lookups.append(1) or rows_for(snap, ids))
+
+    where = {"genre": "a"}
+    allowed = frozenset(f"c{i}" for i in range(0, 40, 2))
+    query = vectors[1].tolist()
+    first = index.search_by_vector(query, 5, where=where, allowed=allowed)
+    assert {cid for cid, _ in first} <= allowed
+    assert index.search_by_vector(query, 5, where=where, allowed=allowed) == first
+    assert len(lookups) == 1
+
+    # 別の許可集合・別の where・行の追加ではマスクを作り直す / New sets, clauses or rows rebuild the mask
+    index.search_by_vector(query, 5, where=where, allowed=set(allowed))
+    assert len(lookups) == 2
+    index.search_by_vector(query, 5, where={"genre": "b"}, allowed=allowed)
+    assert len(lookups) == 3
+    index.add_embeddings(_chunks(1, prefix="new"), [vectors[1].tolist()])
+    hits = index.search_by_vector(query, 5, where=where, allowed=allowed)
+    assert len(lookups) == 4
+    assert "new0" not in {cid for cid, _ in hits}
+
+    # where なしでは毎回照合する / Without where nothing is cached
+    index.search_by_vector(query, 5, allowed=allowed)
+    index.search_by_vector(query, 5, allowed=allowed)
+    assert len(lookups) == 6
+
+
+def _clustered(count: int, *, dim: int = 16, clusters: int = 40, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)) * 4
+    points = centers[rng.integers(clusters, size=count)] + rng.standard_normal((count, dim))
+    return points.astype(np.float32)
+
+
+def _ivf_index(path, **options: object):
+    from memolla.vectors import IVFVectorIndex
+
+    options.setdefault("min_train", 1000)
+    return IVFVectorIndex(base_dir=path, embedding=_embedding(), **options)
+
+
+def _wait_for_training(index) -> None:
+    trainer = index._trainer
+    if trainer is not None:
+        trainer.join(10)
+
+
+def _ids(hits: list) -> list[str]:
+    return [cid for cid, _ in hits]
+
+
+def test_ivf_recall_against_flat_index(tmp_path) -> None:
+    vectors = _clustered(3000)
+    flat = _numpy_index(tmp_path / "flat")
+    ivf = _ivf_index(tmp_path / "ivf")
+    for index in (flat, ivf):
+        index.add_embeddings(_chunks(3000), vectors.tolist())
+    _wait_for_training(ivf)
+    assert ivf._ivf is not None
+
+    queries = _clustered(50, seed=1).tolist()
+    found = total = 0
+    for exact, approx in zip(flat.search_by_vectors(queries, 10), ivf.search_by_vectors(queries, 10)):
+        found += len(set(_ids(exact)) & set(_ids(approx)))
+        total += len(exact)
+    assert found / total >= 0.9
+    # 全リストを探索すれば厳密検索と一致 / Probing every list is exact
+    everything = ivf.search_by_vectors(queries, 10, nprobe=len(ivf._ivf.centroids))
+    assert [_ids(h) for h in everything] == [_ids(h) for h in flat.search_by_vectors(queries, 10)]
+
+
+def test_ivf_trains_in_the_background_and_commits_with_ivf_json(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    import json
+    import threading
+
+    index = _ivf_index(tmp_path / "ivf")
+    threads: list[str] = []
+    train = index._train
+
+    def recording_train(snap, epoch: int) -> bool:
+        threads.append(threading.current_thread().name)
+        return train(snap, epoch)
+
+    monkeypatch.setattr(index, "_train", recording_train)
+
+    vectors = _clustered(999)
+    index.add_embeddings(_chunks(999), vectors.tolist())
+    assert index._trainer is None and not (tmp_path / "ivf" / "ivf.json").exists()
+
+    index.add_embeddings(_chunks(1, prefix="x"), vectors[:1].tolist())
+    _wait_for_training(index)
+    assert threads == ["memolla-ivf-train"]
+    meta = json.loads((tmp_path / "ivf" / "ivf.json").read_text())
+    assert (meta["generation"], meta["trained_rows"]) == (1, 1000)
+    assert (tmp_path / "ivf" / "centroids-1.f32").exists()
+    assert (tmp_path / "ivf" / "lists-1.u32").stat().st_size == 1000 * 4
+    assert index._ivf.generation == 1 and index._ivf.indexed_rows == 1000
+
+
+def test_ivf_swaps_generations_after_background_retraining(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    import threading
+
+    vectors = _clustered(5000)
+    index = _ivf_index(tmp_path / "ivf")
+    index.add_embeddings(_chunks(1000), vectors[:1000].tolist())
+    _wait_for_training(index)
+
+    release = threading.Event()
+    train = index._train
+    monkeypatch.setattr(index, "_train", lambda snap, epoch: release.wait(10) and train(snap, epoch))
+    # 学習時の 4 倍に達すると再学習が始まる / Reaching 4x the trained rows starts retraining
+    index.add_embeddings(_chunks(4000, prefix="b"), vectors[1000:].tolist())
+    assert index._trainer is not None
+
+    # 学習中も現行世代で検索し、追加された行も割り当て済み / The current generation keeps serving, appends included
+    assert index._ivf.generation == 1
+    assert len(index._assign) == 5000
+    assert _ids(index.search_by_vector(vectors[4500].tolist(), 1)) == ["b3500"]
+    index.add_embeddings(_chunks(10, prefix="late"), vectors[:10].tolist())
+
+    release.set()
+    _wait_for_training(index)
+    assert index._ivf.generation == 2
+    assert index._ivf.trained_rows == 5000
+    # 学習中に追加された行も新しい世代に割り当てられる / Rows appended during training are assigned too
+    assert index._ivf.indexed_rows == 5010 and len(index._assign) == 5010
+    assert sorted(p.name for p in (tmp_path / "ivf").glob("*-*.*")) == ["centroids-2.f32", "lists-2.u32"]
+    assert "late3" in _ids(index.search_by_vector(vectors[3].tolist(), 3))
+
+
+def test_ivf_searches_the_unindexed_and_unassigned_tail(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    vectors = _clustered(1000)
+    index = _ivf_index(tmp_path / "ivf")
+    index.add_embeddings(_chunks(1000), vectors.tolist())
+    _wait_for_training(index)
+
+    # CSR に入っていない末尾の行は割り当てで絞る / Tail rows are filtered by their assignment
+    far = np.full(16, 40.0, dtype=np.float32)
+    index.add_embeddings(_chunks(1, prefix="tail"), [far.tolist()])
+    assert index._ivf.indexed_rows == 1000 and len(index._assign) == 1001
+    assert _ids(index.search_by_vector(far.tolist(), 1)) == ["tail0"]
+
+    # 割り当て前の行は全件採点される / Rows without an assignment are always scored
+    monkeypatch.setattr(index, "_sync_ivf", lambda: None)
+    index.add_embeddings(_chunks(1, prefix="raw"), [(-far).tolist()])
+    assert len(index._assign) == 1001
+    assert _ids(index.search_by_vector((-far).tolist(), 1)) == ["raw0"]
+
+
+def test_ivf_compaction_rewrites_assignments(tmp_path) -> None:
+    vectors = _clustered(2000)
+    index = _ivf_index(tmp_path / "ivf")
+    index.add_embeddings(_chunks(2000), vectors.tolist())
+    _wait_for_training(index)
+    epoch = index._epoch
+
+    removed = {f"c{i}" for i in range(0, 2000, 2)}
+    index.delete(removed)
+    assert index.compact() == removed
+    assert index._epoch == epoch + 1
+    assert index._ivf.generation == 1
+    assert index._ivf.indexed_rows == 1000 and len(index._assign) == 1000
+    assert (tmp_path / "ivf" / "lists-1.u32").stat().st_size == 1000 * 4
+
+    nprobe = len(index._ivf.centroids)
+    skip = {int(cid[1:]) for cid in removed}
+    for q in (1, 3, 1999):
+        hits = index.search_by_vectors([vectors[q].tolist()], 5, nprobe=nprobe)[0]
+        assert _ids(hits) == _exact(vectors, vectors[q], 5, skip)
+    reopened = _ivf_index(tmp_path / "ivf")
+    assert reopened.count() == 1000 and reopened._ivf.indexed_rows == 1000
+    assert _ids(reopened.search_by_vectors([vectors[3].tolist()], 5, nprobe=nprobe)[0]) == _exact(vectors, vectors[3], 5, skip)
+
+
+def test_ivf_discards_training_that_raced_a_compaction(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    import threading
+
+    vectors = _clustered(1000)
+    index = _ivf_index(tmp_path / "ivf")
+    release = threading.Event()
+    train = index._train
+    monkeypatch.setattr(index, "_train", lambda snap, epoch: release.wait(10) and train(snap, epoch))
+    index.add_embeddings(_chunks(1000), vectors.tolist())
+    index.delete(["c0"])
+    index.compact()
+    release.set()
+    _wait_for_training(index)
+    # 古い行番号で学習した結果は破棄される / The stale generation is never committed
+    assert index._ivf is None
+    assert not (tmp_path / "ivf" / "ivf.json").exists()
+    assert not list((tmp_path / "ivf").glob("lists-*"))
+
+
+def test_ivf_reopen_ignores_a_pending_generation(tmp_path) -> None:
+    vectors = _clustered(1200)
+    chunks = _chunks(1200)
+    index = _ivf_index(tmp_path / "ivf")
+    index.add_embeddings(chunks[:1000], vectors[:1000].tolist())
+    _wait_for_training(index)
+    index.add_embeddings(chunks[1000:], vectors[1000:].tolist())
+
+    # 新しい世代のファイルを書いた後、ivf.json を置き換える前に落ちた状態 / Crash before ivf.json was replaced
+    base = tmp_path / "ivf"
+    (base / "centroids-2.f32").write_bytes(b"\0" * 64)
+    (base / "lists-2.u32").write_bytes(b"\0" * 16)
+    (base / "ivf.json.tmp").write_text('{"generation": 2, "nlist": 1, "trained_rows": 1200}')
+
+    reopened = _ivf_index(base)
+    assert reopened._ivf.generation == 1
+    assert not (base / "centroids-2.f32").exists() and not (base / "lists-2.u32").exists()
+    assert len(reopened._assign) == 1200
+    nprobe = len(reopened._ivf.centroids)
+    for q in (5, 1100):
+        assert _ids(reopened.search_by_vectors([vectors[q].tolist()], 5, nprobe=nprobe)[0]) == _exact(vectors, vectors[q], 5)